@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Benchmark of the batch query API (PDFLocConverter.pdfloc_pairs_to_bboxes()) against
+converting the PDFLoc pairs one by one.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from pdfloc_converter.converter import PDFLocConverter
+from pdfloc_converter.pdfloc import PDFLocPair
+from synthetic_pdf import write_synthetic_pdf, line_keyword
+
+__author__ = 'Martin Pecka'
+
+
+def random_pdfloc_pairs(count, pages, lines, seed=0, graphics=0, form_uses=1):
+    """
+    Create random highlights spanning up to 5 lines; many of them overlap.
+
+    The graphics and form_uses parameters have to be those the synthetic document was created with.
+    """
+    rnd = random.Random(seed)
+    pairs = []
+    for _ in xrange(count):
+        page = rnd.randrange(pages)
+        start_line = rnd.randrange(lines)
+        end_line = min(lines - 1, start_line + rnd.randrange(5))
+        pairs.append(PDFLocPair(
+            "#pdfloc(abcd,%i,%i,0,%i,0,0,1)" % (page, line_keyword(start_line, graphics, form_uses), rnd.randrange(4)),
+            "#pdfloc(abcd,%i,%i,1,%i,0,0,1)" % (page, line_keyword(end_line, graphics, form_uses), rnd.randrange(4))
+        ))
+    return pairs
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--lines", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    (fd, path) = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        write_synthetic_pdf(path, args.pages, args.lines)
+
+        converter = PDFLocConverter(path)
+        converter.parse_document()
+
+        pairs = random_pdfloc_pairs(args.queries, args.pages, args.lines)
+
+        best_loop = best_batch = None
+        for _ in xrange(args.repeat):
+            start = time.time()
+            loop_results = [converter.pdfloc_pair_to_bboxes(pair) for pair in pairs]
+            elapsed = time.time() - start
+            best_loop = elapsed if best_loop is None else min(best_loop, elapsed)
+
+            start = time.time()
+            batch_results = converter.pdfloc_pairs_to_bboxes(pairs)
+            elapsed = time.time() - start
+            best_batch = elapsed if best_batch is None else min(best_batch, elapsed)
+
+        assert [map(str, bboxes) for bboxes in loop_results] == [map(str, bboxes) for bboxes in batch_results]
+
+        print >>sys.stderr, "%i queries on %i pages" % (args.queries, args.pages)
+        print >>sys.stderr, "per-pair loop: %.3f s (%.1f us/query)" % (best_loop, 1e6 * best_loop / args.queries)
+        print >>sys.stderr, "batch:         %.3f s (%.1f us/query)" % (best_batch, 1e6 * best_batch / args.queries)
+    finally:
+        os.remove(path)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Benchmark of parsing an export of PDFLoc pair lines in bulk (PDFLocBatch) against parsing
+the lines one PDFLocPair at a time, and of converting the parsed queries.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from pdfloc_converter.converter import PDFLocConverter
+from pdfloc_converter.pdfloc import PDFLocPair, PDFLocBatch, PDFLocColumns
+from bench_batch_queries import random_pdfloc_pairs
+from synthetic_pdf import write_synthetic_pdf
+
+__author__ = 'Martin Pecka'
+
+
+def parse_pairs(text):
+    """
+    Parse the lines one PDFLocPair at a time, the way the command line parses its jobs.
+    """
+    pairs = []
+    for line in text.splitlines():
+        (start, end) = line.split(";", 1)
+        parts = end.strip().split(" ", 1)
+        pairs.append(PDFLocPair(start.strip(), parts[0], parts[1] if len(parts) > 1 else None))
+    return pairs
+
+
+def pairs_size(pairs):
+    """
+    Return the memory occupied by the PDFLocPairs and their PDFLocs (without the comments).
+    """
+    size = sys.getsizeof(pairs)
+    for pair in pairs:
+        size += sys.getsizeof(pair)
+        for pdfloc in (pair.start, pair.end):
+            size += sys.getsizeof(pdfloc) + sys.getsizeof(pdfloc.hash)
+    return size
+
+
+def batch_size(batch):
+    """
+    Return the memory occupied by the columns of the batch (without the comments).
+    """
+    size = sys.getsizeof(batch.comments) + sys.getsizeof(batch.line_numbers)
+    for columns in (batch.start, batch.end):
+        for name in PDFLocColumns.__slots__:
+            size += sys.getsizeof(getattr(columns, name))
+    return size
+
+
+def best_time(function, repeat):
+    best = None
+    result = None
+    for _ in xrange(repeat):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, result)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--lines", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    text = "\n".join("%s Highlight %i" % (str(pair), i) for (i, pair) in
+                     enumerate(random_pdfloc_pairs(args.queries, args.pages, args.lines))) + "\n"
+
+    (pairs_time, pairs) = best_time(lambda: parse_pairs(text), args.repeat)
+    (batch_time, batch) = best_time(lambda: PDFLocBatch.parse_text(text), args.repeat)
+
+    assert len(batch.errors) == 0
+    assert list(batch) == pairs
+
+    print >>sys.stderr, "parsing %i lines" % args.queries
+    print >>sys.stderr, "per-pair: %.3f s (%.2f us/line)" % (pairs_time, 1e6 * pairs_time / args.queries)
+    print >>sys.stderr, "bulk:     %.3f s (%.2f us/line)" % (batch_time, 1e6 * batch_time / args.queries)
+    print >>sys.stderr, "memory: PDFLocPairs %i B, PDFLocBatch %i B" % (pairs_size(pairs), batch_size(batch))
+
+    (fd, path) = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        write_synthetic_pdf(path, args.pages, args.lines)
+
+        converter = PDFLocConverter(path)
+        converter.parse_document()
+
+        (pairs_time, pairs_results) = best_time(lambda: converter.pdfloc_pairs_to_bboxes(pairs), args.repeat)
+        (batch_time, batch_results) = best_time(lambda: converter.pdfloc_pairs_to_bboxes(batch), args.repeat)
+
+        assert pairs_results == batch_results
+
+        print >>sys.stderr, "converting %i queries on %i pages" % (args.queries, args.pages)
+        print >>sys.stderr, "PDFLocPairs: %.3f s (%.2f us/query)" % (pairs_time, 1e6 * pairs_time / args.queries)
+        print >>sys.stderr, "PDFLocBatch: %.3f s (%.2f us/query)" % (batch_time, 1e6 * batch_time / args.queries)
+    finally:
+        os.remove(path)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the content stream operator throughput of PDFLocInterpreter on dense
+content streams.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfinterp import PDFContentParser
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+from pdfminer.psparser import PSEOF, PSKeyword
+
+from pdfloc_converter.converter import _create_interpreter
+from synthetic_pdf import write_synthetic_pdf
+
+__author__ = 'Martin Pecka'
+
+
+def count_operators(page):
+    """
+    Count the operators in the page's content streams (not including the form XObjects).
+    """
+    count = 0
+    parser = PDFContentParser(page.contents)
+    while True:
+        try:
+            (_, obj) = parser.nextobject()
+        except PSEOF:
+            break
+        if isinstance(obj, PSKeyword):
+            count += 1
+    return count
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--lines", type=int, default=40)
+    parser.add_argument("--graphics", type=int, default=2000,
+                        help="Number of groups of graphics operators on each page.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    (fd, path) = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        write_synthetic_pdf(path, args.pages, args.lines, args.graphics)
+
+        with open(path, 'rb') as f:
+            document = PDFDocument(PDFParser(f))
+            pages = list(PDFPage.create_pages(document))
+            operators = sum(count_operators(page) for page in pages)
+
+            best = None
+            for _ in xrange(args.repeat):
+                (interp, dev) = _create_interpreter(lazy_layout=True)
+                start = time.time()
+                for (pageno, page) in enumerate(pages):
+                    dev.pageno = pageno + 1
+                    interp.process_page(page)
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+        print >>sys.stderr, "%i operators on %i pages" % (operators, args.pages)
+        print >>sys.stderr, "%.3f s, %.0f operators/s" % (best, operators / best)
+    finally:
+        os.remove(path)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
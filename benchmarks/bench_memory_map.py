@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Benchmark of parsing a document read through a file object against parsing it from
+a memory mapping (PDFLocConverter(memory_map=True)).
+
+The file is in the page cache in both cases, so this only measures the cost of the many small
+seeks and reads; on slow (e.g. network) storage the difference is larger.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from pdfloc_converter.converter import PDFLocConverter
+from bench_batch_queries import random_pdfloc_pairs
+from synthetic_pdf import write_synthetic_pdf
+
+__author__ = 'Martin Pecka'
+
+
+def best_time(function, repeat):
+    best = None
+    result = None
+    for _ in xrange(repeat):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, result)
+
+
+def open_document(path, memory_map):
+    converter = PDFLocConverter(path, memory_map=memory_map)
+    converter.close()
+
+
+def convert(path, memory_map, pairs, pagenos):
+    converter = PDFLocConverter(path, memory_map=memory_map)
+    if pagenos is not None:
+        converter.restrict_only_on_pages_from(only_pages=pagenos)
+    converter.parse_document()
+    return map(str, converter.pdfloc_pairs_to_bboxes(pairs))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--lines", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    pairs = random_pdfloc_pairs(args.queries, args.pages, args.lines)
+
+    (fd, path) = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        write_synthetic_pdf(path, args.pages, args.lines)
+
+        cases = [
+            ("open document", lambda memory_map: open_document(path, memory_map)),
+            ("parse 1 page", lambda memory_map: convert(path, memory_map, pairs, [args.pages - 1])),
+            ("parse %i pages" % args.pages, lambda memory_map: convert(path, memory_map, pairs, None)),
+        ]
+        for (name, function) in cases:
+            (file_time, file_result) = best_time(lambda: function(False), args.repeat)
+            (map_time, map_result) = best_time(lambda: function(True), args.repeat)
+
+            assert file_result == map_result
+
+            print >>sys.stderr, "%-16s file %8.3f s, memory map %8.3f s" % (name + ":", file_time, map_time)
+    finally:
+        os.remove(path)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Benchmark of looking up single pages of a long document by walking its page tree (PDFPageTree)
+against enumerating the pages with PDFPage.create_pages(), on a flat and a nested page tree.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+
+from pdfloc_converter.page_tree import PDFPageTree
+from synthetic_pdf import write_synthetic_pdf
+
+__author__ = 'Martin Pecka'
+
+
+def enumerate_to_page(document, pageno):
+    for (i, page) in enumerate(PDFPage.create_pages(document)):
+        if i == pageno:
+            return page
+    return None
+
+
+def seek_to_page(document, pageno):
+    return PDFPageTree(document).get_page(pageno)
+
+
+def best_time(path, function, pageno, repeat):
+    best = None
+    page = None
+    for _ in xrange(repeat):
+        with open(path, 'rb') as f:
+            # a new document each time, so that no resolved objects are reused
+            document = PDFDocument(PDFParser(f))
+            start = time.time()
+            page = function(document, pageno)
+            elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, page)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=3000)
+    parser.add_argument("--fanout", type=int, default=10, help="Fanout of the nested page tree.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    for (name, fanout) in (("flat", None), ("nested", args.fanout)):
+        (fd, path) = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
+        try:
+            write_synthetic_pdf(path, args.pages, lines=1, page_tree_fanout=fanout)
+
+            for pageno in (0, args.pages // 2, args.pages - 1):
+                (enumerate_time, enumerated_page) = best_time(path, enumerate_to_page, pageno, args.repeat)
+                (seek_time, sought_page) = best_time(path, seek_to_page, pageno, args.repeat)
+
+                assert enumerated_page.pageid == sought_page.pageid
+
+                print >>sys.stderr, "%-6s tree, page %4i: create_pages %8.2f ms, PDFPageTree %8.2f ms" % (
+                    name, pageno, 1000 * enumerate_time, 1000 * seek_time)
+        finally:
+            os.remove(path)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
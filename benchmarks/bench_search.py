@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Benchmark of the full-text search (PDFLocConverter.search()): the time to build the text index
+and the number of queries answered per second, with and without computing the bounding boxes.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from pdfloc_converter.converter import PDFLocConverter
+from pdfloc_converter.text_index import PDFLocTextIndex
+from synthetic_pdf import write_synthetic_pdf
+
+__author__ = 'Martin Pecka'
+
+
+def random_queries(text, count, min_words, max_words, seed=0):
+    """
+    Return phrases of a few consecutive words of the text, some of them spanning line breaks.
+    """
+    rnd = random.Random(seed)
+    words = text.split()
+    queries = []
+    for _ in xrange(count):
+        length = rnd.randint(min_words, max_words)
+        start = rnd.randint(0, len(words) - length)
+        queries.append(u" ".join(words[start:start + length]))
+    return queries
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--lines", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--min-words", type=int, default=3)
+    parser.add_argument("--max-words", type=int, default=6)
+    args = parser.parse_args(argv)
+
+    (fd, path) = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        write_synthetic_pdf(path, args.pages, args.lines)
+
+        converter = PDFLocConverter(path)
+        converter.parse_document()
+
+        start = time.time()
+        text_index = PDFLocTextIndex()
+        for pageno in converter._navigation_tree:
+            text_index.add_page(pageno, converter._navigation_tree[pageno])
+        # the text and its trigrams are built by the first use
+        text_index.text
+        elapsed = time.time() - start
+        print >>sys.stderr, "index of %i pages: %i chars, %.3f s, %i B" % (
+            args.pages, len(text_index.text), elapsed, text_index.memory_size)
+
+        queries = random_queries(text_index.text, args.queries, args.min_words, args.max_words)
+
+        start = time.time()
+        match_count = sum(len(text_index.find(query)) for query in queries)
+        elapsed = time.time() - start
+        print >>sys.stderr, "find:   %i queries, %i matches, %.3f s (%.0f queries/s)" % (
+            len(queries), match_count, elapsed, len(queries) / elapsed)
+
+        # the first search builds the index of the converter
+        converter.search(queries[0])
+
+        start = time.time()
+        match_count = sum(len(converter.search(query)) for query in queries)
+        elapsed = time.time() - start
+        print >>sys.stderr, "search: %i queries, %i matches, %.3f s (%.0f queries/s)" % (
+            len(queries), match_count, elapsed, len(queries) / elapsed)
+    finally:
+        os.remove(path)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
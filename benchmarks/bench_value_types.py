@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the PDFLoc and geometry value types: their size, construction time and
+the memory and time of a large batch conversion, which creates millions of them.
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from pdfloc_converter.converter import PDFLocConverter
+from pdfloc_converter.pdfloc import PDFLoc, PDFLocPair, BoundingBox, BoundingBoxOnPage, Point, PointOnPage
+from bench_batch_queries import random_pdfloc_pairs
+from synthetic_pdf import write_synthetic_pdf
+
+__author__ = 'Martin Pecka'
+
+
+def object_size(obj):
+    """
+    Return the size of the object itself and its attribute dict (not of the attribute values).
+    """
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def peak_rss():
+    """
+    Return the peak resident set size of this process in kilobytes.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    if sys.platform == "darwin":
+        rss //= 1024
+    return rss
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--lines", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=100000)
+    parser.add_argument("--objects", type=int, default=200000, help="Number of objects of each type to construct.")
+    args = parser.parse_args(argv)
+
+    point = Point(1.0, 2.0)
+    bbox = BoundingBox(Point(1.0, 2.0), Point(3.0, 4.0))
+    constructors = [
+        ("Point", lambda: Point(1.0, 2.0)),
+        ("PointOnPage", lambda: PointOnPage(point, 1)),
+        ("BoundingBox", lambda: BoundingBox(point, point)),
+        ("BoundingBoxOnPage", lambda: BoundingBoxOnPage(bbox, 1, u"text")),
+        ("BoundingBoxOnPage from tuple", lambda: BoundingBoxOnPage((1.0, 2.0, 3.0, 4.0), 1)),
+        ("PDFLoc", lambda: PDFLoc("#pdfloc(abcd,1,17,0,2,0,0,1)")),
+        ("PDFLocPair", lambda: PDFLocPair("#pdfloc(abcd,1,17,0,2,0,0,1)", "#pdfloc(abcd,1,21,1,3,0,0,1)")),
+    ]
+
+    for (name, constructor) in constructors:
+        start = time.time()
+        objects = [constructor() for _ in xrange(args.objects)]
+        elapsed = time.time() - start
+        print >>sys.stderr, "%-30s %4i B/object %8.2f us/object" % (
+            name, object_size(objects[0]), 1e6 * elapsed / args.objects)
+        del objects
+
+    (fd, path) = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        write_synthetic_pdf(path, args.pages, args.lines)
+
+        converter = PDFLocConverter(path)
+        converter.parse_document()
+
+        pairs = random_pdfloc_pairs(args.queries, args.pages, args.lines)
+
+        rss_before = peak_rss()
+        start = time.time()
+        results = converter.pdfloc_pairs_to_bboxes(pairs)
+        elapsed = time.time() - start
+        rss_growth = peak_rss() - rss_before
+
+        bbox_count = sum(len(bboxes) for bboxes in results)
+        print >>sys.stderr, "batch of %i queries: %i bounding boxes, %.3f s, peak RSS grew by %i kB" % (
+            args.queries, bbox_count, elapsed, rss_growth)
+    finally:
+        os.remove(path)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
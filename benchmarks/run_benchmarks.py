@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""
+Benchmark suite measuring the parsing, query and annotation throughput on a corpus of
+synthetic PDF documents.
+
+Each document of the corpus is benchmarked in a separate process, so that the reported peak
+memory use belongs to that document only. The results are written as JSON, so the results of
+different runs (e.g. before and after a pdfminer upgrade) can be compared.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import pdfminer
+
+from pdfloc_converter.annotation_writer import PDFLocAnnotationWriter
+from pdfloc_converter.converter import PDFLocConverter
+from pdfloc_converter.pdfloc import PDFLocBoundingBoxes
+from bench_batch_queries import random_pdfloc_pairs
+from synthetic_pdf import write_synthetic_pdf
+
+__author__ = 'Martin Pecka'
+
+# bump this whenever the structure of the results changes
+RESULTS_VERSION = 1
+
+# the documents of the corpus; the parameters are those of synthetic_pdf()
+# (the queries need at least 2 strings on each line)
+CORPUS = [
+    ("baseline", dict(pages=20, lines=40)),
+    ("many-pages", dict(pages=200, lines=40)),
+    ("dense-tj", dict(pages=20, lines=40, strings=12)),
+    ("form-reuse", dict(pages=20, lines=40, form_uses=20)),
+    ("type0-font", dict(pages=20, lines=40, font="type0")),
+    ("dense-graphics", dict(pages=20, lines=40, graphics=500)),
+]
+
+
+def best_time(function, repeat):
+    """
+    Return the shortest time of the given number of calls of the function and the result of the last call.
+    """
+    best = None
+    result = None
+    for _ in xrange(repeat):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, result)
+
+
+def peak_rss():
+    """
+    Return the peak resident set size of this process in kilobytes.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    if sys.platform == "darwin":
+        rss //= 1024
+    return rss
+
+
+def benchmark_document(name, parameters, queries, repeat, directory):
+    """
+    Run the benchmarks on a synthetic document.
+
+    :return: The results.
+    :rtype: dict
+    """
+    path = os.path.join(directory, name + ".pdf")
+    write_synthetic_pdf(path, **parameters)
+
+    pages = parameters["pages"]
+
+    def parse():
+        converter = PDFLocConverter(path)
+        converter.parse_document()
+        return converter
+
+    (parse_time, converter) = best_time(parse, repeat)
+
+    pairs = random_pdfloc_pairs(queries, pages, parameters["lines"], graphics=parameters.get("graphics", 0),
+                                form_uses=parameters.get("form_uses", 1))
+    pdflocs = [pair.start for pair in pairs]
+
+    (pair_time, bboxes) = best_time(lambda: [converter.pdfloc_pair_to_bboxes(pair) for pair in pairs], repeat)
+    (xy_time, _) = best_time(lambda: [converter.pdfloc_to_xy(pdfloc) for pdfloc in pdflocs], repeat)
+
+    highlights = [PDFLocBoundingBoxes(pair_bboxes, comment="Highlight %i" % i) for (i, pair_bboxes) in enumerate(bboxes)]
+    output_path = os.path.join(directory, name + ".annotated.pdf")
+
+    def annotate():
+        with open(output_path, 'wb') as output:
+            writer = PDFLocAnnotationWriter(path, output)
+            for highlight in highlights:
+                writer.add_highlight(highlight)
+            writer.close()
+
+    (annotation_time, _) = best_time(annotate, repeat)
+    update_size = os.path.getsize(output_path) - os.path.getsize(path)
+
+    return {
+        "name": name,
+        "parameters": parameters,
+        "document_size": os.path.getsize(path),
+        "parse": {
+            "seconds": parse_time,
+            "pages_per_second": pages / parse_time,
+        },
+        "pdfloc_pair_to_bboxes": {
+            "queries": queries,
+            "seconds": pair_time,
+            "queries_per_second": queries / pair_time,
+        },
+        "pdfloc_to_xy": {
+            "queries": queries,
+            "seconds": xy_time,
+            "queries_per_second": queries / xy_time,
+        },
+        "annotation": {
+            "highlights": len(highlights),
+            "update_size": update_size,
+            "seconds": annotation_time,
+            "highlights_per_second": len(highlights) / annotation_time,
+            "update_bytes_per_second": update_size / annotation_time,
+        },
+        "peak_rss_kb": peak_rss(),
+    }
+
+
+def run_case(name, queries, repeat, result_path):
+    parameters = dict(CORPUS)[name]
+
+    directory = tempfile.mkdtemp(prefix="pdfloc-benchmark-")
+    try:
+        result = benchmark_document(name, parameters, queries, repeat, directory)
+    finally:
+        shutil.rmtree(directory)
+
+    # stdout may be used by the benchmarked code, so the result goes to a file
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+
+
+def get_revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=devnull,
+                                           cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-o", "--output", help="The file to write the JSON results to. Default is stdout.")
+    parser.add_argument("--cases", nargs="+", choices=[name for (name, _) in CORPUS],
+                        help="Only benchmark these documents of the corpus.")
+    parser.add_argument("--queries", type=int, default=2000, help="Number of queries of each kind.")
+    parser.add_argument("--repeat", type=int, default=3, help="The best time of this many runs is reported.")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case is not None:
+        run_case(args.case, args.queries, args.repeat, args.result_file)
+        return 0
+
+    cases = args.cases if args.cases is not None else [name for (name, _) in CORPUS]
+
+    results = []
+    for name in cases:
+        print >>sys.stderr, "Benchmarking %s..." % name
+
+        (fd, result_path) = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            with open(os.devnull, 'w') as devnull:
+                subprocess.check_call([sys.executable, os.path.abspath(__file__), "--case", name,
+                                       "--queries", str(args.queries), "--repeat", str(args.repeat),
+                                       "--result-file", result_path], stdout=devnull)
+            with open(result_path) as f:
+                result = json.load(f)
+        finally:
+            os.remove(result_path)
+
+        print >>sys.stderr, "  parse %.1f pages/s, pdfloc_pair_to_bboxes %.0f queries/s, pdfloc_to_xy %.0f queries/s, " \
+                            "annotation %.0f highlights/s, peak RSS %i kB" % (
+            result["parse"]["pages_per_second"], result["pdfloc_pair_to_bboxes"]["queries_per_second"],
+            result["pdfloc_to_xy"]["queries_per_second"], result["annotation"]["highlights_per_second"],
+            result["peak_rss_kb"])
+        results.append(result)
+
+    report = {
+        "version": RESULTS_VERSION,
+        "date": datetime.datetime.utcnow().isoformat() + "Z",
+        "revision": get_revision(),
+        "python": platform.python_version(),
+        "pdfminer": pdfminer.__version__,
+        "platform": platform.platform(),
+        "queries": args.queries,
+        "repeat": args.repeat,
+        "cases": results,
+    }
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
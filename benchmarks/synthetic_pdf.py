@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+Generator of synthetic PDF documents for the benchmarks.
+
+The generated pages contain lines of text shown by TJ operators (so that each line has more
+strings) and a form XObject with a header, so the PDFLocs of the text are predictable:
+line l of a page is shown by keyword number line_keyword(l, ...).
+"""
+import argparse
+import sys
+
+__author__ = 'Martin Pecka'
+
+# keyword number of the TJ operator showing the first line of a page
+FIRST_LINE_KEYWORD = 17
+
+# a group of graphics operators; 4 of its 8 operators are counted in the keyword numbers (the path
+# construction operators are not counted)
+GRAPHICS_GROUP = "q 1 0 0 rg 0 0 m 10 10 l 20 0 l h f Q\n"
+GRAPHICS_KEYWORDS = 4
+
+# an additional invocation of the header form; it adds 8 counted keywords (5 of them in the form)
+FORM_USE = "q /X1 Do Q\n"
+FORM_USE_KEYWORDS = 8
+
+# the supported fonts: a simple Type1 font and a composite font with 2-byte codes
+FONTS = {
+    "type1": "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    "type0": "<< /Type /Font /Subtype /Type0 /BaseFont /Helvetica /Encoding /Identity-H "
+             "/DescendantFonts [<< /Type /Font /Subtype /CIDFontType2 /BaseFont /Helvetica "
+             "/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> /DW 500 "
+             "/FontDescriptor << /Type /FontDescriptor /FontName /Helvetica /Flags 32 "
+             "/FontBBox [-166 -225 1000 931] /ItalicAngle 0 /Ascent 718 /Descent -207 /CapHeight 718 "
+             "/StemV 88 >> >>] >>",
+}
+
+
+def line_keyword(line, graphics=0, form_uses=1):
+    """
+    Return the keyword number of the TJ operator showing the given line of a page of a document
+    created by synthetic_pdf() with the given parameters.
+    """
+    return FIRST_LINE_KEYWORD + GRAPHICS_KEYWORDS*graphics + FORM_USE_KEYWORDS*(form_uses - 1) + 2*line
+
+
+def synthetic_pdf(pages=3, lines=40, graphics=0, strings=2, form_uses=1, font="type1", page_tree_fanout=None):
+    """
+    Create a synthetic PDF document.
+
+    :param pages: Number of pages.
+    :type pages: int
+
+    :param lines: Number of text lines on each page.
+    :type lines: int
+
+    :param graphics: Number of groups of graphics operators drawn before the text of each page.
+                        They make the content streams dense, but they shift the keyword numbers
+                        of the lines (each group adds GRAPHICS_KEYWORDS counted keywords).
+    :type graphics: int
+
+    :param strings: Number of strings shown by the TJ operator of each line.
+    :type strings: int
+
+    :param form_uses: Number of invocations of the header form XObject on each page (at least 1).
+    :type form_uses: int
+
+    :param font: The font of the text, one of the FONTS keys.
+    :type font: str
+
+    :param page_tree_fanout: If given, the pages are put in a balanced tree of /Pages nodes with
+                                at most this many kids each, and the pages inherit their MediaBox
+                                from the root node. By default, the root node has all pages as its kids.
+    :type page_tree_fanout: int | None
+
+    :return: The PDF document.
+    :rtype: str
+    """
+    assert strings >= 1 and form_uses >= 1
+
+    objects = {
+        1: "<< /Type /Catalog /Pages 2 0 R >>",
+        3: FONTS[font],
+    }
+
+    if font == "type0":
+        def encode(text):
+            return "<%s>" % "".join("%04x" % ord(c) for c in text)
+    else:
+        def encode(text):
+            return "(%s)" % text
+
+    header = "BT /F1 8 Tf 50 20 Td %s Tj ET" % encode("Header text")
+    objects[4] = "<< /Type /XObject /Subtype /Form /BBox [0 0 600 50] /Resources << /Font << /F1 3 0 R >> >> " \
+                 "/Length %i >>\nstream\n%s\nendstream" % (len(header), header)
+
+    kids = []
+    objid = 5
+    for page in xrange(pages):
+        content = "0 g 1 0 0 1 0 750 cm q /X1 Do Q 1 0 0 1 0 -750 cm 0 0 m 10 10 l S " \
+                  "BT /F1 12 Tf 72 720 Td 14 TL\n"
+        content = GRAPHICS_GROUP * graphics + FORM_USE * (form_uses - 1) + content
+        for line in xrange(lines):
+            texts = ["Line %i of page %i" % (line, page), "second part"] + ["part %i" % i for i in xrange(3, strings + 1)]
+            content += "[%s] TJ T*\n" % "-250".join(encode(text) for text in texts[:strings])
+        content += "ET"
+
+        objects[objid] = "<< /Length %i >>\nstream\n%s\nendstream" % (len(content), content)
+        kids.append(objid + 1)
+        objid += 2
+
+    # page tree node => list of its kids
+    nodes = {}
+    # kid => its page tree node
+    parents = dict((kid, 2) for kid in kids)
+    # page tree node or page => number of pages
+    counts = dict((kid, 1) for kid in kids)
+    while page_tree_fanout is not None and len(kids) > page_tree_fanout:
+        level = []
+        for i in xrange(0, len(kids), page_tree_fanout):
+            nodes[objid] = kids[i:i+page_tree_fanout]
+            counts[objid] = sum(counts[kid] for kid in nodes[objid])
+            parents.update((kid, objid) for kid in nodes[objid])
+            level.append(objid)
+            objid += 1
+        kids = level
+    nodes[2] = kids
+    counts[2] = pages
+    parents.update((kid, 2) for kid in kids)
+
+    media_box = "/MediaBox [0 0 612 792]"
+    for page in xrange(pages):
+        content_objid = 5 + 2*page
+        objects[content_objid + 1] = "<< /Type /Page /Parent %i 0 R %s/Contents %i 0 R " \
+                                     "/Resources << /Font << /F1 3 0 R >> /XObject << /X1 4 0 R >> >> >>" % (
+                                         parents[content_objid + 1],
+                                         media_box + " " if page_tree_fanout is None else "", content_objid)
+
+    for (node, node_kids) in nodes.iteritems():
+        objects[node] = "<< /Type /Pages %s/Kids [%s] /Count %i >>" % (
+            "/Parent %i 0 R " % parents[node] if node != 2 else (media_box + " " if page_tree_fanout is not None else ""),
+            " ".join("%i 0 R" % kid for kid in node_kids), counts[node])
+
+    result = "%PDF-1.4\n"
+    offsets = {}
+    for num in sorted(objects.keys()):
+        offsets[num] = len(result)
+        result += "%i 0 obj\n%s\nendobj\n" % (num, objects[num])
+
+    xref_position = len(result)
+    result += "xref\n0 %i\n0000000000 65535 f \n" % objid
+    for num in xrange(1, objid):
+        result += "%010i 00000 n \n" % offsets[num]
+    result += "trailer\n<< /Size %i /Root 1 0 R >>\nstartxref\n%i\n%%%%EOF\n" % (objid, xref_position)
+
+    return result
+
+
+def write_synthetic_pdf(path, pages=3, lines=40, graphics=0, strings=2, form_uses=1, font="type1",
+                        page_tree_fanout=None):
+    """
+    Write a synthetic PDF document created by synthetic_pdf() to the given path.
+    """
+    with open(path, 'wb') as f:
+        f.write(synthetic_pdf(pages, lines, graphics, strings, form_uses, font, page_tree_fanout))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic PDF document for the benchmarks.")
+    parser.add_argument("filename")
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--lines", type=int, default=40)
+    parser.add_argument("--graphics", type=int, default=0)
+    parser.add_argument("--strings", type=int, default=2)
+    parser.add_argument("--form-uses", type=int, default=1)
+    parser.add_argument("--font", choices=sorted(FONTS.keys()), default="type1")
+    parser.add_argument("--page-tree-fanout", type=int)
+    args = parser.parse_args(sys.argv[1:])
+
+    write_synthetic_pdf(args.filename, args.pages, args.lines, args.graphics, args.strings, args.form_uses, args.font,
+                        args.page_tree_fanout)
@@ -0,0 +1,315 @@
+import re
+import shutil
+import tempfile
+
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import PDFObjRef, resolve1
+from pdfminer.psparser import PSLiteral, PSKeyword
+
+from pdfloc_converter.page_tree import PDFPageTree
+from pdfloc_converter.pdfloc import PDFLocBoundingBoxes
+
+__author__ = 'Martin Pecka'
+
+
+class PDFLocAnnotationWriter(object):
+    """
+    Writes highlight annotations into a PDF document as an incremental update.
+
+    The update is written to the output as the highlights are added, and the offsets in the
+    cross-reference table are computed from the bytes actually written. The cross-reference
+    entries of the highlights are spooled to a temporary file, so the memory use doesn't
+    depend on the number of highlights.
+
+    The pages with new highlights are written when the writer is closed, each with all the
+    highlights added to it.
+    """
+
+    # the part of the file searched for the startxref keyword
+    _TAIL_SIZE = 1024
+
+    _copy_buffer_size = 1 << 20
+
+    def __init__(self, source, output, copy_source=True):
+        """
+        :param source: The PDF document to annotate. Either an open file or a string denoting
+                        a filename. A file given by its name is closed by close().
+        :type source: file | basestring
+
+        :param output: The file to write to. It needs to be opened for writing in binary mode.
+        :type output: file
+
+        :param copy_source: If True, the source document is copied to the output first, so the
+                                output is the annotated document. If False, only the incremental
+                                update is written; it then needs to be appended to the source.
+        :type copy_source: bool
+
+        :raises ValueError: If the source document is encrypted or its startxref can't be found.
+        """
+        super(PDFLocAnnotationWriter, self).__init__()
+
+        if isinstance(source, basestring):
+            self._source = file(source, 'rb')
+            self._owns_source = True
+        else:
+            self._source = source
+            self._owns_source = False
+
+        self._output = output
+        self._document = PDFDocument(PDFParser(self._source))
+
+        trailer = self._get_trailer()
+        if 'Encrypt' in trailer:
+            raise ValueError("Annotating encrypted documents is not supported.")
+        self._root = trailer['Root']
+        # the trailer of the update has to repeat the entries of the previous one (except /Prev);
+        # the xref stream keys (/Type, /W, /Index, /Filter, ...) don't belong to a trailer dictionary
+        self._info = trailer.get('Info')
+        self._id = resolve1(trailer.get('ID'))
+
+        self._previous_startxref = self._read_startxref()
+
+        self._source.seek(0, 2)
+        source_size = self._source.tell()
+
+        # the offset of the next written byte in the annotated document
+        self._position = source_size
+        if copy_source:
+            self._source.seek(0)
+            self._position = 0
+            self._copy_source()
+
+        # the update has to start on a new line
+        self._source.seek(source_size - 1)
+        if self._source.read(1) not in ("\n", "\r"):
+            self._write("\n")
+
+        # the new objects get consecutive numbers starting after the largest number in the document
+        max_objid = max(max(xref.get_objids()) for xref in self._document.xrefs)
+        self._first_new_objid = max(trailer.get('Size', 0), max_objid + 1)
+        self._next_objid = self._first_new_objid
+        # the xref entries of the new objects (in the order of their numbers)
+        self._new_xref_entries = tempfile.TemporaryFile()
+
+        # the page tree of the document; created lazily
+        self._pages = None
+        # page number (indexed from 0) => list of lists [first objid, count] of its new highlights;
+        # highlights added one after another to the same page share one item
+        self._page_highlights = {}
+
+        self._closed = False
+
+    def add_highlight(self, bboxes, comment=None):
+        """
+        Write a highlight annotation of the given bounding boxes.
+
+        If the bounding boxes lie on more pages, a separate annotation is written for each page.
+
+        :param bboxes: The bounding boxes to highlight.
+        :type bboxes: PDFLocBoundingBoxes
+
+        :param comment: Contents of the annotation. If None, the comment of the bounding boxes
+                            is used. Byte strings are decoded as UTF-8.
+        :type comment: basestring | None
+
+        :raises KeyError: If the bounding boxes lie on a page the document doesn't have.
+        """
+        assert isinstance(bboxes, PDFLocBoundingBoxes)
+        assert not self._closed
+
+        if comment is None:
+            comment = bboxes.comment
+
+        # page number (indexed from 0) => list of BoundingBox, in the order of pages
+        page_bboxes = {}
+        for bbox in bboxes.bboxes:
+            page_bboxes.setdefault(bbox.page - 1, []).append(bbox.bbox)
+
+        for pageno in sorted(page_bboxes.keys()):
+            page = self._get_page(pageno)
+            objid = self._start_object()
+
+            self._write("<</Type/Annot/Subtype/Highlight/P %i 0 R/C [1 1 0]/F 4/Contents %s/QuadPoints [" % (
+                page.pageid, _serialize_text(comment)))
+
+            rect = None
+            for bbox in page_bboxes[pageno]:
+                left = min(bbox[0], bbox[2])
+                right = max(bbox[0], bbox[2])
+                bottom = min(bbox[1], bbox[3])
+                top = max(bbox[1], bbox[3])
+
+                # the corners are ordered upper-left, upper-right, lower-left, lower-right
+                self._write(" ".join(_serialize_number(n) for n in (left, top, right, top, left, bottom, right, bottom)))
+                self._write(" ")
+
+                if rect is None:
+                    rect = [left, bottom, right, top]
+                else:
+                    rect = [min(rect[0], left), min(rect[1], bottom), max(rect[2], right), max(rect[3], top)]
+
+            self._write("]/Rect [%s]>>\nendobj\n" % " ".join(_serialize_number(n) for n in rect))
+
+            highlights = self._page_highlights.setdefault(pageno, [])
+            if len(highlights) > 0 and highlights[-1][0] + highlights[-1][1] == objid:
+                highlights[-1][1] += 1
+            else:
+                highlights.append([objid, 1])
+
+    def close(self):
+        """
+        Write the pages with the new highlights, the cross-reference table and the trailer.
+
+        The output is flushed, but not closed.
+        """
+        if self._closed:
+            return
+        self._closed = True
+
+        # objid => offset of the rewritten pages
+        page_offsets = {}
+        for pageno in sorted(self._page_highlights.keys()):
+            page = self._get_page(pageno)
+
+            annots_objid = self._start_object()
+            self._write("[")
+            existing_annots = resolve1(page.attrs.get('Annots', []))
+            for annot in existing_annots:
+                self._write(_serialize(annot))
+                self._write(" ")
+            for (first_objid, count) in self._page_highlights[pageno]:
+                for objid in xrange(first_objid, first_objid + count):
+                    self._write("%i 0 R " % objid)
+            self._write("]\nendobj\n")
+
+            attrs = dict(page.attrs)
+            attrs['Annots'] = PDFObjRef(None, annots_objid, 0)
+            page_offsets[page.pageid] = self._position
+            self._write("%i 0 obj\n%s\nendobj\n" % (page.pageid, _serialize(attrs)))
+
+        xref_position = self._position
+
+        self._write("xref\n0 1\n0000000000 65535 f \n")
+        for objid in sorted(page_offsets.keys()):
+            self._write("%i 1\n%010i 00000 n \n" % (objid, page_offsets[objid]))
+        if self._next_objid > self._first_new_objid:
+            self._write("%i %i\n" % (self._first_new_objid, self._next_objid - self._first_new_objid))
+            self._new_xref_entries.seek(0)
+            shutil.copyfileobj(self._new_xref_entries, self._output, self._copy_buffer_size)
+            self._position += self._new_xref_entries.tell()
+        self._new_xref_entries.close()
+
+        trailer = "/Size %i/Root %s" % (self._next_objid, _serialize(self._root))
+        if self._info is not None:
+            trailer += "/Info %s" % _serialize(self._info)
+        if isinstance(self._id, list) and all(isinstance(item, str) for item in self._id):
+            # the identifiers are binary strings, so they are written in hex
+            trailer += "/ID [%s]" % "".join("<%s>" % item.encode('hex').upper() for item in self._id)
+        self._write("trailer\n<<%s/Prev %i>>\nstartxref\n%i\n%%%%EOF\n" % (
+            trailer, self._previous_startxref, xref_position))
+
+        self._output.flush()
+
+        if self._owns_source:
+            self._source.close()
+
+    def _start_object(self):
+        objid = self._next_objid
+        self._next_objid += 1
+
+        self._new_xref_entries.write("%010i 00000 n \n" % self._position)
+        self._write("%i 0 obj\n" % objid)
+        return objid
+
+    def _write(self, data):
+        self._output.write(data)
+        self._position += len(data)
+
+    def _copy_source(self):
+        while True:
+            chunk = self._source.read(self._copy_buffer_size)
+            if not chunk:
+                break
+            self._write(chunk)
+
+    def _get_page(self, pageno):
+        if self._pages is None:
+            self._pages = PDFPageTree(self._document)
+        if pageno < 0:
+            raise KeyError("The document has no page %i" % pageno)
+        try:
+            return self._pages.get_page(pageno)
+        except IndexError:
+            raise KeyError("The document has no page %i" % pageno)
+
+    def _get_trailer(self):
+        # the first xref is the newest one; older ones may miss the keys that have been updated
+        trailer = {}
+        for xref in reversed(self._document.xrefs):
+            trailer.update(xref.trailer)
+        return trailer
+
+    def _read_startxref(self):
+        self._source.seek(0, 2)
+        size = self._source.tell()
+        self._source.seek(max(0, size - self._TAIL_SIZE))
+        tail = self._source.read()
+
+        matches = list(re.finditer(r"startxref\s+(\d+)", tail))
+        if len(matches) == 0:
+            raise ValueError("The document has no startxref.")
+        return int(matches[-1].group(1))
+
+
+# the bytes that need to be escaped in PDF names
+_name_special_chars = re.compile(r"[^!-~]|[#%()/<>\[\]{}]")
+
+
+def _serialize(obj):
+    """
+    Serialize a PDF object parsed by pdfminer.
+    """
+    if isinstance(obj, PDFObjRef):
+        return "%i 0 R" % obj.objid
+    if isinstance(obj, PSLiteral):
+        return "/" + _name_special_chars.sub(lambda m: "#%02X" % ord(m.group()), obj.name)
+    if isinstance(obj, PSKeyword):
+        return obj.name
+    if isinstance(obj, bool):
+        return "true" if obj else "false"
+    if isinstance(obj, (int, long, float)):
+        return _serialize_number(obj)
+    if isinstance(obj, basestring):
+        return _serialize_string(obj)
+    if isinstance(obj, list):
+        return "[" + " ".join(_serialize(item) for item in obj) + "]"
+    if isinstance(obj, dict):
+        return "<<" + "".join("%s %s" % (_serialize(PSLiteral(key)), _serialize(value))
+                              for (key, value) in sorted(obj.iteritems())) + ">>"
+    if obj is None:
+        return "null"
+    raise ValueError("Cannot serialize a PDF object: %r" % (obj,))
+
+
+def _serialize_number(number):
+    if isinstance(number, (int, long)):
+        return "%i" % number
+    # PDF doesn't allow the exponential notation
+    return ("%.4f" % number).rstrip("0").rstrip(".")
+
+
+def _serialize_string(string):
+    return "(" + string.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").replace("\r", "\\r") + ")"
+
+
+def _serialize_text(text):
+    """
+    Serialize a text string; non-ASCII texts are encoded in UTF-16BE.
+    """
+    if not isinstance(text, unicode):
+        text = text.decode('utf-8')
+    try:
+        return _serialize_string(text.encode('ascii'))
+    except UnicodeEncodeError:
+        return "<FEFF%s>" % text.encode('utf-16-be').encode('hex').upper()
@@ -0,0 +1,333 @@
+import collections
+import os
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from pdfloc_converter.cache import PDFLocCache
+from pdfloc_converter.converter import PDFLocConverter
+
+__author__ = 'Martin Pecka'
+
+
+class AsyncPDFLocConverter(object):
+    """
+    A non-blocking front-end of PDFLocConverter for applications running an event loop.
+
+    All methods return immediately with a concurrent.futures.Future. The documents are parsed
+    in the given executor, which may be either a ThreadPoolExecutor or a ProcessPoolExecutor.
+    Tornado coroutines can yield the returned futures directly, asyncio code can wrap them
+    by asyncio.wrap_future().
+
+    Each document is parsed only once: concurrent requests for a document that is being parsed
+    wait for the same parse. The parsed page indices are loaded into a converter in a separate
+    worker thread. Queries on parsed documents are answered right away without going through
+    the executor. With postponed layout analysis, a query may have to analyze the layout of some
+    lines first, so the queries are answered in the worker thread then, so that they don't block
+    the event loop.
+
+    The number of parsed documents kept can be limited; the least recently used ones are dropped.
+
+    Cancelling a future returned by parse() (or by a query method) detaches the caller from
+    the parse. When no caller waits for the parse any longer and it hasn't started yet, it is
+    removed from the executor. A parse that has already started runs to the end and the parsed
+    document is kept for later requests.
+    """
+
+    def __init__(self, executor=None, cache=None, lazy_layout=False, max_documents=None):
+        """
+        :param executor: The executor to parse the documents in. If None, a ThreadPoolExecutor
+                            with a single worker is created (and shut down by close()).
+        :type executor: concurrent.futures.Executor | None
+
+        :param cache: The cache of parsed pages used when parsing the documents.
+        :type cache: PDFLocCache | None
+
+        :param lazy_layout: If True, the layout analysis of a text line is postponed until a
+                                query needs it (see PDFLocConverter.parse_document()).
+                                The queries are answered in a worker thread then.
+        :type lazy_layout: bool
+
+        :param max_documents: The maximum number of parsed documents to keep. If None, the
+                                documents are kept until they are forgotten.
+        :type max_documents: int | None
+        """
+        super(AsyncPDFLocConverter, self).__init__()
+
+        assert cache is None or isinstance(cache, PDFLocCache)
+        assert max_documents is None or max_documents > 0
+
+        self._owns_executor = executor is None
+        self._executor = executor if executor is not None else ThreadPoolExecutor(max_workers=1)
+        self._cache = cache
+        self._lazy_layout = lazy_layout
+        self._max_documents = max_documents
+        # loads the parsed page indices and (with postponed layout analysis) answers the queries,
+        # so that neither runs in the caller's thread; this can't be done by the executor, which
+        # may run in other processes
+        self._worker = ThreadPoolExecutor(max_workers=1)
+
+        # guards _documents and _parses; reentrant, because cancelling a parse may call _finish_parse()
+        self._lock = threading.RLock()
+        # document path => _ParsedDocument; the most recently used document is at the end
+        self._documents = collections.OrderedDict()
+        # document path => _PendingParse
+        self._parses = {}
+
+    def parse(self, document):
+        """
+        Parse the given document (unless it has already been parsed).
+
+        :param document: Filename of the document.
+        :type document: basestring
+
+        :return: Future of the PDFLocConverter of the parsed document. The converter is not
+                    thread-safe, so it should only be queried by the methods of this class.
+        :rtype: concurrent.futures.Future
+        """
+        return self._parse(document, lambda parsed_document: parsed_document.converter)
+
+    def pdfloc_pair_to_bboxes(self, document, pdfloc_pair):
+        """
+        See PDFLocConverter.pdfloc_pair_to_bboxes().
+
+        :rtype: concurrent.futures.Future
+        """
+        return self._query(document, "pdfloc_pair_to_bboxes", pdfloc_pair)
+
+    def pdfloc_pairs_to_bboxes(self, document, pdfloc_pairs):
+        """
+        See PDFLocConverter.pdfloc_pairs_to_bboxes().
+
+        :rtype: concurrent.futures.Future
+        """
+        return self._query(document, "pdfloc_pairs_to_bboxes", pdfloc_pairs)
+
+    def pdfloc_to_xy(self, document, pdfloc):
+        """
+        See PDFLocConverter.pdfloc_to_xy().
+
+        :rtype: concurrent.futures.Future
+        """
+        return self._query(document, "pdfloc_to_xy", pdfloc)
+
+    def bboxes_to_pdfloc_pair(self, document, bboxes, pdfloc_hash="0000"):
+        """
+        See PDFLocConverter.bboxes_to_pdfloc_pair().
+
+        :rtype: concurrent.futures.Future
+        """
+        return self._query(document, "bboxes_to_pdfloc_pair", bboxes, pdfloc_hash)
+
+    def xy_to_pdfloc(self, document, xy, tolerance=2.0, pdfloc_hash="0000"):
+        """
+        See PDFLocConverter.xy_to_pdfloc().
+
+        :rtype: concurrent.futures.Future
+        """
+        return self._query(document, "xy_to_pdfloc", xy, tolerance, pdfloc_hash)
+
+    def is_document_parsed(self, document):
+        """
+        Return true if the given document has already been parsed.
+
+        :param document: Filename of the document.
+        :type document: basestring
+
+        :rtype: bool
+        """
+        with self._lock:
+            return self._get_path(document) in self._documents
+
+    def forget(self, document):
+        """
+        Drop the parsed document, so that it is parsed again by the next request.
+
+        A parse of the document which is in progress is not affected.
+
+        :param document: Filename of the document.
+        :type document: basestring
+        """
+        with self._lock:
+            parsed_document = self._documents.pop(self._get_path(document), None)
+
+        if parsed_document is not None:
+            parsed_document.close()
+
+    def close(self):
+        """
+        Drop all parsed documents, cancel the parses that haven't started yet and shut down
+        the executor if it was created by this object.
+        """
+        with self._lock:
+            parsed_documents = self._documents.values()
+            self._documents.clear()
+            parses = self._parses.values()
+
+        for parsed_document in parsed_documents:
+            parsed_document.close()
+
+        for parse in parses:
+            for (waiter, _) in list(parse.waiters):
+                waiter.cancel()
+
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+        self._worker.shutdown(wait=False)
+
+    def _parse(self, document, get_result):
+        path = self._get_path(document)
+        waiter = Future()
+        new_parse = False
+
+        with self._lock:
+            parsed_document = self._documents.pop(path, None)
+            if parsed_document is not None:
+                # move the document to the most recently used position
+                self._documents[path] = parsed_document
+            else:
+                parse = self._parses.get(path)
+                if parse is None:
+                    parse = _PendingParse(path, self._executor.submit(
+                        _parse_page_indices, path, self._cache, self._lazy_layout))
+                    self._parses[path] = parse
+                    new_parse = True
+                parse.waiters.append((waiter, get_result))
+
+        if parsed_document is not None:
+            self._resolve(waiter, get_result, parsed_document)
+            return waiter
+
+        # if the parse has already finished, the callback runs right away, so it must not be
+        # called with the lock held
+        if new_parse:
+            parse.future.add_done_callback(lambda future: self._submit_finish_parse(parse))
+        waiter.add_done_callback(lambda future: self._detach_waiter(parse, future))
+
+        return waiter
+
+    def _query(self, document, method_name, *args):
+
+        def query(parsed_document):
+            # the converter may analyse the layout of lines when queried, so it needs to be locked
+            with parsed_document.lock:
+                return getattr(parsed_document.converter, method_name)(*args)
+
+        return self._parse(document, query)
+
+    def _submit_finish_parse(self, parse):
+        # called when the parse finishes (or is cancelled), either from the executor's thread (which
+        # shouldn't be held up by loading the document), or right away from the caller's thread
+        try:
+            self._worker.submit(self._finish_parse, parse)
+        except RuntimeError as e:
+            # the worker has been shut down by close()
+            self._finish_parse(parse, e)
+
+    def _finish_parse(self, parse, error=None):
+        # called from the worker's thread
+        parsed_document = None
+        if error is None and not parse.future.cancelled():
+            try:
+                # the source document is only opened to get the document structure;
+                # the conversions only need the page indices parsed by the executor
+                converter = PDFLocConverter(parse.path, cache=self._cache)
+                converter.load_page_indices(parse.future.result())
+                parsed_document = _ParsedDocument(converter)
+            except Exception as e:
+                error = e
+
+        dropped_documents = []
+        with self._lock:
+            if self._parses.get(parse.path) is parse:
+                del self._parses[parse.path]
+            if parsed_document is not None:
+                dropped_documents.append(self._documents.pop(parse.path, None))
+                self._documents[parse.path] = parsed_document
+                # drop the least recently used documents
+                while self._max_documents is not None and len(self._documents) > self._max_documents:
+                    dropped_documents.append(self._documents.popitem(last=False)[1])
+            waiters = parse.waiters
+            parse.waiters = []
+
+        for dropped_document in dropped_documents:
+            if dropped_document is not None:
+                dropped_document.close()
+
+        for (waiter, get_result) in waiters:
+            if parsed_document is not None:
+                _resolve(waiter, get_result, parsed_document)
+            elif error is not None:
+                if waiter.set_running_or_notify_cancel():
+                    waiter.set_exception(error)
+            else:
+                waiter.cancel()
+
+    def _detach_waiter(self, parse, waiter):
+        if not waiter.cancelled():
+            return
+
+        with self._lock:
+            parse.waiters = [(other, get_result) for (other, get_result) in parse.waiters if other is not waiter]
+            if len(parse.waiters) > 0:
+                return
+
+            # nobody waits for the parse; if it hasn't started yet, it is cancelled, and the next
+            # request for the document starts a new parse
+            if parse.future.cancel() and self._parses.get(parse.path) is parse:
+                del self._parses[parse.path]
+
+    def _resolve(self, waiter, get_result, parsed_document):
+        # without postponed layout analysis, the queries are only fast lookups
+        if not self._lazy_layout:
+            _resolve(waiter, get_result, parsed_document)
+            return
+
+        try:
+            self._worker.submit(_resolve, waiter, get_result, parsed_document)
+        except RuntimeError as e:
+            # the worker has been shut down by close()
+            if waiter.set_running_or_notify_cancel():
+                waiter.set_exception(e)
+
+    @staticmethod
+    def _get_path(document):
+        return os.path.realpath(document)
+
+
+class _PendingParse(object):
+    def __init__(self, path, future):
+        self.path = path
+        self.future = future
+        # list of tuples (Future given to the caller, function of _ParsedDocument computing its result)
+        self.waiters = []
+
+
+class _ParsedDocument(object):
+    def __init__(self, converter):
+        self.converter = converter
+        self.lock = threading.Lock()
+
+    def close(self):
+        # the converter only works with the loaded page indices, so a query running on it
+        # doesn't need the source document
+        self.converter.close()
+
+
+def _resolve(waiter, get_result, parsed_document):
+    # a waiter cancelled by the caller can no longer get a result
+    if not waiter.set_running_or_notify_cancel():
+        return
+
+    try:
+        waiter.set_result(get_result(parsed_document))
+    except Exception as e:
+        waiter.set_exception(e)
+
+
+def _parse_page_indices(path, cache, lazy_layout):
+    # this function runs in the executor, possibly in another process, so it has to be picklable
+    # and it only returns the picklable page indices
+    converter = PDFLocConverter(path, cache=cache)
+    converter.parse_document(lazy_layout=lazy_layout)
+    return converter.get_page_indices()
@@ -0,0 +1,403 @@
+import collections
+import errno
+import json
+import multiprocessing
+import os
+import time
+
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import resolve1
+
+from pdfloc_converter.cache import PDFLocCache
+from pdfloc_converter.converter import PDFLocConverter
+from pdfloc_converter.pdfloc import PDFLoc, PDFLocPair
+from pdfloc_converter.server import run_jobs
+
+__author__ = 'Martin Pecka'
+
+
+class PDFLocBatchRunner(object):
+    """
+    Runs conversion jobs on many documents listed in a manifest in a pool of worker processes.
+
+    The manifest has one JSON object per line:
+        {"document": "/path/to/file.pdf", "jobs": [job, ...]}
+    where the jobs are those of the conversion server (see server.run_jobs()). Empty lines are skipped.
+
+    Only the pages the jobs of a document need are parsed. A document is converted by a single
+    worker, unless it has more than split_pages pages; then its pages are parsed in chunks of
+    split_pages pages by several workers, and the jobs run on the collected pages. The pool is
+    created once for the whole batch, so the workers are started only once.
+
+    The results of each manifest entry are written to the output directory to a file named by
+    the number of the manifest line (e.g. 000042.json):
+        {"document": "/path/to/file.pdf", "results": [result, ...]}
+    or, if the document couldn't be converted at all:
+        {"document": "/path/to/file.pdf", "error": "description"}
+    The file summary.jsonl in the output directory gets a line for each entry in the manifest
+    order. A failed document doesn't abort the batch.
+    """
+
+    SUMMARY_FILE = "summary.jsonl"
+
+    def __init__(self, output_directory, workers=None, split_pages=None, cache=None, lazy_layout=False,
+                 memory_map=False):
+        """
+        :param output_directory: The directory to write the results to. It is created if it doesn't exist.
+        :type output_directory: basestring
+
+        :param workers: Number of worker processes. Defaults to the number of CPUs.
+        :type workers: int | None
+
+        :param split_pages: Documents with more pages than this are parsed by several workers.
+                                None means the documents are never split.
+        :type split_pages: int | None
+
+        :param cache: The cache of parsed pages used by the workers.
+        :type cache: PDFLocCache | None
+
+        :param lazy_layout: Whether the layout analysis of the pages should be postponed
+                                (see PDFLocConverter.parse_document()).
+        :type lazy_layout: bool
+
+        :param memory_map: Whether the workers should memory-map the documents (see PDFLocConverter.__init__()).
+        :type memory_map: bool
+        """
+        super(PDFLocBatchRunner, self).__init__()
+
+        assert cache is None or isinstance(cache, PDFLocCache)
+        assert split_pages is None or split_pages > 0
+
+        self._output_directory = output_directory
+        self._workers = workers if workers is not None else multiprocessing.cpu_count()
+        self._split_pages = split_pages
+        self._cache = cache
+        self._lazy_layout = lazy_layout
+        self._memory_map = memory_map
+
+        # number of documents whose results are waited for at once
+        self._max_pending = 4 * self._workers
+        # how often (in seconds) the split documents are checked for their parsed pages
+        self._poll_interval = 0.05
+
+        self.document_count = 0
+        self.failed_document_count = 0
+        self.failed_job_count = 0
+
+    def run(self, manifest):
+        """
+        Convert the documents of the manifest.
+
+        :param manifest: The lines of the manifest; an open file can be given, too.
+        :type manifest: collections.Iterable
+
+        :return: True if all documents have been converted (some of their jobs may have failed).
+        :rtype: bool
+        """
+        try:
+            os.makedirs(self._output_directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        pool = multiprocessing.Pool(self._workers, _init_worker, (self._cache, self._lazy_layout, self._memory_map))
+        try:
+            with open(os.path.join(self._output_directory, self.SUMMARY_FILE), 'w') as summary:
+                self._run(pool, manifest, summary)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        return self.failed_document_count == 0
+
+    def _run(self, pool, manifest, summary):
+        # the entries are finished in the manifest order; the entries after the first unfinished
+        # one are converted meanwhile
+        pending = collections.deque()
+        entries = iter(enumerate(manifest, 1))
+
+        while True:
+            while len(pending) < self._max_pending:
+                entry = next(entries, None)
+                if entry is None:
+                    break
+                (line_number, line) = entry
+                if len(line.strip()) == 0:
+                    continue
+                pending.append(self._start(pool, line_number, line))
+
+            if len(pending) == 0:
+                break
+
+            for document in pending:
+                document.advance(pool)
+
+            while len(pending) > 0 and pending[0].is_finished():
+                self._write(pending.popleft(), summary)
+
+            if len(pending) > 0:
+                pending[0].wait(self._poll_interval)
+
+    def _start(self, pool, line_number, line):
+        document = _BatchDocument(line_number)
+        try:
+            entry = json.loads(line)
+            if not isinstance(entry, dict) or not isinstance(entry.get("document"), basestring) or \
+                    not isinstance(entry.get("jobs"), list):
+                raise ValueError("A manifest entry has to be an object with a document and a list of jobs.")
+            document.path = entry["document"]
+            document.jobs = entry["jobs"]
+
+            if self._split_pages is not None:
+                # opening the document to count its pages may take long (or fail), so it is left
+                # to the workers, too
+                document.convert_or_split(pool, self._split_pages)
+            else:
+                document.convert(pool)
+        except Exception as e:
+            document.fail(e)
+        return document
+
+    def _write(self, document, summary):
+        self.document_count += 1
+
+        output_file = "%06i.json" % document.line_number
+        result = document.get_result()
+        with open(os.path.join(self._output_directory, output_file), 'w') as f:
+            json.dump(result, f)
+
+        error = result.get("error")
+        failed_jobs = 0
+        if error is not None:
+            self.failed_document_count += 1
+        else:
+            failed_jobs = sum(1 for job_result in result["results"] if "error" in job_result)
+            self.failed_job_count += failed_jobs
+
+        summary.write(json.dumps({
+            "line": document.line_number,
+            "document": document.path,
+            "output": output_file,
+            "error": error,
+            "jobs": len(document.jobs) if document.jobs is not None else 0,
+            "failed_jobs": failed_jobs,
+            "time": time.time() - document.start_time,
+        }) + "\n")
+        summary.flush()
+
+
+class _BatchDocument(object):
+    """
+    The state of the conversion of a single manifest entry.
+    """
+
+    def __init__(self, line_number):
+        self.line_number = line_number
+        self.path = None
+        self.jobs = None
+        self.start_time = time.time()
+
+        # the result of the conversion of a document that may be split, and the size of the chunks
+        self._split_conversion = None
+        self._chunk_size = None
+        # the results of the page chunks of a split document
+        self._chunks = None
+        # the result of the conversion
+        self._conversion = None
+        self._error = None
+        self._results = None
+
+    def convert(self, pool, page_indices=None):
+        self._conversion = pool.apply_async(_convert_document, ((self.path, self.jobs, page_indices),))
+
+    def convert_or_split(self, pool, chunk_size):
+        self._split_conversion = pool.apply_async(_convert_or_split_document, ((self.path, self.jobs, chunk_size),))
+        self._chunk_size = chunk_size
+
+    def parse_in_chunks(self, pool, pagenos, chunk_size):
+        self._chunks = [pool.apply_async(_parse_document_pages, ((self.path, pagenos[i:i+chunk_size]),))
+                        for i in xrange(0, len(pagenos), chunk_size)]
+
+    def fail(self, e):
+        self._error = _describe_error(e)
+
+    def advance(self, pool):
+        """
+        Start parsing the pages of a document in chunks once it is known that it is split,
+        and start converting it once all its pages have been parsed.
+        """
+        if self._split_conversion is not None and self._split_conversion.ready():
+            (self._error, self._results, pagenos) = self._split_conversion.get()
+            self._split_conversion = None
+            if pagenos is not None:
+                self.parse_in_chunks(pool, pagenos, self._chunk_size)
+
+        if self._chunks is None or not all(chunk.ready() for chunk in self._chunks):
+            return
+
+        chunks = self._chunks
+        self._chunks = None
+
+        page_indices = {}
+        for chunk in chunks:
+            (error, chunk_indices) = chunk.get()
+            if error is not None:
+                self._error = error
+                return
+            page_indices.update(chunk_indices)
+        self.convert(pool, page_indices)
+
+    def is_finished(self):
+        return self._error is not None or self._results is not None or \
+            (self._conversion is not None and self._conversion.ready())
+
+    def wait(self, timeout):
+        if self._split_conversion is not None:
+            self._split_conversion.wait(timeout)
+        elif self._conversion is not None:
+            self._conversion.wait(timeout)
+        elif self._chunks is not None:
+            for chunk in self._chunks:
+                chunk.wait(timeout)
+                if not chunk.ready():
+                    break
+
+    def get_result(self):
+        if self._error is None and self._results is None:
+            (self._error, self._results) = self._conversion.get()
+        if self._error is None:
+            return {"document": self.path, "results": self._results}
+        return {"document": self.path, "error": self._error}
+
+
+def _describe_error(e):
+    if isinstance(e, (IOError, OSError)) and e.strerror is not None:
+        return "%s: %s" % (e.strerror, e.filename) if e.filename is not None else e.strerror
+    return str(e) if len(str(e)) > 0 else e.__class__.__name__
+
+
+def _get_page_count(path):
+    with open(path, 'rb') as f:
+        document = PDFDocument(PDFParser(f))
+        pages = resolve1(document.catalog.get('Pages'))
+        count = resolve1(pages.get('Count')) if isinstance(pages, dict) else None
+        return count if isinstance(count, int) else None
+
+
+def _get_job_pages(jobs):
+    """
+    Return the pages (indexed from 0) the jobs (see run_jobs()) need. Malformed jobs are ignored,
+    they fail when they are run.
+
+    :return: The pages, or None if all pages are needed (by a search job).
+    :rtype: set | None
+    """
+    pages = set()
+    for job in jobs:
+        try:
+            if "search" in job:
+                return None
+            elif "pdfloc_pair" in job:
+                (start, end) = job["pdfloc_pair"].split(";", 1)
+                pages.update(PDFLocPair(start.strip(), end.strip()).pages_covered)
+            elif "pdfloc" in job:
+                pages.add(PDFLoc(job["pdfloc"]).page)
+            elif "point" in job:
+                pages.add(int(job["point"]["page"]) - 1)
+            elif "bboxes" in job:
+                pages.update(int(bbox["page"]) - 1 for bbox in job["bboxes"])
+        except (KeyError, ValueError, TypeError, AttributeError):
+            pass
+    return pages
+
+
+# the state of a worker process, set by _init_worker()
+_worker_cache = None
+_worker_lazy_layout = False
+_worker_memory_map = False
+
+
+def _init_worker(cache, lazy_layout, memory_map):
+    global _worker_cache, _worker_lazy_layout, _worker_memory_map
+    _worker_cache = cache
+    _worker_lazy_layout = lazy_layout
+    _worker_memory_map = memory_map
+
+
+def _convert_document(args):
+    """
+    Run the jobs of a document. This is executed in a worker process.
+
+    :param args: The document filename, the jobs and the dict page number => PageIndex of its
+                    parsed pages. If the pages are None, the document is parsed on demand.
+    :type args: tuple
+
+    :return: Tuple (error description or None, the results of the jobs (see run_jobs())).
+    :rtype: tuple
+    """
+    (path, jobs, page_indices) = args
+    try:
+        converter = PDFLocConverter(path, cache=_worker_cache, memory_map=_worker_memory_map)
+        try:
+            if page_indices is None:
+                converter.parse_on_demand(lazy_layout=_worker_lazy_layout)
+            else:
+                converter.load_page_indices(page_indices)
+            return None, run_jobs(converter, jobs)
+        finally:
+            converter.close()
+    except Exception as e:
+        # the exception is not passed to the parent process, because it may not be picklable
+        return _describe_error(e), None
+
+
+def _convert_or_split_document(args):
+    """
+    Run the jobs of a document, unless it has more pages than the given chunk size and should be
+    parsed in chunks by several workers. This is executed in a worker process.
+
+    :param args: The document filename, the jobs and the chunk size.
+    :type args: tuple
+
+    :return: Tuple (error description or None, the results of the jobs or None, the sorted list
+                of the page numbers to parse in chunks if the document is split, None otherwise).
+    :rtype: tuple
+    """
+    (path, jobs, chunk_size) = args
+    try:
+        page_count = _get_page_count(path)
+    except Exception as e:
+        return _describe_error(e), None, None
+
+    if page_count is not None and page_count > chunk_size:
+        job_pages = _get_job_pages(jobs)
+        if job_pages is None:
+            job_pages = xrange(page_count)
+        return None, None, sorted(pageno for pageno in job_pages if 0 <= pageno < page_count)
+
+    (error, results) = _convert_document((path, jobs, None))
+    return error, results, None
+
+
+def _parse_document_pages(args):
+    """
+    Parse the given pages of a document. This is executed in a worker process.
+
+    :param args: The document filename and the list of page numbers.
+    :type args: tuple
+
+    :return: Tuple (error description or None, dict page number => PageIndex).
+    :rtype: tuple
+    """
+    (path, pagenos) = args
+    try:
+        converter = PDFLocConverter(path, cache=_worker_cache, memory_map=_worker_memory_map)
+        converter.restrict_only_on_pages_from(only_pages=pagenos)
+        converter.parse_document(lazy_layout=_worker_lazy_layout)
+        return None, converter.get_page_indices()
+    except Exception as e:
+        return _describe_error(e), None
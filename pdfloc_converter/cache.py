@@ -0,0 +1,219 @@
+import cPickle as pickle
+import errno
+import hashlib
+import os
+import tempfile
+
+__author__ = 'Martin Pecka'
+
+
+class PDFLocCache(object):
+    """
+    A persistent on-disk cache of parsed document pages (their PageIndex objects).
+
+    Each parsed page is stored in a separate file, so that a later conversion touching
+    additional pages of a cached document only needs to parse the missing ones.
+
+    The cache entries are keyed by a fingerprint of the document contents and the ids of
+    the page's content streams, so a changed document never reuses stale entries.
+
+    If the total size of the cache exceeds the given bound, the least recently used
+    entries are evicted.
+    """
+
+    # bump this whenever the format of the stored page indices changes
+    FORMAT_VERSION = 5
+
+    _read_chunk_size = 1 << 20
+
+    def __init__(self, directory, max_size=None):
+        """
+        Initialize the cache.
+
+        :param directory: The directory to store the cache entries in. It is created if it
+                            doesn't exist.
+        :type directory: basestring
+
+        :param max_size: Maximum total size of the cache entries in bytes. None means
+                            the size is not bounded.
+        :type max_size: int | None
+        """
+        super(PDFLocCache, self).__init__()
+
+        self._directory = directory
+        self._max_size = max_size
+        # total size of the entries; computed lazily on the first store
+        self._total_size = None
+
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    def document_fingerprint(self, stream):
+        """
+        Compute the fingerprint of the document contents.
+
+        The stream position is preserved.
+
+        :param stream: The open (seekable) stream with the PDF document.
+        :type stream: file
+
+        :return: The fingerprint.
+        :rtype: str
+        """
+        digest = hashlib.sha1()
+
+        position = stream.tell()
+        stream.seek(0)
+        while True:
+            chunk = stream.read(self._read_chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+        stream.seek(position)
+
+        return digest.hexdigest()
+
+    def page_key(self, document_fingerprint, page_num, page):
+        """
+        Return the cache key of the given document page.
+
+        :param document_fingerprint: The fingerprint returned by document_fingerprint().
+        :type document_fingerprint: str
+
+        :param page_num: The page number (indexed from 0).
+        :type page_num: int
+
+        :param page: The page.
+        :type page: pdfminer.pdfpage.PDFPage
+
+        :return: The cache key.
+        :rtype: str
+        """
+        content_ids = [getattr(stream, "objid", None) for stream in page.contents]
+        return hashlib.sha1("%i:%s:%i:%s" % (
+            self.FORMAT_VERSION, document_fingerprint, page_num, repr(content_ids)
+        )).hexdigest()
+
+    def load(self, key):
+        """
+        Load a cached page index.
+
+        :param key: The cache key returned by page_key().
+        :type key: str
+
+        :return: The cached page index, or None if the page is not cached.
+        :rtype: PageIndex | None
+        """
+        path = self._get_path(key)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+
+        try:
+            with f:
+                page_index = pickle.load(f)
+        except Exception:
+            # unpickling a truncated or otherwise corrupted entry may fail with almost any error;
+            # the bad entry is removed, so the page is parsed and stored again
+            self._remove(path)
+            return None
+
+        # mark the entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return page_index
+
+    def store(self, key, page_index):
+        """
+        Store a page index in the cache and evict the least recently used entries if
+        the cache gets too big.
+
+        :param key: The cache key returned by page_key().
+        :type key: str
+
+        :param page_index: The page index.
+        :type page_index: PageIndex
+        """
+        path = self._get_path(key)
+
+        # write to a temporary file first so that concurrent readers never see partial entries
+        (fd, tmp_path) = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(page_index, f, pickle.HIGHEST_PROTOCOL)
+            # the size of the entry being replaced (if any)
+            old_size = self._get_size(path)
+            os.rename(tmp_path, path)
+        except:
+            self._remove(tmp_path)
+            raise
+
+        if self._max_size is not None:
+            if self._total_size is None:
+                self._total_size = sum(size for (_, _, size) in self._list_entries())
+            else:
+                self._total_size += os.path.getsize(path) - old_size
+
+            if self._total_size > self._max_size:
+                self._evict()
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        for (path, _, _) in self._list_entries():
+            self._remove(path)
+        self._total_size = 0
+
+    def _evict(self):
+        entries = sorted(self._list_entries(), key=lambda entry: entry[1])
+        self._total_size = sum(size for (_, _, size) in entries)
+
+        for (path, _, size) in entries:
+            if self._total_size <= self._max_size:
+                break
+            self._remove(path)
+            self._total_size -= size
+
+    def _list_entries(self):
+        entries = []
+        for filename in os.listdir(self._directory):
+            if not filename.endswith(".pickle"):
+                continue
+            path = os.path.join(self._directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # removed concurrently
+            entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _get_size(self, path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _get_path(self, key):
+        return os.path.join(self._directory, key + ".pickle")
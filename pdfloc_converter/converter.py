@@ -1,18 +1,86 @@
+import collections
+import itertools
+import multiprocessing
+import os
+import time
+
 from pdfminer.layout import LAParams
 from pdfminer.pdfdocument import PDFDocument
-from pdfminer.pdfinterp import PDFResourceManager
-from pdfminer.pdfpage import PDFPage
 from pdfminer.pdfparser import PDFParser
 
-from pdfloc_converter.document_structure import NavigationTree
-from pdfloc_converter.pdfloc import PDFLoc, PDFLocPair, PDFLocBoundingBoxes
-from pdfloc_converter.pdfminer_extensions import PDFLocPageAnalyzer, PDFLocInterpreter, PDFLocDocument
+from pdfloc_converter.cache import PDFLocCache
+from pdfloc_converter.document_structure import CharRef, NavigationTree
+from pdfloc_converter.instrumentation import PDFLocInstrumentation, PageParseStats
+from pdfloc_converter.memory_map import MemoryMappedStream
+from pdfloc_converter.page_tree import PDFPageTree
+from pdfloc_converter.pdfloc import PDFLoc, PDFLocPair, PDFLocBatch, PDFLocBoundingBoxes, PointOnPage
+from pdfloc_converter.pdfminer_extensions import PDFLocPageAnalyzer, PDFLocInterpreter, PDFLocDocument, \
+    PDFLocResourceManager
+from pdfloc_converter.text_index import PDFLocTextIndex
 
 __author__ = 'Martin Pecka'
 
 
+def describe_lookup_error(error, first_page):
+    """
+    Describe the KeyError raised by a conversion when the query refers to a part of the document
+    that doesn't exist.
+
+    :param error: The error.
+    :type error: KeyError
+
+    :param first_page: The number of the first page in the page numbering of the query
+                        (0 for PDFLocs, 1 for points and bounding boxes).
+    :type first_page: int
+
+    :rtype: str
+    """
+    key = error.args[0] if len(error.args) > 0 else None
+    if isinstance(key, (int, long)):
+        # the navigation tree raises the numbers (indexed from 0) of the pages it doesn't have
+        return "The document has no page %i" % (key + first_page)
+    # the page indices describe the missing chars
+    return "Location not found in the document: %s" % key
+
+
+class PDFLocQueryError(object):
+    """
+    Describes why a query of a batch (see PDFLocConverter.pdfloc_pairs_to_bboxes()) couldn't
+    be converted.
+    """
+
+    def __init__(self, index, query, cause):
+        """
+        :param index: Index of the query in the batch.
+        :type index: int
+
+        :param query: The query as it was given in the batch.
+
+        :param cause: The exception raised when converting the query.
+        :type cause: Exception
+        """
+        super(PDFLocQueryError, self).__init__()
+
+        self.index = index
+        self.query = query
+        self.cause = cause
+
+    @property
+    def message(self):
+        if isinstance(self.cause, KeyError):
+            # the pages of PDFLocs are indexed from 0
+            return describe_lookup_error(self.cause, 0)
+        return str(self.cause)
+
+    def __repr__(self):
+        return "Error converting query %i (%s): %s" % (self.index, str(self.query), self.message)
+
+    def __str__(self):
+        return self.__repr__()
+
+
 class PDFLocConverter(object):
-    def __init__(self, document, pdflocs=[], bboxes=[]):
+    def __init__(self, document, pdflocs=[], bboxes=[], cache=None, instrumentation=None, memory_map=False):
         """
         Initialize the converter with the given document.
 
@@ -33,26 +101,59 @@ class PDFLocConverter(object):
 
         :param pdflocs: A list of PDFLocs of interest - only pages corresponding to them are
                             to be parsed.
-        :type pdflocs: list
+        :type pdflocs: list | PDFLocBatch
 
         :param bboxes: A list of bounding boxes of interest - only pages corresponding to
                             them are to be parsed.
         :type bboxes: list
+
+        :param cache: If given, the parsed pages are looked up in (and stored to) this cache,
+                        so that repeated conversions on the same document don't need to
+                        parse it again.
+        :type cache: PDFLocCache | None
+
+        :param instrumentation: Receives the statistics of parsing the pages (e.g. PDFLocStatsCollector).
+                                    By default, the statistics are not collected anywhere.
+        :type instrumentation: PDFLocInstrumentation | None
+
+        :param memory_map: If True, the file is memory-mapped and the document is parsed from the
+                            mapping instead of reading the file in small chunks. This makes the
+                            random access to the document objects much cheaper, especially on
+                            slow (e.g. network) storage. The mapping is closed together with
+                            the file. Only possible if the document is given as a filename or
+                            an open file.
+        :type memory_map: bool
+
+        :raises ValueError: If memory mapping is requested for a prepared PDFDocument.
         """
         super(PDFLocConverter, self).__init__()
 
         # if document is given as a filename and we open it automatically here,
         # we need to remember the file handle to close it when the document is parsed
         self.__source_file_handle = None
+        # the file name is needed by parallel parsing, where each worker opens the document itself
+        self.__source_filename = None
+        self._memory_map = memory_map
+
+        assert cache is None or isinstance(cache, PDFLocCache)
+        self._cache = cache
+
+        assert instrumentation is None or isinstance(instrumentation, PDFLocInstrumentation)
+        self._instrumentation = instrumentation if instrumentation is not None else PDFLocInstrumentation()
 
         if isinstance(document, PDFDocument):
+            if memory_map:
+                raise ValueError("Memory mapping needs the document to be given as a filename or an open file.")
             self._pdf_document = document
         elif isinstance(document, basestring):
-            self.__source_file_handle = file(document, 'rb')
+            self.__source_filename = document
+            self.__source_file_handle = _open_source(file(document, 'rb'), memory_map)
             parser = PDFParser(self.__source_file_handle)
             self._pdf_document = PDFDocument(parser)
         elif type(document) == file:
-            self.__source_file_handle = document
+            if os.path.isfile(document.name):
+                self.__source_filename = document.name
+            self.__source_file_handle = _open_source(document, memory_map)
             parser = PDFParser(self.__source_file_handle)
             self._pdf_document = PDFDocument(parser)
         else:
@@ -62,6 +163,25 @@ class PDFLocConverter(object):
         self._only_pages = None
         self._navigation_tree = None
 
+        # state of on-demand parsing; _parsed_pages is an LRU-ordered dict pageno => page index
+        self._parsed_pages = None
+        self._max_parsed_pages = None
+        self._max_parsed_memory = None
+        self._lazy_layout = False
+        # the page tree of the PDF document; created on the first use
+        self._pdf_pages = None
+        self._fingerprint = None
+        # the full-text index of the pages (filled by the searches) and the bounding boxes
+        # of whole lines computed by the searches
+        self._text_index = None
+        self._search_line_cache = None
+        self._interpreter = None
+        self._device = None
+
+        # statistics of the parsing
+        self.parse_time = 0.0
+        self.parsed_page_count = 0
+
         self.restrict_only_on_pages_from(pdflocs, bboxes)
 
     def restrict_only_on_pages_from(self, pdflocs=[], bboxes=[], only_pages=set()):
@@ -73,7 +193,7 @@ class PDFLocConverter(object):
 
         :param pdflocs: A list of PDFLocs of interest - only pages corresponding to them are
                             to be parsed.
-        :type pdflocs: list
+        :type pdflocs: list | PDFLocBatch
 
         :param bboxes: A list of bounding boxes of interest - only pages corresponding to
                             them are to be parsed.
@@ -88,6 +208,9 @@ class PDFLocConverter(object):
             raise RuntimeError("Cannot restrict pages in an already parsed document.")
 
         self._only_pages = set(only_pages)
+        if isinstance(pdflocs, PDFLocBatch):
+            self._only_pages.update(pdflocs.pages_covered)
+            pdflocs = []
         for pdfloc in pdflocs:
             if isinstance(pdfloc, PDFLoc):
                 self._only_pages.add(pdfloc.page)
@@ -96,7 +219,8 @@ class PDFLocConverter(object):
 
         for bbox in bboxes:
             if isinstance(bbox, PDFLocBoundingBoxes):
-                self._only_pages.update(bbox.pages_covered)
+                # bounding boxes have their pages indexed from 1
+                self._only_pages.update(page - 1 for page in bbox.pages_covered)
 
         if len(self._only_pages) == 0:
             self._only_pages = None
@@ -109,7 +233,7 @@ class PDFLocConverter(object):
         """
         return self._pdfloc_document is not None
 
-    def parse_document(self):
+    def parse_document(self, workers=None, lazy_layout=False):
         """
         Parse the document and prepare the internal PDFLoc-decoding structures.
 
@@ -117,37 +241,79 @@ class PDFLocConverter(object):
 
         Only close the document parser's source stream after calling this method.
 
+        :param workers: If greater than 1, the pages are parsed in a pool of this many
+                            processes. Each process opens the document file by itself, so
+                            the document has to be given as a filename or a file opened
+                            from one. The result is the same as with serial parsing.
+        :type workers: int | None
+
+        :param lazy_layout: If True, the layout analysis of the pages is postponed until
+                                a query needs the text lines of the page (which
+                                pdfloc_pair_to_bboxes() does). This saves a lot of time if only
+                                pdfloc_to_xy() queries are going to be answered.
+        :type lazy_layout: bool
+
         :raises RuntimeError: If this function is called more than once.
         :raises RuntimeError: If the document parser's source stream has already been closed.
+        :raises ValueError: If parallel parsing is requested, but the document wasn't given
+                                as a filename or a file opened from one.
         """
 
         if self.is_document_parsed():
             raise RuntimeError("parse_document can only be called once.")
 
-        la = LAParams()
-        rm = PDFResourceManager()
-        dev = PDFLocPageAnalyzer(rm, laparams=la)
-        interp = PDFLocInterpreter(rm, dev)
-        dev.set_interpreter(interp)
+        if workers is not None and workers > 1 and self.__source_filename is None:
+            raise ValueError("Parallel parsing needs the document to be given as a filename or a file opened from one.")
 
-        self._navigation_tree = NavigationTree()
-        self._pdfloc_document = PDFLocDocument()
+        start_time = time.time()
 
-        for (pageno, page) in enumerate(PDFPage.create_pages(self._pdf_document)):
-
-            if self._only_pages is not None and pageno not in self._only_pages:
-                continue
+        self._navigation_tree = NavigationTree()
+        self._pdfloc_document = PDFLocDocument(instrumentation=self._instrumentation)
+
+        fingerprint = self._get_fingerprint()
+
+        # page number => page index; all pages are added to the document at the end,
+        # because they need to be added in the page order
+        parsed_pages = {}
+        pages_to_parse = []
+        # only the wanted pages are looked up in the page tree, the others are not even constructed
+        for (pageno, page) in self._get_pdf_pages().get_pages(self._only_pages):
+            cache_key = None
+            if self._cache is not None:
+                cache_key = self._cache.page_key(fingerprint, pageno, page)
+                page_index = self._load_cached_page(pageno, cache_key)
+                if page_index is not None:
+                    parsed_pages[pageno] = page_index
+                    continue
+
+            pages_to_parse.append((pageno, page, cache_key))
+
+        if workers is not None and workers > 1 and len(pages_to_parse) > 1:
+            page_indices = self._parse_pages_in_parallel(
+                [pageno for (pageno, _, _) in pages_to_parse], workers, lazy_layout)
+            for (pageno, _, cache_key) in pages_to_parse:
+                (page_index, stats) = page_indices[pageno]
+                parsed_pages[pageno] = page_index
+                self._instrumentation.page_parsed(stats)
+
+                if self._cache is not None:
+                    self._cache.store(cache_key, page_index)
+        else:
+            (interp, dev) = _create_interpreter(lazy_layout)
+            for (pageno, page, cache_key) in pages_to_parse:
+                (parsed_pages[pageno], stats) = _parse_page(interp, dev, pageno, page)
+                self._instrumentation.page_parsed(stats)
 
-            interp.process_page(page)
+                if self._cache is not None:
+                    self._cache.store(cache_key, parsed_pages[pageno])
 
-            self._navigation_tree[pageno] = dev.coords_to_chars
-            self._pdfloc_document.add(dev.get_result())
+        self._add_page_indices(parsed_pages)
 
-            print "Page no. %i contains %i keywords" % (pageno, interp.keyword_count)
+        self.parse_time += time.time() - start_time
+        self.parsed_page_count += len(pages_to_parse)
 
         # if we opened the source file, close it now, because we no longer need it
-        if self.__source_file_handle is not None and not self.__source_file_handle.closed:
-            self.__source_file_handle.close()
+        self.close()
 
         # assert objs_per_page[0][73][0:2] == ["w","ork"]
         # assert objs_per_page[0][79][0] == "in"
@@ -157,27 +323,464 @@ class PDFLocConverter(object):
         # assert objs_per_page[4][1278][0] == "A."
         # assert objs_per_page[3][2961][0:2] == [".", "F"]
 
+    def load_page_indices(self, page_indices):
+        """
+        Use pages parsed by another converter of the same document (e.g. in another process,
+        see get_page_indices()) instead of calling parse_document().
+
+        :param page_indices: Dict page number (indexed from 0) => PageIndex.
+        :type page_indices: dict
+
+        :raises RuntimeError: If the document has already been parsed.
+        """
+        if self.is_document_parsed():
+            raise RuntimeError("The document has already been parsed.")
+
+        self._navigation_tree = NavigationTree()
+        self._pdfloc_document = PDFLocDocument(instrumentation=self._instrumentation)
+        self._add_page_indices(page_indices)
+
+        # the source file is not needed for conversions of parsed pages
+        self.close()
+
+    def get_page_indices(self):
+        """
+        Return the indices of the parsed pages.
+
+        The indices can be pickled, so they can be sent to another process and loaded there
+        by load_page_indices().
+
+        :return: Dict page number (indexed from 0) => PageIndex.
+        :rtype: dict
+
+        :raises RuntimeError: If the document hasn't been parsed yet.
+        """
+        if not self.is_document_parsed():
+            raise RuntimeError("The document hasn't been parsed yet.")
+
+        return dict((pageno, self._navigation_tree[pageno]) for pageno in self._navigation_tree)
+
+    def _add_page_indices(self, page_indices):
+        # the pages need to be added to the document in the page order
+        for pageno in sorted(page_indices.keys()):
+            self._navigation_tree[pageno] = page_indices[pageno]
+            self._pdfloc_document.add(page_indices[pageno])
+
+    def parse_on_demand(self, max_pages=None, max_memory=None, lazy_layout=False):
+        """
+        Prepare the internal PDFLoc-decoding structures for parsing the document pages on demand.
+
+        This is an alternative to parse_document(). No pages are parsed in advance (except the
+        ones given to restrict_only_on_pages_from()), but each query parses the pages it needs
+        the first time they are touched. The parsed pages are kept in a least-recently-used
+        cache bounded by max_pages and max_memory; evicted pages are parsed again when they
+        are needed. The pages needed by a single query are never evicted while answering it.
+
+        The document parser's source stream needs to stay open until close() is called.
+
+        :param max_pages: Maximum number of parsed pages kept in memory (None means unbounded).
+        :type max_pages: int | None
+
+        :param max_memory: Maximum (estimated) memory occupied by the parsed pages in bytes
+                            (None means unbounded).
+        :type max_memory: int | None
+
+        :param lazy_layout: If True, the layout analysis of the pages is postponed (see
+                                parse_document()).
+        :type lazy_layout: bool
+
+        :raises RuntimeError: If the document has already been parsed.
+        """
+        if self.is_document_parsed():
+            raise RuntimeError("The document has already been parsed.")
+
+        self._navigation_tree = NavigationTree()
+        self._pdfloc_document = PDFLocDocument(instrumentation=self._instrumentation)
+
+        self._parsed_pages = collections.OrderedDict()
+        self._max_parsed_pages = max_pages
+        self._max_parsed_memory = max_memory
+        self._lazy_layout = lazy_layout
+
+        if self._only_pages is not None:
+            self._ensure_pages_parsed(self._only_pages)
+
+    def is_parsing_on_demand(self):
+        """
+        Return true if the pages are parsed on demand (see parse_on_demand()).
+        :rtype bool:
+        """
+        return self._parsed_pages is not None
+
+    @property
+    def memory_size(self):
+        """
+        The estimated memory occupied by the parsed pages and the full-text index in bytes.
+        :rtype: int
+        """
+        if self._navigation_tree is None:
+            return 0
+        size = sum(self._navigation_tree[pageno].memory_size for pageno in self._navigation_tree)
+        if self._text_index is not None:
+            size += self._text_index.memory_size
+        return size
+
+    def close(self):
+        """
+        Close the document source stream if it was opened by the converter (and its memory mapping).
+
+        After calling this, no more pages can be parsed.
+        """
+        if self.__source_file_handle is not None and not self.__source_file_handle.closed:
+            self.__source_file_handle.close()
+
+    def _ensure_pages_parsed(self, pagenos):
+        """
+        When parsing on demand, make sure the given pages are parsed and mark them as
+        recently used. Pages out of the document range are ignored.
+        """
+        if self._parsed_pages is None:
+            return
+
+        pagenos = set(pagenos)
+        pdf_pages = self._get_pdf_pages()
+        for pageno in sorted(pagenos):
+            if pageno in self._parsed_pages:
+                # move the page to the most recently used position
+                self._parsed_pages[pageno] = self._parsed_pages.pop(pageno)
+                continue
+
+            if not 0 <= pageno < len(pdf_pages):
+                continue
+
+            page_index = self._load_or_parse_page(pageno, pdf_pages[pageno])
+            self._parsed_pages[pageno] = page_index
+            self._navigation_tree[pageno] = page_index
+            self._pdfloc_document.add(page_index)
+
+        self._evict_parsed_pages(pagenos)
+
+    def _load_or_parse_page(self, pageno, page):
+        cache_key = None
+        if self._cache is not None:
+            cache_key = self._cache.page_key(self._get_fingerprint(), pageno, page)
+            page_index = self._load_cached_page(pageno, cache_key)
+            if page_index is not None:
+                return page_index
+
+        if self._interpreter is None:
+            (self._interpreter, self._device) = _create_interpreter(self._lazy_layout)
+
+        start_time = time.time()
+        (page_index, stats) = _parse_page(self._interpreter, self._device, pageno, page)
+        self.parse_time += time.time() - start_time
+        self.parsed_page_count += 1
+        self._instrumentation.page_parsed(stats)
+
+        if self._cache is not None:
+            self._cache.store(cache_key, page_index)
+
+        return page_index
+
+    def _load_cached_page(self, pageno, cache_key):
+        start_time = time.time()
+        page_index = self._cache.load(cache_key)
+        if page_index is not None:
+            self._instrumentation.page_loaded(pageno, time.time() - start_time)
+        return page_index
+
+    def _evict_parsed_pages(self, pagenos_in_use):
+        while self._is_over_parsed_pages_budget():
+            # find the least recently used page that is not needed right now
+            evicted_pageno = None
+            for pageno in self._parsed_pages:
+                if pageno not in pagenos_in_use:
+                    evicted_pageno = pageno
+                    break
+
+            if evicted_pageno is None:
+                break
+
+            page_index = self._parsed_pages.pop(evicted_pageno)
+            del self._navigation_tree[evicted_pageno]
+            self._pdfloc_document.remove(page_index)
+
+    def _is_over_parsed_pages_budget(self):
+        if self._max_parsed_pages is not None and len(self._parsed_pages) > self._max_parsed_pages:
+            return True
+        if self._max_parsed_memory is not None:
+            memory = sum(page_index.memory_size for page_index in self._parsed_pages.itervalues())
+            if memory > self._max_parsed_memory:
+                return True
+        return False
+
+    def _get_pdf_pages(self):
+        if self._pdf_pages is None:
+            self._pdf_pages = PDFPageTree(self._pdf_document)
+        return self._pdf_pages
+
+    def _get_fingerprint(self):
+        if self._cache is None:
+            return None
+        if self._fingerprint is None:
+            self._fingerprint = self._cache.document_fingerprint(self._get_source_stream())
+        return self._fingerprint
+
+    def _parse_pages_in_parallel(self, pagenos, workers, lazy_layout):
+        # split the pages into contiguous ranges, one for each worker
+        chunk_size = (len(pagenos) + workers - 1) // workers
+        chunks = [pagenos[i:i+chunk_size] for i in range(0, len(pagenos), chunk_size)]
+
+        pool = multiprocessing.Pool(min(workers, len(chunks)))
+        try:
+            results = pool.map(_parse_pages, [(self.__source_filename, chunk, lazy_layout, self._memory_map)
+                                              for chunk in chunks])
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        page_indices = {}
+        for chunk_result in results:
+            for (pageno, page_index, stats) in chunk_result:
+                page_indices[pageno] = (page_index, stats)
+        return page_indices
+
+    def _get_source_stream(self):
+        if self.__source_file_handle is not None:
+            return self.__source_file_handle
+
+        # a prepared PDFDocument was given, so use its parser's stream
+        parser = getattr(self._pdf_document, "_parser", None)
+        if parser is None or getattr(parser, "fp", None) is None:
+            raise RuntimeError("Cannot access the source stream of the document to compute its fingerprint.")
+        return parser.fp
+
     def pdfloc_pair_to_bboxes(self, pdfloc_pair):
         assert isinstance(pdfloc_pair, PDFLocPair)
 
+        self._ensure_pages_parsed(pdfloc_pair.pages_covered)
+
         start_char = self._navigation_tree.find_layout_char(pdfloc_pair.start)
         end_char = self._navigation_tree.find_layout_char(pdfloc_pair.end)
 
         bboxes = self._pdfloc_document.find_bboxes_between_chars(start_char, end_char)
         return bboxes
 
+    def pdfloc_pairs_to_bboxes(self, pdfloc_pairs):
+        """
+        Convert a batch of PDFLoc pairs to bounding boxes.
+
+        The queries are processed grouped by their start pages. Each distinct PDFLoc of a group
+        is looked up only once, and text lines covered by more queries are only extracted once.
+        When parsing on demand, the pages of a group are parsed just before processing it.
+
+        :param pdfloc_pairs: The queries; either PDFLocPair objects or tuples of PDFLoc strings,
+                                or a PDFLocBatch, which is processed without creating the PDFLocPairs.
+        :type pdfloc_pairs: list | PDFLocBatch
+
+        :return: A list with an item for each query, in the order of the queries. The item is
+                    either the list of bounding boxes (as returned by pdfloc_pair_to_bboxes()),
+                    or a PDFLocQueryError if the query couldn't be converted.
+        :rtype: list
+        """
+        results = [None] * len(pdfloc_pairs)
+
+        # start page => list of (query index, start location, end location), where a location is
+        # a tuple (page, keyword_num, string_num, instring_num)
+        queries_by_page = {}
+        if isinstance(pdfloc_pairs, PDFLocBatch):
+            for (index, start, end) in itertools.izip(itertools.count(), pdfloc_pairs.start.locations(),
+                                                      pdfloc_pairs.end.locations()):
+                queries_by_page.setdefault(start[0], []).append((index, start, end))
+        else:
+            for (index, query) in enumerate(pdfloc_pairs):
+                try:
+                    pdfloc_pair = _to_pdfloc_pair(query)
+                except ValueError as e:
+                    results[index] = PDFLocQueryError(index, query, e)
+                    continue
+                queries_by_page.setdefault(pdfloc_pair.start.page, []).append(
+                    (index, _get_location(pdfloc_pair.start), _get_location(pdfloc_pair.end)))
+
+        line_cache = {}
+        for pageno in sorted(queries_by_page.keys()):
+            queries = queries_by_page[pageno]
+
+            pagenos = set()
+            for (_, start, end) in queries:
+                pagenos.update(xrange(start[0], end[0] + 1))
+            self._ensure_pages_parsed(pagenos)
+
+            # location => char
+            chars = {}
+            for (index, start, end) in queries:
+                try:
+                    start_char = self._find_layout_char_memoized(start, chars)
+                    end_char = self._find_layout_char_memoized(end, chars)
+                    results[index] = self._pdfloc_document.find_bboxes_between_chars(
+                        start_char, end_char, line_cache)
+                except (KeyError, RuntimeError) as e:
+                    results[index] = PDFLocQueryError(index, _to_pdfloc_pair(pdfloc_pairs[index]), e)
+
+        return results
+
+    def _find_layout_char_memoized(self, location, chars):
+        char = chars.get(location)
+        if char is None:
+            char = self._navigation_tree.find_layout_char_at(*location)
+            chars[location] = char
+        return char
+
     def pdfloc_to_xy(self, pdfloc):
+        self._ensure_pages_parsed([pdfloc.page])
         char = self._navigation_tree.find_layout_char(pdfloc)
         return self._pdfloc_document.find_bbox_for_char(char)
 
-    def bboxes_to_pdfloc_pair(self, bboxes):
-        pass  #TODO
+    def bboxes_to_pdfloc_pair(self, bboxes, pdfloc_hash="0000"):
+        """
+        Find the PDFLoc pair covering the text in the given bounding boxes.
+
+        The start of the pair is the first char (in reading order) whose center lies in any of
+        the bounding boxes, and the end of the pair is the last such char, so that
+        pdfloc_pair_to_bboxes() returns the bounding boxes of the same text.
+
+        :param bboxes: The bounding boxes. Their pages are numbered the same way as the pages
+                        of the bboxes returned by pdfloc_pair_to_bboxes() (i.e. indexed from 1).
+        :type bboxes: PDFLocBoundingBoxes
+
+        :param pdfloc_hash: The document hash to put in the returned PDFLocs.
+        :type pdfloc_hash: basestring
+
+        :return: The PDFLoc pair, or None if there is no char in the bounding boxes.
+        :rtype: PDFLocPair | None
+
+        :raises KeyError: If a page of the bounding boxes hasn't been parsed.
+        """
+        assert isinstance(bboxes, PDFLocBoundingBoxes)
+
+        self._ensure_pages_parsed(page - 1 for page in bboxes.pages_covered)
+
+        chars = []
+        for bbox in bboxes.bboxes:
+            chars.extend(self._navigation_tree.find_chars_in(bbox.page - 1, bbox.bbox))
+
+        if len(chars) == 0:
+            return None
+
+        start = min(chars, key=self._pdfloc_document.reading_order_key)
+        end = max(chars, key=self._pdfloc_document.reading_order_key)
+
+        return PDFLocPair(self._get_pdfloc(start, pdfloc_hash), self._get_pdfloc(end, pdfloc_hash), bboxes._comment)
+
+    def xy_to_pdfloc(self, xy, tolerance=2.0, pdfloc_hash="0000"):
+        """
+        Find the PDFLoc of the char containing the given point, or of the char nearest to it.
+
+        :param xy: The point. Its page is numbered the same way as the pages of the bboxes
+                    returned by pdfloc_to_xy() (i.e. indexed from 1).
+        :type xy: PointOnPage
+
+        :param tolerance: Maximum distance of the char from the point (in PDF page units).
+        :type tolerance: float
+
+        :param pdfloc_hash: The document hash to put in the returned PDFLoc.
+        :type pdfloc_hash: basestring
+
+        :return: The PDFLoc of the found char, or None if there is no char close enough.
+        :rtype: PDFLoc | None
+
+        :raises KeyError: If the page of the point hasn't been parsed.
+        """
+        assert isinstance(xy, PointOnPage)
+
+        page = xy.page - 1
+        self._ensure_pages_parsed([page])
+        char = self._navigation_tree.find_char_at(page, xy.point.x, xy.point.y, tolerance)
+        if char is None:
+            return None
+
+        return self._get_pdfloc(char, pdfloc_hash)
+
+    def search(self, query, ignore_case=False, pdfloc_hash="0000"):
+        """
+        Find all occurrences of the given text in the parsed pages.
+
+        The text of the pages is searched in the reading order. Whitespace in the query matches
+        any whitespace in the document, including line and page breaks, so phrases broken to more
+        lines are found, too. The occurrences don't overlap.
+
+        The pages are added to the full-text index by the first search and reused by the next
+        ones; pages parsed later are added by the next search. When parsing on demand, all pages
+        of the document are searched: the pages not indexed yet are parsed one by one within the
+        limits of parse_on_demand() (so earlier pages may be evicted meanwhile), and only the pages
+        containing the found occurrences are parsed again to get their PDFLocs and bounding boxes.
+
+        :param query: The text to look for. Byte strings are decoded as UTF-8.
+        :type query: basestring
+
+        :param ignore_case: Whether the letter case should be ignored.
+        :type ignore_case: bool
+
+        :param pdfloc_hash: The document hash to put in the returned PDFLocs.
+        :type pdfloc_hash: basestring
+
+        :return: List of tuples (PDFLocPair, list of bounding boxes) of the occurrences in the
+                    reading order. The bounding boxes are the same as pdfloc_pair_to_bboxes()
+                    returns for the pair.
+        :rtype: list
+
+        :raises RuntimeError: If the document hasn't been parsed yet.
+        :raises ValueError: If the query contains only whitespace.
+        """
+        if not self.is_document_parsed():
+            raise RuntimeError("The document hasn't been parsed yet.")
+
+        if self._text_index is None:
+            self._text_index = PDFLocTextIndex()
+            self._search_line_cache = {}
 
-    def xy_to_pdfloc(self, xy):
-        pass  #TODO
+        if self.is_parsing_on_demand():
+            pagenos = xrange(len(self._get_pdf_pages()))
+        else:
+            pagenos = list(self._navigation_tree)
+
+        for pageno in pagenos:
+            if pageno in self._text_index:
+                continue
+            # only the indexed page is in use, so the others may be evicted
+            self._ensure_pages_parsed([pageno])
+            page = self._navigation_tree[pageno]
+            self._pdfloc_document.analyze_postponed_layout(page)
+            self._text_index.add_page(pageno, page)
+
+        # with limited on-demand parsing, the bounding boxes of lines of evicted pages are not kept
+        if self._max_parsed_pages is None and self._max_parsed_memory is None:
+            line_cache = self._search_line_cache
+        else:
+            line_cache = {}
+
+        results = []
+        for ((start_pageno, start_row), (end_pageno, end_row)) in self._text_index.find(query, ignore_case):
+            # the bounding boxes are taken from all pages between the ends of the occurrence
+            self._ensure_pages_parsed(xrange(start_pageno, end_pageno + 1))
+            start_char = CharRef(self._navigation_tree[start_pageno], start_row)
+            end_char = CharRef(self._navigation_tree[end_pageno], end_row)
+
+            pdfloc_pair = PDFLocPair(self._get_pdfloc(start_char, pdfloc_hash), self._get_pdfloc(end_char, pdfloc_hash))
+            results.append((pdfloc_pair, self._pdfloc_document.find_bboxes_between_chars(
+                start_char, end_char, line_cache)))
+        return results
+
+    def _get_pdfloc(self, char, pdfloc_hash):
+        (keyword_num, string_num, instring_num) = char.page.char_location(char.row)
+        # layout page ids are the page numbers indexed from 1
+        return PDFLoc.from_parts(pdfloc_hash, char.page.pageid - 1, keyword_num, string_num, instring_num)
 
     @staticmethod
-    def pdflocs_to_bboxes(document, pdfloc_strings):
+    def pdflocs_to_bboxes(document, pdfloc_strings, cache=None):
         """
         Parse the given document and return a list of bounding boxes corresponding to the
         given list of PDFLocs.
@@ -188,26 +791,155 @@ class PDFLocConverter(object):
         :param pdfloc_strings: A list of pairs (tuples) of strings with the PDFLocs.
         :type pdfloc_strings: list
 
+        :param cache: The cache of parsed pages to use.
+        :type cache: PDFLocCache | None
+
         :return: The corresponding bounding boxes. There is a list of boundingboxes
-                    corresponing to each one PDFLoc. Indices in the returned list
-                    correspond to the order in which pdfloc_strings are iterated.
+                    corresponing to each one PDFLoc, or a PDFLocQueryError if the PDFLoc
+                    couldn't be converted. Indices in the returned list correspond to the
+                    order in which pdfloc_strings are iterated.
         :rtype list:
         """
+        pdfloc_strings = list(pdfloc_strings)
+
         pdflocs = []
         for pdfloc_string in pdfloc_strings:
-            if isinstance(pdfloc_string, tuple) and len(pdfloc_string) == 2:
-                (start, end) = pdfloc_string
-                pdflocs.append(PDFLocPair(start, end))
-            else:
-                print "Warning: ignoring pdfloc string '%s'" % pdfloc_string
+            try:
+                pdflocs.append(_to_pdfloc_pair(pdfloc_string))
+            except ValueError:
+                pass  # reported by pdfloc_pairs_to_bboxes()
 
-        converter = PDFLocConverter(document, pdflocs)
+        converter = PDFLocConverter(document, pdflocs, cache=cache)
         converter.parse_document()
 
-        result = []
-        for query in pdflocs:
-            if isinstance(query, PDFLocPair):
-                bboxes = converter.pdfloc_pair_to_bboxes(query)
-                result.append(bboxes)
+        return converter.pdfloc_pairs_to_bboxes(pdfloc_strings)
+
+
+def _to_pdfloc_pair(query):
+    """
+    Convert a query of a batch to a PDFLoc pair.
+
+    :param query: Either a PDFLocPair or a tuple of two PDFLoc strings.
+    :type query: PDFLocPair | tuple
+
+    :rtype: PDFLocPair
+
+    :raises ValueError: If the query is neither of the accepted types or the PDFLocs can't be parsed.
+    """
+    if isinstance(query, PDFLocPair):
+        return query
+    if isinstance(query, tuple) and len(query) == 2:
+        (start, end) = query
+        return PDFLocPair(start, end)
+    raise ValueError("Not a pair of PDFLocs: %r" % (query,))
+
+
+def _get_location(pdfloc):
+    return (pdfloc.page, pdfloc.keyword_num, pdfloc.string_num, pdfloc.instring_num)
+
+
+def _create_interpreter(lazy_layout=False):
+    """
+    Create the interpreter and page analyzer used for parsing documents.
+
+    :param lazy_layout: Whether the layout analysis of the pages should be postponed.
+    :type lazy_layout: bool
+
+    :return: The interpreter and the page analyzer.
+    :rtype: tuple
+    """
+    la = LAParams()
+    rm = PDFLocResourceManager()
+    dev = PDFLocPageAnalyzer(rm, laparams=la, lazy_layout=lazy_layout)
+    interp = PDFLocInterpreter(rm, dev)
+    dev.set_interpreter(interp)
+    return interp, dev
+
+
+def _parse_page(interp, dev, pageno, page):
+    """
+    Parse the given page and return its index.
+
+    :param interp: The interpreter created by _create_interpreter().
+    :type interp: PDFLocInterpreter
+
+    :param dev: The page analyzer created by _create_interpreter().
+    :type dev: PDFLocPageAnalyzer
+
+    :param pageno: The page number (indexed from 0).
+    :type pageno: int
+
+    :param page: The page.
+    :type page: PDFPage
+
+    :return: Tuple (page index, PageParseStats).
+    :rtype: tuple
+    """
+    # number the layout pages by their position in the document, not by the parse order
+    dev.pageno = pageno + 1
+
+    start_time = time.time()
+    interp.process_page(page)
+    process_time = time.time() - start_time
+
+    # only the compact index is kept, the layout objects are freed with the next page
+    start_time = time.time()
+    page_index = dev.get_result().build_index(dev.coords_to_chars)
+    indexing_time = time.time() - start_time
+
+    stats = PageParseStats(pageno, process_time - dev.layout_time, dev.layout_time, indexing_time,
+                           interp.keyword_count, page_index.char_count, interp.xobject_count,
+                           interp.recorded_form_count, page_index.memory_size)
+    return page_index, stats
+
+
+def _parse_pages(args):
+    """
+    Parse the given pages of a document and return their indices.
+
+    This is the work unit of PDFLocConverter.parse_document() when parsing in parallel. It is
+    executed in a worker process, so it opens the document by itself.
+
+    :param args: The document filename, the sorted list of page numbers to parse, whether the
+                    layout analysis should be postponed and whether the file should be memory-mapped.
+    :type args: tuple
+
+    :return: List of tuples (page number, page index, PageParseStats).
+    :rtype: list
+    """
+    (filename, pagenos, lazy_layout, memory_map) = args
+
+    result = []
+    source = _open_source(open(filename, 'rb'), memory_map)
+    try:
+        document = PDFDocument(PDFParser(source))
+        (interp, dev) = _create_interpreter(lazy_layout)
+
+        for (pageno, page) in PDFPageTree(document).get_pages(pagenos):
+            (page_index, stats) = _parse_page(interp, dev, pageno, page)
+            result.append((pageno, page_index, stats))
+    finally:
+        source.close()
+
+    return result
+
+
+def _open_source(source_file, memory_map):
+    """
+    Return the stream the document should be parsed from.
+
+    :param source_file: The open document file.
+    :type source_file: file
+
+    :param memory_map: Whether the file should be memory-mapped.
+    :type memory_map: bool
 
-        return result
\ No newline at end of file
+    :rtype: file | MemoryMappedStream
+    """
+    if not memory_map:
+        return source_file
+    try:
+        return MemoryMappedStream(source_file)
+    except:
+        source_file.close()
+        raise
@@ -1,26 +1,91 @@
+import array
+import collections
+import math
+
 from pdfloc_converter.pdfloc import PDFLoc
 
 __author__ = 'Martin Pecka'
 
+
+# reference to a char (a row) in a page index
+class CharRef(collections.namedtuple("CharRef", ["page", "row"])):
+    """
+    A reference to a char of a page index: the page index and the row of the char in it.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        location = self.page.char_location(self.row)
+        if location is None:
+            location = "no position in the page content"
+        else:
+            location = "keyword %i, string %i, char %i" % location
+        return "char %r on page %i (%s)" % (self.page.char_text(self.row), self.page.pageid, location)
+
+
 class NavigationTree(object):
     def __init__(self):
         super(NavigationTree, self).__init__()
 
         self._tree = dict()
 
+    def find_char_at(self, page, x, y, tolerance):
+        """
+        Find the char containing the given point, or the nearest char not further than the
+        tolerance.
+
+        :param int page: The page number (indexed from 0).
+        :param float x: The x coordinate.
+        :param float y: The y coordinate.
+        :param float tolerance: Maximum distance of the char from the point.
+        :return: The found char, or None if there is no char close enough.
+        :rtype: CharRef | None
+
+        :raises KeyError: If the page hasn't been parsed.
+        """
+        if page not in self._tree:
+            raise KeyError(page)
+
+        page_index = self._tree[page]
+        row = page_index.find_row_at(x, y, tolerance)
+        return CharRef(page_index, row) if row is not None else None
+
+    def find_chars_in(self, page, bbox):
+        """
+        Find the chars whose centers lie in the given bbox.
+
+        :param int page: The page number (indexed from 0).
+        :param tuple|BoundingBox bbox: The bbox (x0, y0, x1, y1); the corners may be given in any order.
+        :return: The found chars.
+        :rtype: list
+
+        :raises KeyError: If the page hasn't been parsed.
+        """
+        if page not in self._tree:
+            raise KeyError(page)
+
+        page_index = self._tree[page]
+        (x0, y0, x1, y1) = bbox[0:4]
+        rows = page_index.find_rows_in(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        return [CharRef(page_index, row) for row in rows]
+
     def find_layout_char(self, pdfloc):
         assert isinstance(pdfloc, PDFLoc)
-    
-        if pdfloc.page not in self._tree:
-            raise KeyError(pdfloc.page)
-        if pdfloc.keyword_num not in self._tree[pdfloc.page]:
-            raise KeyError(pdfloc.keyword_num)
-        if pdfloc.string_num >= len(self._tree[pdfloc.page][pdfloc.keyword_num]):
-            raise KeyError(pdfloc.string_num)
-        if pdfloc.instring_num >= len(self._tree[pdfloc.page][pdfloc.keyword_num][pdfloc.string_num]):
-            raise KeyError(pdfloc.instring_num)
-    
-        return self._tree[pdfloc.page][pdfloc.keyword_num][pdfloc.string_num][pdfloc.instring_num]
+
+        return self.find_layout_char_at(pdfloc.page, pdfloc.keyword_num, pdfloc.string_num, pdfloc.instring_num)
+
+    def find_layout_char_at(self, page, keyword_num, string_num, instring_num):
+        """
+        Find the char at the given position in the page content (the parts of a PDFLoc).
+
+        :raises KeyError: If the page hasn't been parsed or it has no such char.
+        """
+        if page not in self._tree:
+            raise KeyError(page)
+
+        page_index = self._tree[page]
+        return CharRef(page_index, page_index.find_row(keyword_num, string_num, instring_num))
 
     def __contains__(self, item):
         return item in self._tree
@@ -29,6 +94,7 @@ class NavigationTree(object):
         return self._tree[key]
 
     def __setitem__(self, key, value):
+        assert isinstance(value, PageIndex)
         self._tree[key] = value
 
     def __delitem__(self, key):
@@ -38,4 +104,372 @@ class NavigationTree(object):
         return iter(self._tree)
 
     def __len__(self):
-        return len(self._tree)
\ No newline at end of file
+        return len(self._tree)
+
+
+class PageIndex(object):
+    """
+    Compact index of the characters and text lines of a single page.
+
+    The chars of the page are stored as rows of flat arrays (bboxes, offsets to the text of
+    the page, line numbers). The text lines are stored in reading order as sequences of items,
+    where each item is either a char row or an annotation text (spaces and newlines added by
+    the layout analysis). An offset table maps (keyword_num, string_num, instring_num) to
+    the char rows.
+
+    The index holds no references to pdfminer objects, so it is cheap to keep and it can be
+    pickled.
+    """
+
+    # the row is not part of any text line
+    NO_LINE = -1
+    # the row has no position in the page content (is not referenced by any keyword)
+    NO_LOCATION = -1
+
+    # maximum number of cells of the spatial index in one direction
+    _max_grid_size = 256
+
+    def __init__(self, pageid, bbox):
+        super(PageIndex, self).__init__()
+
+        self.pageid = pageid
+        self.bbox = tuple(bbox)
+
+        # char rows: 4 numbers per row in _char_bboxes; the text of row r is
+        # _text[_text_offsets[r]:_text_offsets[r+1]]
+        self._char_bboxes = array.array('d')
+        self._text_offsets = array.array('i', [0])
+        self._text = u""
+        self._pending_texts = []
+        self._char_lines = array.array('i')
+        self._char_positions_in_lines = array.array('i')
+
+        # text lines: 4 numbers per line in _line_bboxes; the items of line l are
+        # _line_items[_line_starts[l]:_line_starts[l+1]], non-negative items are char rows and
+        # negative item i stands for the annotation _annotations[-i-1]
+        self._line_bboxes = array.array('d')
+        self._line_starts = array.array('i', [0])
+        self._line_items = array.array('i')
+        self._annotations = []
+        self._annotation_ids = {}
+
+        # offset table: keyword_num => (index of the first string, number of strings); the char
+        # rows of string s are _string_rows[_string_starts[s]:_string_starts[s+1]]
+        self._keywords = {}
+        self._string_starts = array.array('i', [0])
+        self._string_rows = array.array('i')
+
+        # reverse of the offset table: the keyword_num, string_num and instring_num of each row
+        self._char_keywords = array.array('i')
+        self._char_strings = array.array('i')
+        self._char_instrings = array.array('i')
+
+        # spatial index: a uniform grid of _grid_columns x _grid_rows cells over the page bbox;
+        # the rows of chars overlapping cell c are _grid_items[_grid_starts[c]:_grid_starts[c+1]]
+        self._grid_columns = 0
+        self._grid_rows = 0
+        self._grid_starts = array.array('i')
+        self._grid_items = array.array('i')
+
+        # rows of chars whose layout analysis has been postponed (in the order they were
+        # rendered in); None if the layout of the page is analyzed
+        self._deferred_rows = None
+
+    def add_char(self, bbox, text):
+        """
+        Add a char row.
+
+        :param tuple bbox: The bbox of the char.
+        :param unicode text: The text of the char.
+        :return: The row of the added char.
+        :rtype: int
+        """
+        self._char_bboxes.extend(bbox)
+        self._pending_texts.append(text)
+        self._text_offsets.append(self._text_offsets[-1] + len(text))
+        self._char_lines.append(self.NO_LINE)
+        self._char_positions_in_lines.append(0)
+        self._char_keywords.append(self.NO_LOCATION)
+        self._char_strings.append(self.NO_LOCATION)
+        self._char_instrings.append(self.NO_LOCATION)
+        return len(self._char_lines) - 1
+
+    def add_line(self, bbox, items):
+        """
+        Add a text line. Lines have to be added in reading order.
+
+        :param tuple bbox: The bbox of the line.
+        :param list items: The items of the line - char rows or annotation texts.
+        :return: The number of the added line.
+        :rtype: int
+        """
+        line = self.line_count
+        self._line_bboxes.extend(bbox)
+        for (position, item) in enumerate(items):
+            if isinstance(item, basestring):
+                if item not in self._annotation_ids:
+                    self._annotation_ids[item] = len(self._annotations)
+                    self._annotations.append(item)
+                self._line_items.append(-self._annotation_ids[item] - 1)
+            else:
+                self._line_items.append(item)
+                self._char_lines[item] = line
+                self._char_positions_in_lines[item] = position
+        self._line_starts.append(len(self._line_items))
+        return line
+
+    def add_keyword(self, keyword_num, strings):
+        """
+        Add the offset table entry for a text-showing keyword.
+
+        :param int keyword_num: The keyword number.
+        :param list strings: For each string of the keyword, the list of rows of its chars.
+        """
+        self._keywords[keyword_num] = (len(self._string_starts) - 1, len(strings))
+        for (string_num, rows) in enumerate(strings):
+            self._string_rows.extend(rows)
+            self._string_starts.append(len(self._string_rows))
+            for (instring_num, row) in enumerate(rows):
+                self._char_keywords[row] = keyword_num
+                self._char_strings[row] = string_num
+                self._char_instrings[row] = instring_num
+
+    def defer_layout(self, rows):
+        """
+        Mark the layout analysis of this page as postponed.
+
+        :param list rows: The rows of the chars that take part in the layout analysis, in
+                            the order they were rendered in.
+        """
+        self._deferred_rows = array.array('i', rows)
+
+    def finish_layout(self):
+        """
+        Mark the postponed layout analysis as done (the lines should have been added).
+        """
+        self._deferred_rows = None
+
+    @property
+    def is_layout_analyzed(self):
+        return self._deferred_rows is None
+
+    @property
+    def deferred_rows(self):
+        return self._deferred_rows
+
+    def finish(self):
+        """
+        Finish building the index. Call this after all the chars and keywords have been added.
+        """
+        if self._pending_texts:
+            self._text += u"".join(self._pending_texts)
+            self._pending_texts = []
+            self._build_grid()
+        elif len(self._grid_starts) == 0:
+            # a page without chars still gets a (single empty) cell, so that lookups find nothing
+            self._build_grid()
+
+    def _build_grid(self):
+        # aim at about one char per cell
+        (x0, y0, x1, y1) = self.bbox
+        width = max(x1 - x0, 1.0)
+        height = max(y1 - y0, 1.0)
+        count = max(self.char_count, 1)
+        self._grid_columns = max(1, min(self._max_grid_size, int(math.ceil(math.sqrt(count * width / height)))))
+        self._grid_rows = max(1, min(self._max_grid_size, int(math.ceil(count / float(self._grid_columns)))))
+
+        cells = [[] for _ in xrange(self._grid_columns * self._grid_rows)]
+        for row in xrange(self.char_count):
+            if self._char_keywords[row] == self.NO_LOCATION:
+                continue
+            (cx0, cy0, cx1, cy1) = self.char_bbox(row)
+            (column0, grid_row0) = self._get_grid_cell(cx0, cy0)
+            (column1, grid_row1) = self._get_grid_cell(cx1, cy1)
+            for grid_row in xrange(grid_row0, grid_row1 + 1):
+                for column in xrange(column0, column1 + 1):
+                    cells[grid_row * self._grid_columns + column].append(row)
+
+        self._grid_starts = array.array('i', [0])
+        self._grid_items = array.array('i')
+        for cell in cells:
+            self._grid_items.extend(cell)
+            self._grid_starts.append(len(self._grid_items))
+
+    def _get_grid_cell(self, x, y):
+        (x0, y0, x1, y1) = self.bbox
+        column = int((x - x0) / max(x1 - x0, 1.0) * self._grid_columns)
+        grid_row = int((y - y0) / max(y1 - y0, 1.0) * self._grid_rows)
+        # points outside of the page belong to the border cells
+        return (min(max(column, 0), self._grid_columns - 1),
+                min(max(grid_row, 0), self._grid_rows - 1))
+
+    def find_row(self, keyword_num, string_num, instring_num):
+        """
+        Find the char row corresponding to the given position in the page content.
+
+        :raises KeyError: If there is no such char. The error message tells the missing part of the position
+                            (with the page numbered from 0, as in PDFLocs).
+        """
+        if keyword_num not in self._keywords:
+            raise KeyError("no text keyword %i on page %i" % (keyword_num, self.pageid - 1))
+
+        (first_string, string_count) = self._keywords[keyword_num]
+        if string_num >= string_count:
+            raise KeyError("keyword %i on page %i has no string %i" % (keyword_num, self.pageid - 1, string_num))
+
+        start = self._string_starts[first_string + string_num]
+        end = self._string_starts[first_string + string_num + 1]
+        if instring_num >= end - start:
+            raise KeyError("string %i of keyword %i on page %i has no char %i" % (
+                string_num, keyword_num, self.pageid - 1, instring_num))
+
+        return self._string_rows[start + instring_num]
+
+    def find_row_at(self, x, y, tolerance):
+        """
+        Find the char containing the given point, or the nearest char not further than the
+        tolerance. Only chars with a position in the page content are considered.
+
+        :return: The row of the found char, or None if there is no char close enough.
+        :rtype: int | None
+        """
+        (column0, grid_row0) = self._get_grid_cell(x - tolerance, y - tolerance)
+        (column1, grid_row1) = self._get_grid_cell(x + tolerance, y + tolerance)
+
+        best_row = None
+        best_distance = None
+        for grid_row in xrange(grid_row0, grid_row1 + 1):
+            for cell in xrange(grid_row * self._grid_columns + column0, grid_row * self._grid_columns + column1 + 1):
+                for row in self._grid_items[self._grid_starts[cell]:self._grid_starts[cell+1]]:
+                    (cx0, cy0, cx1, cy1) = self._char_bboxes[4*row:4*row+4]
+                    dx = max(cx0 - x, 0.0, x - cx1)
+                    dy = max(cy0 - y, 0.0, y - cy1)
+                    distance = math.sqrt(dx*dx + dy*dy)
+                    if distance <= tolerance and (best_row is None or (distance, row) < (best_distance, best_row)):
+                        best_row = row
+                        best_distance = distance
+
+        return best_row
+
+    def find_rows_in(self, x0, y0, x1, y1):
+        """
+        Find the chars whose centers lie in the given bbox. Only chars with a position in the
+        page content are considered.
+
+        :return: The rows of the found chars.
+        :rtype: list
+        """
+        (column0, grid_row0) = self._get_grid_cell(x0, y0)
+        (column1, grid_row1) = self._get_grid_cell(x1, y1)
+
+        rows = set()
+        for grid_row in xrange(grid_row0, grid_row1 + 1):
+            for cell in xrange(grid_row * self._grid_columns + column0, grid_row * self._grid_columns + column1 + 1):
+                for row in self._grid_items[self._grid_starts[cell]:self._grid_starts[cell+1]]:
+                    (cx0, cy0, cx1, cy1) = self._char_bboxes[4*row:4*row+4]
+                    if x0 <= (cx0 + cx1) / 2 <= x1 and y0 <= (cy0 + cy1) / 2 <= y1:
+                        rows.add(row)
+
+        return sorted(rows)
+
+    def char_location(self, row):
+        """
+        Return the position of the char in the page content.
+
+        :return: Tuple (keyword_num, string_num, instring_num), or None if the char has no
+                    position in the page content.
+        :rtype: tuple | None
+        """
+        if self._char_keywords[row] == self.NO_LOCATION:
+            return None
+        return self._char_keywords[row], self._char_strings[row], self._char_instrings[row]
+
+    @property
+    def memory_size(self):
+        """
+        Estimate of the memory occupied by the index in bytes.
+        """
+        size = len(self._text) * 4
+        for value in self.__dict__.itervalues():
+            if isinstance(value, array.array):
+                size += value.itemsize * len(value)
+        size += len(self._keywords) * 100
+        return size
+
+    @property
+    def char_count(self):
+        return len(self._char_lines)
+
+    @property
+    def line_count(self):
+        return len(self._line_starts) - 1
+
+    def char_bbox(self, row):
+        return tuple(self._char_bboxes[4*row:4*row+4])
+
+    def char_text(self, row):
+        return self._text[self._text_offsets[row]:self._text_offsets[row+1]]
+
+    def char_line(self, row):
+        return self._char_lines[row]
+
+    def char_position_in_line(self, row):
+        return self._char_positions_in_lines[row]
+
+    def line_bbox(self, line):
+        return tuple(self._line_bboxes[4*line:4*line+4])
+
+    def line_length(self, line):
+        return self._line_starts[line+1] - self._line_starts[line]
+
+    def line_text(self, line, start=0, end=None):
+        """
+        Return the text of the line items from start to end (both inclusive).
+        """
+        first = self._line_starts[line]
+        last = self._line_starts[line+1]
+        if end is not None:
+            last = min(last, first + end + 1)
+        first += start
+
+        texts = []
+        for item in self._line_items[first:last]:
+            if item >= 0:
+                texts.append(self.char_text(item))
+            else:
+                texts.append(self._annotations[-item - 1])
+        return u"".join(texts)
+
+    def line_items(self, line):
+        """
+        Return the items of the line.
+
+        :return: List of tuples (char row, text); the row of annotation texts is None.
+        :rtype: list
+        """
+        items = []
+        for item in self._line_items[self._line_starts[line]:self._line_starts[line+1]]:
+            if item >= 0:
+                items.append((item, self.char_text(item)))
+            else:
+                items.append((None, self._annotations[-item - 1]))
+        return items
+
+    def __getstate__(self):
+        self.finish()
+        state = self.__dict__.copy()
+        # arrays pickle as lists of python objects, which is slow and big
+        arrays = {}
+        for (key, value) in self.__dict__.iteritems():
+            if isinstance(value, array.array):
+                arrays[key] = (value.typecode, value.tostring())
+                del state[key]
+        state["_arrays"] = arrays
+        return state
+
+    def __setstate__(self, state):
+        arrays = state.pop("_arrays")
+        for (key, (typecode, data)) in arrays.iteritems():
+            state[key] = array.array(typecode)
+            state[key].fromstring(data)
+        self.__dict__.update(state)
@@ -0,0 +1,210 @@
+import logging
+
+__author__ = 'Martin Pecka'
+
+
+class PageParseStats(object):
+    """
+    Statistics of parsing a single document page.
+    """
+
+    def __init__(self, pageno, interpretation_time, layout_time, indexing_time, keyword_count, char_count,
+                 xobject_count, recorded_form_count, memory_size):
+        """
+        :param pageno: The page number (indexed from 0).
+        :type pageno: int
+
+        :param interpretation_time: Time spent interpreting the content streams (in seconds).
+        :type interpretation_time: float
+
+        :param layout_time: Time spent in the layout analysis (in seconds). It is almost zero if
+                                the layout analysis has been postponed.
+        :type layout_time: float
+
+        :param indexing_time: Time spent building the page index (in seconds).
+        :type indexing_time: float
+
+        :param keyword_count: Number of keywords counted in the pdflocs of the page.
+        :type keyword_count: int
+
+        :param char_count: Number of chars on the page.
+        :type char_count: int
+
+        :param xobject_count: Number of form XObject invocations on the page (including the nested ones).
+        :type xobject_count: int
+
+        :param recorded_form_count: Number of form XObjects that had to be interpreted, because
+                                        they were not cached from the previous invocations.
+        :type recorded_form_count: int
+
+        :param memory_size: Estimated memory occupied by the page index (in bytes).
+        :type memory_size: int
+        """
+        super(PageParseStats, self).__init__()
+
+        self.pageno = pageno
+        self.interpretation_time = interpretation_time
+        self.layout_time = layout_time
+        self.indexing_time = indexing_time
+        self.keyword_count = keyword_count
+        self.char_count = char_count
+        self.xobject_count = xobject_count
+        self.recorded_form_count = recorded_form_count
+        self.memory_size = memory_size
+
+    @property
+    def total_time(self):
+        return self.interpretation_time + self.layout_time + self.indexing_time
+
+    def __repr__(self):
+        return "Page %i: %i keywords, %i chars, %i XObjects (%i interpreted), %i B index, " \
+               "interpretation %.3f s, layout %.3f s, indexing %.3f s" % (
+                   self.pageno, self.keyword_count, self.char_count, self.xobject_count, self.recorded_form_count,
+                   self.memory_size, self.interpretation_time, self.layout_time, self.indexing_time)
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class PDFLocInstrumentation(object):
+    """
+    Receives the events of parsing document pages.
+
+    This implementation ignores all events. Subclasses override the callbacks they are
+    interested in.
+    """
+
+    def page_parsed(self, stats):
+        """
+        Called after a page has been parsed.
+
+        :param stats: The statistics of the parsing.
+        :type stats: PageParseStats
+        """
+        pass
+
+    def page_loaded(self, pageno, load_time):
+        """
+        Called after the index of a page has been loaded from the cache instead of parsing the page.
+
+        :param pageno: The page number (indexed from 0).
+        :type pageno: int
+
+        :param load_time: Time spent loading the index (in seconds).
+        :type load_time: float
+        """
+        pass
+
+    def layout_analyzed(self, pageno, layout_time):
+        """
+        Called after the postponed layout analysis of a page has been run.
+
+        :param pageno: The page number (indexed from 0).
+        :type pageno: int
+
+        :param layout_time: Time spent in the layout analysis (in seconds).
+        :type layout_time: float
+        """
+        pass
+
+
+class PDFLocLoggingInstrumentation(PDFLocInstrumentation):
+    """
+    Logs the events of parsing document pages.
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        """
+        :param logger: The logger to log to. If None, the logger of this module is used.
+        :type logger: logging.Logger | None
+
+        :param level: The level of the log records.
+        :type level: int
+        """
+        super(PDFLocLoggingInstrumentation, self).__init__()
+
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.level = level
+
+    def page_parsed(self, stats):
+        self.logger.log(self.level, "Parsed %s", stats)
+
+    def page_loaded(self, pageno, load_time):
+        self.logger.log(self.level, "Loaded page %i from the cache in %.3f s", pageno, load_time)
+
+    def layout_analyzed(self, pageno, layout_time):
+        self.logger.log(self.level, "Analyzed the postponed layout of page %i in %.3f s", pageno, layout_time)
+
+
+class PDFLocStatsCollector(PDFLocInstrumentation):
+    """
+    Aggregates the statistics of parsing document pages.
+    """
+
+    def __init__(self):
+        super(PDFLocStatsCollector, self).__init__()
+
+        self.parsed_pages = 0
+        self.loaded_pages = 0
+        self.interpretation_time = 0.0
+        self.layout_time = 0.0
+        self.indexing_time = 0.0
+        self.load_time = 0.0
+        self.postponed_layout_time = 0.0
+        self.postponed_layout_pages = 0
+        self.keyword_count = 0
+        self.char_count = 0
+        self.xobject_count = 0
+        self.recorded_form_count = 0
+        self.memory_size = 0
+        # the page that took the longest to parse
+        self.slowest_page = None
+
+    def page_parsed(self, stats):
+        self.parsed_pages += 1
+        self.interpretation_time += stats.interpretation_time
+        self.layout_time += stats.layout_time
+        self.indexing_time += stats.indexing_time
+        self.keyword_count += stats.keyword_count
+        self.char_count += stats.char_count
+        self.xobject_count += stats.xobject_count
+        self.recorded_form_count += stats.recorded_form_count
+        self.memory_size += stats.memory_size
+
+        if self.slowest_page is None or stats.total_time > self.slowest_page.total_time:
+            self.slowest_page = stats
+
+    def page_loaded(self, pageno, load_time):
+        self.loaded_pages += 1
+        self.load_time += load_time
+
+    def layout_analyzed(self, pageno, layout_time):
+        self.postponed_layout_pages += 1
+        self.postponed_layout_time += layout_time
+
+    def format_report(self):
+        """
+        Return a human-readable report of the aggregated statistics.
+
+        :rtype: str
+        """
+        phases = [
+            ("interpretation", self.interpretation_time, self.parsed_pages),
+            ("layout analysis", self.layout_time, self.parsed_pages),
+            ("indexing", self.indexing_time, self.parsed_pages),
+            ("cache loading", self.load_time, self.loaded_pages),
+            ("postponed layout analysis", self.postponed_layout_time, self.postponed_layout_pages),
+        ]
+
+        lines = ["Parsed %i pages, loaded %i pages from the cache" % (self.parsed_pages, self.loaded_pages)]
+        for (name, seconds, pages) in phases:
+            lines.append("  %-26s %9.3f s  (%i pages, %.1f ms/page)" % (
+                name + ":", seconds, pages, 1000.0 * seconds / pages if pages > 0 else 0.0))
+        lines.append("  %-26s %9i" % ("keywords:", self.keyword_count))
+        lines.append("  %-26s %9i" % ("chars:", self.char_count))
+        lines.append("  %-26s %9i  (%i interpreted)" % ("form XObjects:", self.xobject_count, self.recorded_form_count))
+        lines.append("  %-26s %9i B" % ("index memory:", self.memory_size))
+        if self.slowest_page is not None:
+            lines.append("  %-26s %9.3f s  (page %i)" % ("slowest page:", self.slowest_page.total_time,
+                                                         self.slowest_page.pageno))
+        return "\n".join(lines)
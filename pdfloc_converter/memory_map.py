@@ -0,0 +1,77 @@
+import mmap
+import os
+import stat
+
+__author__ = 'Martin Pecka'
+
+
+class MemoryMappedStream(object):
+    """
+    A read-only seekable stream over a memory-mapped file.
+
+    The parser seeks and reads small chunks for every object it fetches. A file object turns each
+    of them into system calls, whereas reading from the mapping only copies the bytes from the page
+    cache. The stream has the subset of the file interface pdfminer uses (read, seek, tell, close).
+
+    Unlike mmap objects, the stream can be positioned past its end (reads return an empty string
+    there, as with files), so corrupted offsets in the document fail the same way as with files.
+    """
+
+    def __init__(self, source_file):
+        """
+        Map the whole file. The stream takes the ownership of the file, so it closes it when it is closed.
+
+        :param source_file: The file to map. It has to be a regular file open for reading.
+        :type source_file: file
+
+        :raises ValueError: If the file is not a regular file (e.g. a pipe).
+        """
+        super(MemoryMappedStream, self).__init__()
+
+        file_stat = os.fstat(source_file.fileno())
+        if not stat.S_ISREG(file_stat.st_mode):
+            raise ValueError("Only regular files can be memory-mapped: %s" % getattr(source_file, "name", None))
+
+        self.name = getattr(source_file, "name", None)
+        self._file = source_file
+        self._size = file_stat.st_size
+        # empty files can't be mapped
+        self._map = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ) if self._size > 0 else ""
+        self._position = 0
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def read(self, size=-1):
+        if self._file.closed:
+            raise ValueError("I/O operation on closed file")
+
+        start = min(self._position, self._size)
+        end = self._size if size is None or size < 0 else min(start + size, self._size)
+        self._position = max(self._position, end)
+        return self._map[start:end]
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self._position + offset
+        elif whence == os.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError("Invalid whence (%r)" % whence)
+
+        if position < 0:
+            raise IOError(22, "Invalid argument")
+        self._position = position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if self._file.closed:
+            return
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
@@ -0,0 +1,214 @@
+import bisect
+
+from pdfminer.pdfpage import PDFPage, LITERAL_PAGE, LITERAL_PAGES
+from pdfminer.pdftypes import PDFObjRef, dict_value, list_value, resolve1
+
+__author__ = 'Martin Pecka'
+
+
+class PDFPageTree(object):
+    """
+    Random access to the pages of a document by their numbers (indexed from 0).
+
+    PDFPage.create_pages() constructs all pages preceding the wanted one. Instead, this class
+    walks the /Pages tree down to the wanted page, and skips the whole subtrees before it using
+    their /Count. The visited tree nodes are kept, so looking up more pages only resolves the
+    nodes that haven't been visited yet.
+
+    The pages are numbered the same way as by PDFPage.create_pages() and they have the same
+    attributes (including those inherited from the ancestor nodes). The /Count of a subtree is
+    trusted; if a subtree has no /Count, its pages are counted by walking it. A document
+    without a page tree falls back to PDFPage.create_pages().
+    """
+
+    def __init__(self, document):
+        """
+        :param document: The document.
+        :type document: PDFDocument
+        """
+        super(PDFPageTree, self).__init__()
+
+        self._document = document
+
+        # the root node, or None if the document has no page tree
+        self._root = None
+        if 'Pages' in document.catalog:
+            root = self._create_node(document.catalog['Pages'], document.catalog)
+            if isinstance(root, _PageTreeNode) and root.get_count(self) > 0:
+                self._root = root
+
+        # page number => PDFPage; all pages are there if the document has no page tree
+        self._pages = {}
+        if self._root is None:
+            self._pages = dict(enumerate(PDFPage.create_pages(document)))
+
+    def get_page(self, pageno):
+        """
+        Return the page with the given number.
+
+        :param pageno: The page number (indexed from 0).
+        :type pageno: int
+
+        :rtype: PDFPage
+
+        :raises IndexError: If the document has no such page.
+        """
+        if pageno in self._pages:
+            return self._pages[pageno]
+        if self._root is None or not 0 <= pageno < len(self):
+            raise IndexError("The document has no page %i" % pageno)
+
+        (kid, index) = self._root.find_kid(self, pageno)
+        while isinstance(kid, _PageTreeNode):
+            (kid, index) = kid.find_kid(self, index)
+
+        (objid, attrs) = kid
+        page = PDFPage(self._document, objid, attrs)
+        self._pages[pageno] = page
+        return page
+
+    def get_pages(self, pagenos=None):
+        """
+        Return the given pages in the page order.
+
+        :param pagenos: The page numbers (indexed from 0). The numbers out of the range of the
+                            document pages are ignored. None means all pages.
+        :type pagenos: collections.Iterable | None
+
+        :return: Generator of tuples (page number, PDFPage).
+        :rtype: generator
+        """
+        if pagenos is None:
+            pagenos = xrange(len(self))
+        for pageno in sorted(pageno for pageno in set(pagenos) if 0 <= pageno < len(self)):
+            yield (pageno, self.get_page(pageno))
+
+    def __len__(self):
+        if self._root is None:
+            return len(self._pages)
+        return self._root.get_count(self)
+
+    def __getitem__(self, pageno):
+        if pageno < 0:
+            pageno += len(self)
+        return self.get_page(pageno)
+
+    def __iter__(self):
+        for (_, page) in self.get_pages():
+            yield page
+
+    def _create_node(self, obj, parent_attrs):
+        """
+        Resolve a node of the page tree.
+
+        :return: _PageTreeNode for intermediate nodes, tuple (objid, attributes) for pages, or
+                    None for other objects.
+        """
+        if isinstance(obj, PDFObjRef):
+            objid = obj.objid
+        elif isinstance(obj, int):
+            objid = obj
+            obj = self._document.getobj(objid)
+        else:
+            objid = None
+
+        attrs = dict_value(obj).copy()
+        for (key, value) in parent_attrs.iteritems():
+            if key in PDFPage.INHERITABLE_ATTRS and key not in attrs:
+                attrs[key] = value
+
+        if attrs.get('Type') is LITERAL_PAGES and 'Kids' in attrs:
+            return _PageTreeNode(attrs)
+        if attrs.get('Type') is LITERAL_PAGE:
+            return (objid, attrs)
+        return None
+
+
+class _PageTreeNode(object):
+    """
+    An intermediate node of the page tree with the page counts of its kids.
+    """
+
+    def __init__(self, attrs):
+        self.attrs = attrs
+        self.kids = list_value(attrs['Kids'])
+
+        # kid index => _PageTreeNode, (objid, attributes) of a page, or None
+        self._resolved_kids = {}
+        # the index of the first page of each kid in this subtree and the number of pages of the
+        # subtree; computed on the first look-up
+        self._offsets = None
+        self._count = None
+        # whether the kids are only assumed to be pages, which hasn't been checked for all of them
+        self._counts_assumed = False
+
+    def get_count(self, tree):
+        self._ensure_counted(tree)
+        return self._count
+
+    def find_kid(self, tree, index):
+        """
+        Find the kid containing the page with the given index in this subtree.
+
+        :return: Tuple (kid, index of the page in the kid's subtree), where the kid is either
+                    _PageTreeNode or a tuple (objid, attributes) of a page.
+
+        :raises IndexError: If the subtree has no such page.
+        """
+        self._ensure_counted(tree)
+        (kid_index, kid_page_index) = self._locate(index)
+        kid = self._resolve_kid(tree, kid_index)
+
+        if self._counts_assumed and not isinstance(kid, tuple):
+            # the node has other kids than pages, so all of them have to be counted
+            self._set_counts(self._count_kids(tree))
+
+            (kid_index, kid_page_index) = self._locate(index)
+            kid = self._resolve_kid(tree, kid_index)
+
+        return kid, kid_page_index
+
+    def _ensure_counted(self, tree):
+        if self._offsets is not None:
+            return
+
+        count = resolve1(self.attrs.get('Count'))
+        if isinstance(count, int) and count == len(self.kids):
+            # the usual flat node only has pages as its kids; this is checked when they are resolved,
+            # so that the preceding kids don't need to be resolved
+            self._set_counts([1] * len(self.kids))
+            self._counts_assumed = True
+        else:
+            self._set_counts(self._count_kids(tree))
+
+    def _set_counts(self, counts):
+        self._offsets = []
+        self._count = 0
+        for count in counts:
+            self._offsets.append(self._count)
+            self._count += count
+        self._counts_assumed = False
+
+    def _locate(self, index):
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        # the kids without pages share the offset with the next kid, so the last kid with the
+        # offset is the one containing the page
+        kid_index = bisect.bisect_right(self._offsets, index) - 1
+        return kid_index, index - self._offsets[kid_index]
+
+    def _count_kids(self, tree):
+        counts = []
+        for kid_index in xrange(len(self.kids)):
+            kid = self._resolve_kid(tree, kid_index)
+            if isinstance(kid, _PageTreeNode):
+                count = resolve1(kid.attrs.get('Count'))
+                counts.append(count if isinstance(count, int) else kid.get_count(tree))
+            else:
+                counts.append(1 if kid is not None else 0)
+        return counts
+
+    def _resolve_kid(self, tree, kid_index):
+        if kid_index not in self._resolved_kids:
+            self._resolved_kids[kid_index] = tree._create_node(self.kids[kid_index], self.attrs)
+        return self._resolved_kids[kid_index]
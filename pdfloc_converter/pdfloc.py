@@ -1,9 +1,15 @@
+import array
+import itertools
+import operator
 import re
 
 __author__ = 'Martin Pecka'
 
 
 class PDFLoc(object):
+    __slots__ = ("_hash", "_page", "_keyword_num", "_string_num", "_instring_num", "_flag1", "_is_up_to_end",
+                 "_is_not_up_to_end")
+
     _regex_matcher = re.compile(
         r"#pdfloc\("
             r"(?P<hash>[0-9a-f]+),"
@@ -31,12 +37,29 @@ class PDFLoc(object):
             self._keyword_num = int(match.group("keyword_num")) if (match.group("keyword_num") != "E") else None
             self._string_num = int(match.group("string_num")) if (match.group("string_num") != "E") else None
             self._instring_num = int(match.group("instring_num")) if (match.group("instring_num") != "E") else None
-            self._flag1 = bool(match.group("flag1"))
-            self._is_up_to_end = bool(match.group("is_up_to_end"))
-            self._is_not_up_to_end = bool(match.group("is_not_up_to_end"))
+            self._flag1 = match.group("flag1") == "1"
+            self._is_up_to_end = match.group("is_up_to_end") == "1"
+            self._is_not_up_to_end = match.group("is_not_up_to_end") == "1"
         else:
             raise ValueError("The following pdfloc couldn't be parsed: %s" % pdfloc)
 
+    @classmethod
+    def from_parts(cls, hash, page, keyword_num, string_num, instring_num,
+                   flag1=False, is_up_to_end=False, is_not_up_to_end=True):
+        """
+        Create a PDFLoc from its parts instead of parsing it from a string.
+        """
+        pdfloc = cls.__new__(cls)
+        pdfloc._hash = str(hash)
+        pdfloc._page = page
+        pdfloc._keyword_num = keyword_num
+        pdfloc._string_num = string_num
+        pdfloc._instring_num = instring_num
+        pdfloc._flag1 = flag1
+        pdfloc._is_up_to_end = is_up_to_end
+        pdfloc._is_not_up_to_end = is_not_up_to_end
+        return pdfloc
+
     @property
     def hash(self):
         return self._hash
@@ -70,24 +93,50 @@ class PDFLoc(object):
         return self._is_not_up_to_end
 
     def __str__(self):
-        return "#pdfloc(%s,%d,%d,%d,%d,%d,%d,%d)" % (
-            self.hash, self.page, self.keyword_num, self.string_num, self.instring_num, self.flag1,
-            self.is_up_to_end, self.is_not_up_to_end
+        # the E parts are None
+        parts = [part if part is not None else "E" for part in (self.keyword_num, self.string_num, self.instring_num)]
+        return "#pdfloc(%s,%d,%s,%s,%s,%d,%d,%d)" % (
+            self.hash, self.page, parts[0], parts[1], parts[2], self.flag1, self.is_up_to_end, self.is_not_up_to_end
         )
 
+    def _key(self):
+        return (self._hash, self._page, self._keyword_num, self._string_num, self._instring_num, self._flag1,
+                self._is_up_to_end, self._is_not_up_to_end)
+
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, PDFLoc):
+            return NotImplemented
+        return self._key() == other._key()
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash(self._key())
+
+    def __reduce__(self):
+        return PDFLoc.from_parts, self._key()
+
 
 class PDFLocPair(object):
+    __slots__ = ("_start", "_end", "_comment")
+
     def __init__(self, start, end, comment=None):
-        super(PDFLocPair, self).__init__()
-        self.start = PDFLoc(start)
-        self.end = PDFLoc(end)
-        self.comment = comment
+        self._start = start if isinstance(start, PDFLoc) else PDFLoc(start)
+        self._end = end if isinstance(end, PDFLoc) else PDFLoc(end)
+        self._comment = comment
+
+    @property
+    def start(self):
+        return self._start
+
+    @property
+    def end(self):
+        return self._end
+
+    @property
+    def comment(self):
+        return self._comment
 
     @property
     def pages_covered(self):
@@ -99,11 +148,281 @@ class PDFLocPair(object):
     def __eq__(self, other):
         if not isinstance(other, PDFLocPair):
             return NotImplemented
-        return self.__dict__ == other.__dict__
+        return self._start == other._start and self._end == other._end and self._comment == other._comment
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash((self._start, self._end, self._comment))
+
+    def __reduce__(self):
+        return PDFLocPair, (self._start, self._end, self._comment)
+
+
+class PDFLocParseError(object):
+    """
+    Describes a line of a bulk input (see PDFLocBatch.parse()) that couldn't be parsed.
+    """
+
+    def __init__(self, line_number, line):
+        """
+        :param line_number: Number of the line in the input (indexed from 1).
+        :type line_number: int
+
+        :param line: The line (without the line break).
+        :type line: basestring
+        """
+        super(PDFLocParseError, self).__init__()
+
+        self.line_number = line_number
+        self.line = line
+
+    @property
+    def message(self):
+        return "Not a pair of pdflocs: %s" % self.line
+
+    def __repr__(self):
+        return "Error parsing line %i: %s" % (self.line_number, self.message)
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class PDFLocColumns(object):
+    """
+    A column of pdflocs stored in a PDFLocBatch. Each part of the pdflocs is stored in an
+    integer array indexed by the number of the pair in the batch.
+
+    The hash is stored as an index to PDFLocBatch.hashes. The E parts (the end of a stream) are
+    stored as PDFLocBatch.END. The flags are stored as 0 or 1.
+    """
+
+    __slots__ = ("hash_id", "page", "keyword_num", "string_num", "instring_num", "flag1", "is_up_to_end",
+                 "is_not_up_to_end")
+
+    def __init__(self, hash_id, page, keyword_num, string_num, instring_num, flag1, is_up_to_end,
+                 is_not_up_to_end):
+        self.hash_id = hash_id
+        self.page = page
+        self.keyword_num = keyword_num
+        self.string_num = string_num
+        self.instring_num = instring_num
+        self.flag1 = flag1
+        self.is_up_to_end = is_up_to_end
+        self.is_not_up_to_end = is_not_up_to_end
+
+    def location(self, index):
+        """
+        Return the position of the pdfloc in the page content.
+
+        :param index: Index of the pair in the batch.
+        :type index: int
+
+        :return: Tuple (page, keyword_num, string_num, instring_num); the E parts are None.
+        :rtype: tuple
+        """
+        return (self.page[index], _from_column_value(self.keyword_num[index]),
+                _from_column_value(self.string_num[index]), _from_column_value(self.instring_num[index]))
+
+    def locations(self):
+        """
+        Return the positions of all the pdflocs in the page content (see location()).
+
+        :rtype: list
+        """
+        return zip(self.page, _from_column(self.keyword_num), _from_column(self.string_num),
+                   _from_column(self.instring_num))
+
+    def get_pdfloc(self, index, hashes):
+        (page, keyword_num, string_num, instring_num) = self.location(index)
+        return PDFLoc.from_parts(hashes[self.hash_id[index]], page, keyword_num, string_num, instring_num,
+                                 self.flag1[index] == 1, self.is_up_to_end[index] == 1,
+                                 self.is_not_up_to_end[index] == 1)
+
+
+class PDFLocBatch(object):
+    """
+    A batch of PDFLoc pairs parsed in bulk and stored column-oriented.
+
+    Parsing millions of pairs one PDFLocPair at a time is dominated by matching each pdfloc
+    separately and allocating the objects. The batch is parsed by a single scanner matching
+    whole lines, and it only keeps integer arrays of the parts of the pdflocs (see PDFLocColumns),
+    the comments and the line numbers. The hashes are interned and stored once.
+
+    PDFLocConverter.pdfloc_pairs_to_bboxes() processes the batch directly. Indexing or
+    iterating the batch creates the PDFLocPairs.
+
+    The input lines have the format of the pdfloc jobs of the command line:
+        #pdfloc(abcd,1,1,1,1,1,1,1);#pdfloc(abcd,1,1,2,1,1,1,1) optional comment separated by a space
+    Empty lines are skipped. The lines that can't be parsed are stored in errors.
+    """
+
+    # the value of E parts in the columns
+    END = -1
+
+    _pdfloc_pattern = r"#pdfloc\(([0-9a-f]+),([0-9]+),([0-9]+|E),([0-9]+|E),([0-9]+|E),([01]),([01]),([01])\)"
+
+    # matches a single line; either the pdfloc pair (16 groups) and the comment, or the whole
+    # malformed line in the last group
+    _line_scanner = re.compile(
+        r"^(?:[ \t]*" + _pdfloc_pattern + r"[ \t]*;[ \t]*" + _pdfloc_pattern +
+        r"(?:[ \t]+([^\r\n]*))?\r?$|([^\n]*))", re.IGNORECASE | re.MULTILINE)
+
+    _fields_per_line = 16
+
+    def __init__(self, hashes, start, end, comments, line_numbers, errors):
+        """
+        Use parse(), parse_text() or parse_file() to create a batch.
+
+        :param hashes: The distinct hashes of the pdflocs.
+        :type hashes: list
+
+        :param start: The start pdflocs of the pairs.
+        :type start: PDFLocColumns
+
+        :param end: The end pdflocs of the pairs.
+        :type end: PDFLocColumns
+
+        :param comments: The comment of each pair (or None).
+        :type comments: list
+
+        :param line_numbers: The number of the input line of each pair (indexed from 1).
+        :type line_numbers: array.array
+
+        :param errors: The lines that couldn't be parsed.
+        :type errors: list
+        """
+        super(PDFLocBatch, self).__init__()
+
+        self.hashes = hashes
+        self.start = start
+        self.end = end
+        self.comments = comments
+        self.line_numbers = line_numbers
+        self.errors = errors
+
+    @classmethod
+    def parse(cls, lines, first_line_number=1):
+        """
+        Parse the pdfloc pairs from the given lines.
+
+        :param lines: The lines; an open file can be given, too.
+        :type lines: collections.Iterable
+
+        :param first_line_number: The number of the first line used in errors and line_numbers.
+        :type first_line_number: int
+
+        :rtype: PDFLocBatch
+        """
+        match = cls._line_scanner.match
+        return cls._from_rows([match(line).groups("") for line in lines], first_line_number)
+
+    @classmethod
+    def parse_text(cls, text):
+        """
+        Parse the pdfloc pairs from the lines of the given text.
+
+        :type text: basestring
+
+        :rtype: PDFLocBatch
+        """
+        # the scanner matches every line, so the rows correspond to the lines
+        return cls._from_rows(cls._line_scanner.findall(text), 1)
+
+    @classmethod
+    def parse_file(cls, filename):
+        """
+        Parse the pdfloc pairs from the lines of the given file.
+
+        :type filename: basestring
+
+        :rtype: PDFLocBatch
+        """
+        with open(filename, 'rb') as f:
+            return cls.parse_text(f.read())
+
+    @classmethod
+    def _from_rows(cls, rows, first_line_number):
+        # the rows are tuples of the groups of the scanner (empty strings for the unmatched ones),
+        # they are processed column by column
+        if len(rows) == 0:
+            rows = [("",) * (cls._fields_per_line + 2)]
+        columns = zip(*rows)
+        line_numbers = xrange(first_line_number, first_line_number + len(rows))
+
+        errors = []
+        # the malformed and empty lines have no hash
+        if "" in columns[0]:
+            is_pair = map(bool, columns[0])
+            for index in itertools.compress(xrange(len(rows)), map(operator.not_, is_pair)):
+                line = columns[-1][index].rstrip("\r\n")
+                if len(line.strip()) > 0:
+                    errors.append(PDFLocParseError(first_line_number + index, line))
+
+            columns = [list(itertools.compress(column, is_pair)) for column in columns]
+            line_numbers = itertools.compress(line_numbers, is_pair)
+
+        # distinct hash => its index in hashes
+        hash_ids = {}
+        hashes = []
+        for hash in set(columns[0]).union(columns[8]):
+            hash_ids[hash] = len(hashes)
+            hashes.append(intern(str(hash)))
+
+        pdfloc_columns = []
+        for offset in (0, 8):
+            pdfloc_columns.append(PDFLocColumns(
+                array.array('i', map(hash_ids.__getitem__, columns[offset])),
+                *[_to_column(columns[offset + i], 'i' if i < 5 else 'b') for i in xrange(1, 8)]))
+
+        comments = [comment.rstrip() or None for comment in columns[cls._fields_per_line]]
+
+        return cls(hashes, pdfloc_columns[0], pdfloc_columns[1], comments, array.array('i', line_numbers), errors)
+
+    @property
+    def pages_covered(self):
+        """
+        The pages covered by any pair of the batch (indexed from 0).
+
+        :rtype: set
+        """
+        pages = set()
+        for (start_page, end_page) in set(zip(self.start.page, self.end.page)):
+            pages.update(xrange(start_page, end_page + 1))
+        return pages
+
+    def __len__(self):
+        return len(self.line_numbers)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        return PDFLocPair(self.start.get_pdfloc(index, self.hashes), self.end.get_pdfloc(index, self.hashes),
+                          self.comments[index])
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+
+def _to_column(parts, typecode):
+    # the parts repeat a lot, so each distinct part is only converted once
+    values = dict((part, int(part) if part not in ("E", "e") else PDFLocBatch.END) for part in set(parts))
+    return array.array(typecode, map(values.__getitem__, parts))
+
+
+def _from_column_value(value):
+    return value if value != PDFLocBatch.END else None
+
+
+def _from_column(column):
+    if PDFLocBatch.END in column:
+        return [_from_column_value(value) for value in column]
+    return column
+
 
 class PDFLocBoundingBoxes(object):
     def __init__(self, bboxes, page=None, comment=None):
@@ -172,6 +491,8 @@ class PDFLocBoundingBoxes(object):
 
 
 class BoundingBoxOnPage(object):
+    __slots__ = ("_bbox", "_page", "_text")
+
     def __init__(self, bbox, page, text=None):
         """
         Represent a bounding box.
@@ -179,21 +500,28 @@ class BoundingBoxOnPage(object):
         :param int page:
         :param str text:
         """
-        super(BoundingBoxOnPage, self).__init__()
-
         assert isinstance(bbox, tuple) or isinstance(bbox, BoundingBox)
         assert isinstance(page, int)
 
         if isinstance(bbox, BoundingBox):
-            self.bbox = bbox
+            self._bbox = bbox
         else:
-            self.bbox = BoundingBox(
-                start=Point(x=bbox[0], y=bbox[1]),
-                end=Point(x=bbox[2], y=bbox[3])
-            )
+            self._bbox = BoundingBox.from_coords(bbox[0], bbox[1], bbox[2], bbox[3])
 
-        self.page = page
-        self.text = text
+        self._page = page
+        self._text = text
+
+    @property
+    def bbox(self):
+        return self._bbox
+
+    @property
+    def page(self):
+        return self._page
+
+    @property
+    def text(self):
+        return self._text
 
     def __repr__(self):
         return "Page %i, '%s', %s" % (self.page, str(self.bbox),
@@ -205,86 +533,106 @@ class BoundingBoxOnPage(object):
     def __eq__(self, other):
         if not isinstance(other, BoundingBoxOnPage):
             return NotImplemented
-        return self.__dict__ == other.__dict__
+        return self._bbox == other._bbox and self._page == other._page and self._text == other._text
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash((self._bbox, self._page, self._text))
+
+    def __reduce__(self):
+        return BoundingBoxOnPage, (self._bbox, self._page, self._text)
+
 
 class BoundingBox(object):
-    _start = None
-    _end = None
+    # the coordinates are kept in a tuple (x0, y0, x1, y1), the start and end points are only
+    # created when asked for
+    __slots__ = ("_coords",)
 
     def __init__(self, start, end):
-        super(BoundingBox, self).__init__()
-
         assert isinstance(start, Point)
         assert isinstance(end, Point)
 
-        self._start = start
-        self._end = end
+        self._coords = (start.x, start.y, end.x, end.y)
+
+    @classmethod
+    def from_coords(cls, x0, y0, x1, y1):
+        """
+        Create a bounding box from its coordinates without creating its start and end points.
+        """
+        bbox = cls.__new__(cls)
+        bbox._coords = (x0, y0, x1, y1)
+        return bbox
 
     @property
     def start(self):
-        return self._start
+        return Point(self._coords[0], self._coords[1])
 
     @property
     def end(self):
-        return self._end
+        return Point(self._coords[2], self._coords[3])
 
     def width(self):
-        return self.end.x - self.start.x
+        return self._coords[2] - self._coords[0]
 
     def height(self):
-        return self.start.y - self.end.y  # y axis is inverted in PDF
+        return self._coords[1] - self._coords[3]  # y axis is inverted in PDF
 
     def __str__(self):
-        return "Bbox[start=%s, end=%s]" % (self.start, self.end)
+        return "Bbox[start=[%f, %f], end=[%f, %f]]" % self._coords
 
     def __eq__(self, other):
         if not isinstance(other, BoundingBox):
             return NotImplemented
-        return self.__dict__ == other.__dict__
+        return self._coords == other._coords
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash(self._coords)
+
+    def __reduce__(self):
+        return BoundingBox.from_coords, self._coords
+
     def __getitem__(self, i):
-        if i == 0:
-            return self.start.x
-        elif i == 1:
-            return self.start.y
-        elif i == 2:
-            return self.end.x
-        elif i == 3:
-            return self.end.y
-        elif isinstance(i, slice):
-            return [self[ii] for ii in range(*i.indices(len(self)))]
-        else:
-            raise IndexError()
+        # slices are tuples
+        return self._coords[i]
+
+    def __iter__(self):
+        return iter(self._coords)
 
     def __len__(self):
         return 4
 
 
 class PointOnPage(object):
+    __slots__ = ("_point", "_page")
+
     def __init__(self, point, page):
         """
         Represent a point on a page.
         :param tuple|Point point: (x, y)
         :param int page:
         """
-        super(PointOnPage, self).__init__()
-
         assert isinstance(point, tuple) or isinstance(point, Point)
         assert isinstance(page, int)
 
         if isinstance(point, Point):
-            self.point = point
+            self._point = point
         else:
-            self.point = Point(x=point[0], y=point[1])
+            self._point = Point(x=point[0], y=point[1])
 
-        self.page = page
+        self._page = page
+
+    @property
+    def point(self):
+        return self._point
+
+    @property
+    def page(self):
+        return self._page
 
     def __repr__(self):
         return "Page %i, '%s'" % (self.page, str(self.point))
@@ -295,19 +643,22 @@ class PointOnPage(object):
     def __eq__(self, other):
         if not isinstance(other, PointOnPage):
             return NotImplemented
-        return self.__dict__ == other.__dict__
+        return self._point == other._point and self._page == other._page
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash((self._point, self._page))
+
+    def __reduce__(self):
+        return PointOnPage, (self._point, self._page)
+
 
 class Point(object):
-    _x = 0.0
-    _y = 0.0
+    __slots__ = ("_x", "_y")
 
     def __init__(self, x, y):
-        super(Point, self).__init__()
-
         self._x = x
         self._y = y
 
@@ -325,16 +676,22 @@ class Point(object):
     def __eq__(self, other):
         if not isinstance(other, Point):
             return NotImplemented
-        return self.__dict__ == other.__dict__
+        return self._x == other._x and self._y == other._y
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash((self._x, self._y))
+
+    def __reduce__(self):
+        return Point, (self._x, self._y)
+
     def __getitem__(self, i):
         if i == 0:
-            return self.x
+            return self._x
         elif i == 1:
-            return self.y
+            return self._y
         else:
             raise IndexError()
 
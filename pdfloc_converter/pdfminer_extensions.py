@@ -1,156 +1,345 @@
 #!/usr/bin/env python
+import array
+import bisect
 import collections
 import logging
+import time
 
 from pdfminer.converter import PDFPageAggregator
-from pdfminer.layout import LTContainer, LTChar, LTTextLine, LTText, LTPage, LTFigure
-from pdfminer.pdfinterp import PDFPageInterpreter, PDFInterpreterError, LITERAL_FORM
+from pdfminer.pdfdevice import PDFTextDevice
+from pdfminer.layout import LTContainer, LTChar, LTTextLine, LTPage, LTFigure, LTComponent, LAParams
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager, PDFContentParser, PDFInterpreterError, \
+    LITERAL_FORM
 from pdfminer.pdftypes import stream_value, list_value, dict_value
-from pdfminer.psparser import literal_name, STRICT
+from pdfminer.psparser import literal_name, PSEOF, PSKeyword, STRICT
 from pdfminer.utils import MATRIX_IDENTITY, mult_matrix
 
-from pdfloc_converter.pdfloc import BoundingBoxOnPage, BoundingBox, Point
+from pdfloc_converter.document_structure import PageIndex, CharRef
+from pdfloc_converter.instrumentation import PDFLocInstrumentation
+from pdfloc_converter.pdfloc import BoundingBoxOnPage, BoundingBox
 
 __author__ = 'Martin Pecka'
 
 
-class PDFLocDocument(LTContainer):
-    def __init__(self):
-        super(PDFLocDocument, self).__init__((0.0, 0.0, 1.0, 1.0))
-        self.index_in_layout_parent = 0
-        self.layout_children = []
-        self.layout_parent = None
+class PDFLocDocument(object):
+    def __init__(self, laparams=None, instrumentation=None):
+        """
+        :param laparams: Parameters of the layout analysis of pages whose analysis has been
+                            postponed.
+        :type laparams: LAParams
+
+        :param instrumentation: Receives the events of the postponed layout analysis.
+        :type instrumentation: PDFLocInstrumentation | None
+        """
+        super(PDFLocDocument, self).__init__()
+        self.laparams = laparams if laparams is not None else LAParams()
+        self.instrumentation = instrumentation if instrumentation is not None else PDFLocInstrumentation()
+        # the pages are kept sorted by their pageid
+        self.pages = []
+        self._pageids = []
+
+        # the document-wide reading order of text lines: lines of page p have ordinals
+        # _line_offsets[p] to _line_offsets[p+1]-1
+        self._line_offsets = array.array('i', [0])
 
     def add(self, page):
-        assert isinstance(page, PDFLocPage)
-        super(PDFLocDocument, self).add(page)
-
-        page.index_in_layout_parent = len(self.layout_children)
-        page.layout_parent = self
-        self.layout_children.append(page)
-
-    def find_bboxes_between_chars(self, start_char, end_char):
-        assert isinstance(start_char, LTChar)
-        assert isinstance(end_char, LTChar)
-        assert hasattr(start_char, "layout_parent")
-        assert hasattr(end_char, "layout_parent")
-
-        start_line = start_char.layout_parent
-        end_line = end_char.layout_parent
-
-        lines = [start_line]
-
-        if start_line != end_line:
-            node = start_line
-            i = 0
-            came_from_child = False
-            while node is not None and node != end_line and i < 100000:
-                if not came_from_child and len(node.layout_children) > 0 and isinstance(node.layout_children[0], LTContainer):
-                    node = node.layout_children[0]
-                    came_from_child = False
-                    if isinstance(node, LTTextLine):
-                        lines.append(node)
-                elif node.layout_parent is not None and node.index_in_layout_parent < len(node.layout_parent.layout_children)-1:
-                    node = node.layout_parent.layout_children[node.index_in_layout_parent+1]
-                    came_from_child = False
-                    if isinstance(node, LTTextLine):
-                        lines.append(node)
-                elif node.layout_parent is not None:
-                    node = node.layout_parent
-                    came_from_child = True
-                else:
-                    raise RuntimeError("End line not found: %s" % str(node))
-                i += 1
-
-        if len(lines) == 0:
+        assert isinstance(page, PageIndex)
+
+        # pages parsed on demand may come in any order
+        position = bisect.bisect_right(self._pageids, page.pageid)
+        self.pages.insert(position, page)
+        self._pageids.insert(position, page.pageid)
+        self._line_offsets.insert(position+1, 0)
+
+        self._update_positions(position)
+
+    def remove(self, page):
+        assert isinstance(page, PageIndex)
+
+        position = page.index_in_document
+        assert self.pages[position] is page
+
+        del self.pages[position]
+        del self._pageids[position]
+        del self._line_offsets[position+1]
+
+        self._update_positions(position)
+
+    def _update_positions(self, first_position):
+        # update the positions and line offsets of the pages starting with the given one
+        for page_i in xrange(first_position, len(self.pages)):
+            self.pages[page_i].index_in_document = page_i
+            self._line_offsets[page_i+1] = self._line_offsets[page_i] + self.pages[page_i].line_count
+
+    @property
+    def line_count(self):
+        return self._line_offsets[-1]
+
+    def get_line_ordinal(self, char):
+        """
+        Return the position of the char's text line in the reading order of the document.
+
+        :return: The ordinal of the line, or PageIndex.NO_LINE if the char is not part of any line.
+        :rtype: int
+        """
+        assert isinstance(char, CharRef)
+        self._ensure_page_layout_analyzed(char.page)
+
+        line = char.page.char_line(char.row)
+        if line == PageIndex.NO_LINE:
+            return PageIndex.NO_LINE
+        return self._line_offsets[char.page.index_in_document] + line
+
+    def get_line(self, ordinal):
+        """
+        Return the text line at the given position in the reading order of the document.
+
+        :return: Tuple (page index, line number in the page).
+        :rtype: tuple
+        """
+        page_i = bisect.bisect_right(self._line_offsets, ordinal) - 1
+        return self.pages[page_i], ordinal - self._line_offsets[page_i]
+
+    def get_lines(self, start_ordinal, end_ordinal):
+        """
+        Return the text lines with ordinals from start_ordinal up to end_ordinal (exclusive).
+
+        :return: List of tuples (page index, line number in the page).
+        :rtype: list
+        """
+        lines = []
+        if start_ordinal >= end_ordinal:
+            return lines
+
+        page_i = bisect.bisect_right(self._line_offsets, start_ordinal) - 1
+        for ordinal in xrange(start_ordinal, end_ordinal):
+            while ordinal >= self._line_offsets[page_i+1]:
+                page_i += 1
+            lines.append((self.pages[page_i], ordinal - self._line_offsets[page_i]))
+        return lines
+
+    def find_bboxes_between_chars(self, start_char, end_char, line_cache=None):
+        """
+        Return the bounding boxes of the text lines between the two chars (both inclusive).
+
+        :param start_char: The first char.
+        :type start_char: CharRef
+
+        :param end_char: The last char.
+        :type end_char: CharRef
+
+        :param line_cache: If given, the bounding boxes and texts of whole lines are memoized in
+                            this dict, so that queries sharing some lines don't compute them again.
+        :type line_cache: dict | None
+
+        :return: The bounding boxes.
+        :rtype: list
+
+        :raises RuntimeError: If the chars are not part of any text line, or the end char
+                                precedes the start char.
+        """
+        assert isinstance(start_char, CharRef)
+        assert isinstance(end_char, CharRef)
+
+        self._ensure_layout_analyzed(start_char, end_char)
+
+        start_ordinal = self.get_line_ordinal(start_char)
+        end_ordinal = self.get_line_ordinal(end_char)
+        if start_ordinal == PageIndex.NO_LINE or end_ordinal == PageIndex.NO_LINE:
             raise RuntimeError("No lines found for: start '%s', end '%s'" % (str(start_char), str(end_char)))
+        if end_ordinal < start_ordinal:
+            raise RuntimeError("End line not found: %s" % str(end_char))
 
         bboxes = []
-        for line in lines:
-            pageid = self._get_page_for_page_item(line)
-            bboxes.append(BoundingBoxOnPage(line.bbox, pageid, line.get_text()))
-
-        # the first and last lines are not selected completely (note that this also works on a single line)
-        bboxes[0].bbox = BoundingBox(
-            start=Point(*start_char.bbox[:2]),
-            end=Point(*bboxes[0].bbox[2:])
-        )
-        bboxes[len(bboxes)-1].bbox = BoundingBox(
-            start=Point(*bboxes[len(bboxes) - 1].bbox[:2]),
-            end=Point(*end_char.bbox[2:])
-        )
-
-        start_i = start_char.index_in_layout_parent
-        end_i = end_char.index_in_layout_parent
-        if len(bboxes) == 1:
-            bboxes[0].text = self._get_line_substring(lines[0], start_i, end_i)
-        else:
-            bboxes[0].text = self._get_line_substring(lines[0], start=start_i)
-            bboxes[len(bboxes)-1].text = self._get_line_substring(lines[len(lines)-1], end=end_i)
+        for (page, line) in self.get_lines(start_ordinal, end_ordinal + 1):
+            bboxes.append(self._get_line_bbox(page, line, line_cache))
 
-        return bboxes
+        # the first and last lines are not selected completely; the bounding boxes are immutable,
+        # so they are replaced
+        start_bbox = start_char.page.char_bbox(start_char.row)
+        end_bbox = end_char.page.char_bbox(end_char.row)
 
-    def _get_line_substring(self, line, start=0, end=None):
-        assert isinstance(line, LTTextLine)
+        start_line = start_char.page.char_line(start_char.row)
+        end_line = end_char.page.char_line(end_char.row)
+        start_i = start_char.page.char_position_in_line(start_char.row)
+        end_i = end_char.page.char_position_in_line(end_char.row)
 
-        if end is None:
-            end = len(line)
+        (first, last) = (bboxes[0], bboxes[len(bboxes)-1])
+        if len(bboxes) == 1:
+            bboxes[0] = BoundingBoxOnPage(
+                BoundingBox.from_coords(start_bbox[0], start_bbox[1], end_bbox[2], end_bbox[3]),
+                first.page, start_char.page.line_text(start_line, start_i, end_i))
+        else:
+            bboxes[0] = BoundingBoxOnPage(
+                BoundingBox.from_coords(start_bbox[0], start_bbox[1], first.bbox[2], first.bbox[3]),
+                first.page, start_char.page.line_text(start_line, start=start_i))
+            bboxes[len(bboxes)-1] = BoundingBoxOnPage(
+                BoundingBox.from_coords(last.bbox[0], last.bbox[1], end_bbox[2], end_bbox[3]),
+                last.page, end_char.page.line_text(end_line, end=end_i))
 
-        text = ""
-        i = 0
-        for char in line:
-            if start <= i <= end and isinstance(char, LTText):
-                text += char.get_text()
-            i += 1
+        return bboxes
 
-        return text
+    def _get_line_bbox(self, page, line, line_cache):
+        if line_cache is None:
+            return BoundingBoxOnPage(page.line_bbox(line), page.pageid, page.line_text(line))
+
+        # the line ordinals change when pages are added, so the lines are keyed by their page
+        key = (page.pageid, line)
+        bbox = line_cache.get(key)
+        if bbox is None:
+            # BoundingBoxOnPage is immutable, so it can be shared by the results
+            bbox = BoundingBoxOnPage(page.line_bbox(line), page.pageid, page.line_text(line))
+            line_cache[key] = bbox
+        return bbox
+
+    def analyze_postponed_layout(self, page):
+        """
+        Run the postponed layout analysis of the given page of the document if it hasn't been analyzed yet.
+
+        :type page: PageIndex
+        """
+        self._ensure_page_layout_analyzed(page)
+
+    def _ensure_layout_analyzed(self, start_char, end_char):
+        # the lines between the two chars are taken from all pages between them, so pages
+        # with postponed layout analysis need to be analyzed now
+        start_i = start_char.page.index_in_document
+        end_i = end_char.page.index_in_document
+
+        for page in self.pages[min(start_i, end_i):max(start_i, end_i)+1]:
+            self._ensure_page_layout_analyzed(page)
+
+    def _ensure_page_layout_analyzed(self, page):
+        if not page.is_layout_analyzed:
+            start_time = time.time()
+            PDFLocPage.analyze_index(page, self.laparams)
+            self.instrumentation.layout_analyzed(page.pageid - 1, time.time() - start_time)
+            # the page has got its lines
+            self._update_positions(page.index_in_document)
+
+    def reading_order_key(self, char):
+        """
+        Return a key that sorts chars in the reading order of the document.
+
+        Chars that are not part of any text line are ordered after all the lines of their page.
+        """
+        assert isinstance(char, CharRef)
+        self._ensure_page_layout_analyzed(char.page)
+
+        line = char.page.char_line(char.row)
+        if line == PageIndex.NO_LINE:
+            return char.page.index_in_document, 1, 0, 0, char.row
+        return char.page.index_in_document, 0, line, char.page.char_position_in_line(char.row), char.row
 
     def find_bbox_for_char(self, char):
-        assert isinstance(char, LTChar)
-        pageid = self._get_page_for_page_item(char)
-        return BoundingBoxOnPage(char.bbox, pageid, char.get_text())
-
-    def _get_page_for_page_item(self, char_or_line):
-        node = char_or_line
-        while node is not None and not isinstance(node, PDFLocPage):
-            node = node.layout_parent
-
-        if node is None:
-            return None
-        return node.pageid
+        assert isinstance(char, CharRef)
+        return BoundingBoxOnPage(char.page.char_bbox(char.row), char.page.pageid, char.page.char_text(char.row))
 
 
 class PDFLocPage(LTPage):
 
     def __init__(self, pageid, bbox, rotate=0):
         super(PDFLocPage, self).__init__(pageid, bbox, rotate)
+        self.is_layout_analyzed = True
 
     def __getitem__(self, item):
         return self._objs[item]
 
     def analyze(self, laparams):
         super(PDFLocPage, self).analyze(laparams)
+        self.is_layout_analyzed = True
+
+    def defer_analysis(self):
+        """
+        Mark the layout analysis of this page as postponed; build_index() then records the
+        chars that take part in the analysis instead of the text lines.
+        """
+        self.is_layout_analyzed = False
+
+    def build_index(self, coords_to_chars):
+        """
+        Build the compact index of this page.
+
+        After that, this page and its layout objects are no longer needed for answering the
+        PDFLoc queries.
+
+        :param coords_to_chars: The keyword-to-chars mapping of this page as collected by
+                                    PDFLocPageAnalyzer.
+        :type coords_to_chars: dict
+
+        :return: The index.
+        :rtype: PageIndex
+        """
+        index = PageIndex(self.pageid, self.bbox)
+        rows = {}
+
+        def get_row(char):
+            if id(char) not in rows:
+                rows[id(char)] = index.add_char(char.bbox, char.get_text())
+            return rows[id(char)]
+
+        if self.is_layout_analyzed:
+            self._add_lines_to_index(index, get_row)
+        else:
+            index.defer_layout([get_row(obj) for obj in self if isinstance(obj, LTChar)])
+
+        for keyword_num in sorted(coords_to_chars.keys()):
+            index.add_keyword(keyword_num, [[get_row(char) for char in string]
+                                            for string in coords_to_chars[keyword_num]])
+
+        index.finish()
+        return index
+
+    @classmethod
+    def analyze_index(cls, index, laparams):
+        """
+        Run the postponed layout analysis of an indexed page and add the found text lines
+        to the index.
+
+        :param index: The index of a page whose layout analysis has been postponed.
+        :type index: PageIndex
+
+        :param laparams: The parameters of the layout analysis.
+        :type laparams: LAParams
+        """
+        assert not index.is_layout_analyzed
+
+        page = cls(index.pageid, index.bbox)
+        for row in index.deferred_rows:
+            page.add(PDFLocIndexedChar(index.char_bbox(row), index.char_text(row), row))
+        page.analyze(laparams)
+
+        page._add_lines_to_index(index, lambda char: char.row)
+        index.finish_layout()
+
+    def _add_lines_to_index(self, index, get_row):
+        for line in self._iter_text_lines(self.groups or []):
+            items = [get_row(item) if isinstance(item, LTChar) else item.get_text() for item in line]
+            index.add_line(line.bbox, items)
+
+    def _iter_text_lines(self, nodes):
+        # walks the layout tree in reading order
+        for node in nodes:
+            if isinstance(node, LTTextLine):
+                yield node
+            elif isinstance(node, LTContainer):
+                for line in self._iter_text_lines(node):
+                    yield line
+
+
+class PDFLocIndexedChar(LTChar):
+    """A character rebuilt from a page index; it only knows its bbox, text and index row."""
+
+    def __init__(self, bbox, text, row):
+        LTComponent.__init__(self, bbox)
+        self._text = text
+        self.row = row
+        self.matrix = MATRIX_IDENTITY
+        self.fontname = None
+        self.adv = self.width
+        self.upright = True
+        self.size = self.height
 
-        self.layout_parent = None
-        self.layout_children = self.groups
-        self.index_in_layout_parent = 0
-
-        i = 0
-        if self.groups is not None:  # may be None for empty pages
-            for child in self.groups:
-                self._set_as_layout_parent(self, child, i)
-                i += 1
-
-    def _set_as_layout_parent(self, parent, child, index_in_layout_parent):
-        child.layout_parent = parent
-        child.layout_children = []
-        child.index_in_layout_parent = index_in_layout_parent
-        if isinstance(child, collections.Iterable):
-            i = 0
-            for grandchild in child:
-                child.layout_children.append(grandchild)
-                self._set_as_layout_parent(child, grandchild, i)
-                i += 1
 
 class PDFLocFigure(LTFigure):
 
@@ -160,38 +349,20 @@ class PDFLocFigure(LTFigure):
     def __getitem__(self, item):
         return self._objs[item]
 
-    def analyze(self, laparams):
-        super(PDFLocFigure, self).analyze(laparams)
-
-        self.layout_parent = None
-        self.layout_children = self.groups
-        self.index_in_layout_parent = 0
-
-        i = 0
-        if self.groups is not None:
-            for child in self.groups:
-                self._set_as_layout_parent(self, child, i)
-                i += 1
-
-    def _set_as_layout_parent(self, parent, child, index_in_layout_parent):
-        child.layout_parent = parent
-        child.layout_children = []
-        child.index_in_layout_parent = index_in_layout_parent
-        if isinstance(child, collections.Iterable):
-            i = 0
-            for grandchild in child:
-                child.layout_children.append(grandchild)
-                self._set_as_layout_parent(child, grandchild, i)
-                i += 1
 
 class PDFLocPageAnalyzer(PDFPageAggregator):
-    def __init__(self, rsrcmgr, pageno=1, laparams=None):
-        super(PDFLocPageAnalyzer, self).__init__(rsrcmgr, pageno, laparams)
+    def __init__(self, rsrcmgr, pageno=1, laparams=None, lazy_layout=False):
+        # with lazy layout, the ancestor doesn't get the layout parameters, so that it doesn't
+        # analyze the pages; their analysis is just postponed in end_page()
+        super(PDFLocPageAnalyzer, self).__init__(rsrcmgr, pageno, laparams if not lazy_layout else None)
+        self.lazy_layout = lazy_layout
         self.current_line = 0
         self.text_lines = {}
         self.coords_to_chars = {}
         self.interpreter = None
         self.cur_item = None
+        # time spent in the layout analysis of the last page
+        self.layout_time = 0.0
 
     def set_interpreter(self, interpreter):
         assert isinstance(interpreter, PDFLocInterpreter)
@@ -205,6 +376,14 @@ class PDFLocPageAnalyzer(PDFPageAggregator):
         self.text_lines = {}
         self.coords_to_chars = {}
 
+    def end_page(self, page):
+        if self.lazy_layout:
+            self.cur_item.defer_analysis()
+        # the ancestor runs the layout analysis
+        start_time = time.time()
+        super(PDFLocPageAnalyzer, self).end_page(page)
+        self.layout_time = time.time() - start_time
+
     def begin_figure(self, name, bbox, matrix):
         super(PDFLocPageAnalyzer, self).begin_figure(name, bbox, matrix)
         self.cur_item = PDFLocFigure(name, bbox, mult_matrix(matrix, self.ctm))
@@ -217,14 +396,13 @@ class PDFLocPageAnalyzer(PDFPageAggregator):
         line = self.text_lines[self.current_line]
         self.coords_to_chars[self.current_line] = []
         i = 0
+        font = textstate.font
         for str in seq:
             if isinstance(str, basestring):
-                font = textstate.font
-                char_map = []
-                for cid in font.decode(str):
-                    char_map.append(line[i])
-                    i += 1
-                self.coords_to_chars[self.current_line].append(char_map)
+                # the decoded string is memoized by the font (see PDFLocResourceManager)
+                char_count = len(font.decode(str))
+                self.coords_to_chars[self.current_line].append(line[i:i+char_count])
+                i += char_count
 
     def render_char(self, matrix, font, fontsize, scaling, rise, cid):
         result = super(PDFLocPageAnalyzer, self).render_char(matrix, font, fontsize, scaling, rise, cid)
@@ -233,79 +411,267 @@ class PDFLocPageAnalyzer(PDFPageAggregator):
         return result
 
 
+class PDFLocResourceManager(PDFResourceManager):
+    """
+    A resource manager whose fonts memoize the decoding of strings to CIDs.
+
+    The strings are decoded both when rendering them and when mapping their chars to pdflocs,
+    and the fonts are shared by all pages using them, so each string is only decoded once.
+    """
+
+    # maximum number of memoized strings of each font
+    DECODE_CACHE_SIZE = 4096
+
+    def get_font(self, objid, spec):
+        font = PDFResourceManager.get_font(self, objid, spec)
+        if not isinstance(font.__dict__.get("decode"), _MemoizedDecode):
+            font.decode = _MemoizedDecode(font.decode, self.DECODE_CACHE_SIZE)
+        return font
+
+
+class _MemoizedDecode(object):
+    """
+    Wraps the decode() method of a font, remembering the CIDs of the decoded strings.
+    """
+
+    def __init__(self, decode, max_size):
+        super(_MemoizedDecode, self).__init__()
+        self._decode = decode
+        self._max_size = max_size
+        self._cache = {}
+
+    def __call__(self, string):
+        try:
+            return self._cache[string]
+        except KeyError:
+            pass
+
+        if len(self._cache) >= self._max_size:
+            self._cache.clear()
+
+        # CID fonts decode the strings lazily, so the result has to be stored as a tuple
+        cids = tuple(self._decode(string))
+        self._cache[string] = cids
+        return cids
+
+
+class PDFLocFormRecorder(PDFTextDevice):
+    """
+    A device recording what a form XObject draws, so that the drawing can be replayed on
+    another device without interpreting the form again.
+
+    The form should be interpreted with the identity CTM; the recorded drawing is then in
+    the form space and it is placed by the CTM given to PDFLocRecordedForm.replay().
+    """
+
+    def __init__(self, rsrcmgr):
+        super(PDFLocFormRecorder, self).__init__(rsrcmgr)
+        # list of (device method name, arguments)
+        self.events = []
+
+    def set_ctm(self, ctm):
+        super(PDFLocFormRecorder, self).set_ctm(ctm)
+        self.events.append(("set_ctm", (ctm,)))
+
+    def begin_tag(self, tag, props=None):
+        self.events.append(("begin_tag", (tag, props)))
+
+    def end_tag(self):
+        self.events.append(("end_tag", ()))
+
+    def do_tag(self, tag, props=None):
+        self.events.append(("do_tag", (tag, props)))
+
+    def begin_figure(self, name, bbox, matrix):
+        self.events.append(("begin_figure", (name, bbox, matrix)))
+
+    def end_figure(self, name):
+        self.events.append(("end_figure", (name,)))
+
+    def paint_path(self, graphicstate, stroke, fill, evenodd, path):
+        self.events.append(("paint_path", (graphicstate.copy(), stroke, fill, evenodd, path)))
+
+    def render_image(self, name, stream):
+        self.events.append(("render_image", (name, stream)))
+
+    def render_string(self, textstate, seq):
+        # the text state is recorded before rendering, because rendering moves its line matrix
+        self.events.append(("render_string", (textstate.copy(), seq)))
+        # the line matrix has to be moved the same way the real device would move it, because
+        # the following text of the form continues from there
+        super(PDFLocFormRecorder, self).render_string(textstate, seq)
+
+    def render_char(self, matrix, font, fontsize, scaling, rise, cid):
+        # the advance of the char, computed the same way as in LTChar
+        return font.char_width(cid) * fontsize * scaling
+
+
+class PDFLocRecordedForm(object):
+    """
+    The result of interpreting a form XObject: its keyword count and its drawing recorded
+    by PDFLocFormRecorder.
+    """
+
+    def __init__(self, keyword_count, events, resources, xobject_count=0):
+        """
+        :param int keyword_count: The number of keywords counted in the form.
+        :param list events: The events recorded by PDFLocFormRecorder.
+        :param dict resources: The resources the form was interpreted with (they are kept here
+                                so that they can be identified by their id in the cache key).
+        :param int xobject_count: The number of form XObjects invoked by the form.
+        """
+        super(PDFLocRecordedForm, self).__init__()
+        self.keyword_count = keyword_count
+        self.events = events
+        self.resources = resources
+        self.xobject_count = xobject_count
+
+    def replay(self, device, ctm):
+        """
+        Draw the recorded form on the given device.
+
+        :param PDFDevice device: The device.
+        :param tuple ctm: The CTM the form is drawn with.
+        """
+        for (method, args) in self.events:
+            if method == "set_ctm":
+                device.set_ctm(mult_matrix(args[0], ctm))
+            elif method == "render_string":
+                # the device moves the line matrix of the text state
+                device.render_string(args[0].copy(), args[1])
+            else:
+                getattr(device, method)(*args)
+
+
 class PDFLocInterpreter(PDFPageInterpreter):
+    # operators not counted in the keyword numbers of pdflocs (they only construct paths)
+    IGNORED_KEYWORDS = frozenset(["m", "l", "c", "v", "y", "h", "re", "n"])
+
+    # maximum number of recorded form XObjects kept in the cache
+    FORM_CACHE_SIZE = 32
+
     def __init__(self, rsrcmgr, device):
         PDFPageInterpreter.__init__(self, rsrcmgr, device)
-        self.ignored_keywords = ["do_"+kw for kw in ["m", "l", "c", "v", "y", "h", "re", "n"]]
         self.keyword_count = 0
+        # statistics of the current page: invoked form XObjects and the forms that had to be recorded
+        self.xobject_count = 0
+        self.recorded_form_count = 0
         # self.text_sequences = {}
-        self.is_first_level_call = None
-
-        # decorate the non-ignored keyword-processing functions so that they increment self.keyword_count
-        for member in dir(self):
-            if member.startswith("do_") and (member not in self.ignored_keywords):
-                setattr(self, member, self.call_func_with_keyword_counting( getattr(self, member) ).__get__(self, self.__class__))
-
-    def call_func_with_keyword_counting(self, func):
-        def call_func_and_count_keyword(args):
-            prev_is_first_level_call = self.is_first_level_call
-            if self.is_first_level_call is None:
-                self.is_first_level_call = True
-            else:
-                self.is_first_level_call = False
+        # recorded form XObjects; shared with the interpreters created by dup(), so that they
+        # live as long as the top-level interpreter (which is used for a whole document)
+        self.form_cache = collections.OrderedDict()
+
+    def dup(self):
+        interpreter = super(PDFLocInterpreter, self).dup()
+        interpreter.form_cache = self.form_cache
+        return interpreter
+
+    @classmethod
+    def get_dispatch_table(cls):
+        """
+        Return the table of operators this interpreter understands.
+
+        The table is built once for each interpreter class.
+
+        :return: Dict operator name => (unbound method, number of arguments, is counted in keyword numbers).
+        :rtype: dict
+        """
+        table = cls.__dict__.get("_dispatch_table")
+        if table is None:
+            table = {}
+            for member in dir(cls):
+                if not member.startswith("do_"):
+                    continue
+                func = getattr(cls, member).im_func
+                name = member[3:].replace('_a', '*').replace('_w', '"').replace('_q', "'")
+                table[name] = (func, func.func_code.co_argcount - 1, name not in cls.IGNORED_KEYWORDS)
+            cls._dispatch_table = table
+        return table
+
+    def execute(self, streams):
+        # the same as the ancestor's execute(), but the operators are looked up in the dispatch table
+        # and the counted ones increment self.keyword_count after they are processed; operators
+        # called by other operators (e.g. ' calls T* and Tj) don't go through here, so they are
+        # counted only once
+        try:
+            parser = PDFContentParser(streams)
+        except PSEOF:
+            # empty page
+            return
 
-            func(*args)
+        dispatch_table = self.get_dispatch_table()
+        nextobject = parser.nextobject
+        while True:
+            try:
+                (_, obj) = nextobject()
+            except PSEOF:
+                break
+
+            if not isinstance(obj, PSKeyword):
+                self.push(obj)
+                continue
+
+            operator = dispatch_table.get(obj.name)
+            if operator is None:
+                if STRICT:
+                    raise PDFInterpreterError('Unknown operator: %r' % obj.name)
+                continue
+
+            (func, nargs, is_counted) = operator
+            if nargs:
+                args = self.pop(nargs)
+                if len(args) != nargs:
+                    continue
+                func(self, *args)
+            else:
+                func(self)
 
-            if self.is_first_level_call:
+            if is_counted:
                 self.keyword_count += 1
 
-            self.is_first_level_call = prev_is_first_level_call
-
-        if func.func_code.co_argcount == 0:
-            def new_func():
-                call_func_and_count_keyword([])
-            return new_func
-        if func.func_code.co_argcount == 1:
-            def new_func(self):
-                call_func_and_count_keyword([])
-            return new_func
-        if func.func_code.co_argcount == 2:
-            def new_func(self, a1):
-                call_func_and_count_keyword([a1])
-            return new_func
-        if func.func_code.co_argcount == 3:
-            def new_func(self, a1, a2):
-                call_func_and_count_keyword([a1, a2])
-            return new_func
-        if func.func_code.co_argcount == 4:
-            def new_func(self, a1, a2, a3):
-                call_func_and_count_keyword([a1, a2, a3])
-            return new_func
-        if func.func_code.co_argcount == 5:
-            def new_func(self, a1, a2, a3, a4):
-                call_func_and_count_keyword([a1, a2, a3, a4])
-            return new_func
-        if func.func_code.co_argcount == 6:
-            def new_func(self, a1, a2, a3, a4, a5):
-                call_func_and_count_keyword([a1, a2, a3, a4, a5])
-            return new_func
-        if func.func_code.co_argcount == 7:
-            def new_func(self, a1, a2, a3, a4, a5, a6):
-                call_func_and_count_keyword([a1, a2, a3, a4, a5, a6])
-            return new_func
-
     def init_state(self, ctm):
         super(PDFLocInterpreter, self).init_state(ctm)
         self.keyword_count = 0
+        self.xobject_count = 0
+        self.recorded_form_count = 0
         # self.text_sequences = {}
-        self.is_first_level_call = None
+
+    def _get_recorded_form(self, xobj):
+        # According to PDF reference 1.7 section 4.9.1, XObjects in
+        # earlier PDFs (prior to v1.2) use the page's Resources entry
+        # instead of having their own Resources entry.
+        own_resources = dict_value(xobj.get('Resources'))
+
+        key = None
+        if xobj.objid is not None:
+            key = (xobj.objid, None if own_resources else id(self.resources))
+            form = self.form_cache.pop(key, None)
+            if form is not None:
+                # move the form to the most recently used position
+                self.form_cache[key] = form
+                return form
+
+        resources = own_resources or self.resources.copy()
+
+        # the form is interpreted in its own space (with the identity CTM), so that the recording
+        # can be replayed wherever the form is used
+        recorder = PDFLocFormRecorder(self.rsrcmgr)
+        interpreter = self.dup()
+        interpreter.device = recorder
+        interpreter.render_contents(resources, [xobj], ctm=MATRIX_IDENTITY)
+        form = PDFLocRecordedForm(interpreter.keyword_count, recorder.events, self.resources, interpreter.xobject_count)
+        self.recorded_form_count += 1 + interpreter.recorded_form_count
+
+        if key is not None:
+            self.form_cache[key] = form
+            while len(self.form_cache) > self.FORM_CACHE_SIZE:
+                self.form_cache.popitem(last=False)
+
+        return form
 
     def do_TJ(self, chain):
         super(PDFLocInterpreter, self).do_TJ(chain)
 
-        if not self.is_first_level_call:
-            return
-
         text_line = [s for s in chain if isinstance(s, basestring)]
 
         # self.text_sequences[self.keyword_count] = text_line
@@ -323,23 +689,18 @@ class PDFLocInterpreter(PDFPageInterpreter):
         if self.debug: logging.info('Processing xobj: %r' % xobj)
         subtype = xobj.get('Subtype')
         if subtype is LITERAL_FORM and 'BBox' in xobj:
-            interpreter = self.dup()
-            interpreter.is_first_level_call = None
             bbox = list_value(xobj['BBox'])
             matrix = list_value(xobj.get('Matrix', MATRIX_IDENTITY))
-            # According to PDF reference 1.7 section 4.9.1, XObjects in
-            # earlier PDFs (prior to v1.2) use the page's Resources entry
-            # instead of having their own Resources entry.
-            resources = dict_value(xobj.get('Resources')) or self.resources.copy()
+            form = self._get_recorded_form(xobj)
 
             self.device.begin_figure(xobjid, bbox, matrix)
-            interpreter.render_contents(resources, [xobj], ctm=mult_matrix(matrix, self.ctm))
+            form.replay(self.device, mult_matrix(matrix, self.ctm))
             self.device.end_figure(xobjid)
 
             # for (k,v) in interpreter.text_lines.iteritems():
             #     self.text_sequences[k + self.keyword_count] = v
-            self.keyword_count += interpreter.keyword_count
-            print "Included %i keywords" % interpreter.keyword_count
+            self.keyword_count += form.keyword_count
+            self.xobject_count += 1 + form.xobject_count
         else:
             # ignored xobject type.
             pass
@@ -0,0 +1,187 @@
+import collections
+
+from pdfminer.pdfdevice import PDFDevice
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfparser import PDFParser
+
+from pdfloc_converter.converter import PDFLocQueryError
+from pdfloc_converter.page_tree import PDFPageTree
+from pdfloc_converter.pdfloc import PDFLoc, PDFLocPair
+from pdfloc_converter.pdfminer_extensions import PDFLocInterpreter, PDFLocResourceManager
+
+__author__ = 'Martin Pecka'
+
+
+# a text-showing keyword of a page: its number and the decoded char count of each of its strings
+TextKeyword = collections.namedtuple("TextKeyword", ["keyword_num", "string_lengths"])
+
+
+class PDFLocScanDevice(PDFDevice):
+    """
+    A device that doesn't render anything, it only records the strings shown by the
+    text-showing keywords.
+
+    The keywords are numbered the same way PDFLocPageAnalyzer numbers them, so the recorded
+    strings are exactly the ones pdflocs can point to.
+    """
+
+    def __init__(self, rsrcmgr):
+        super(PDFLocScanDevice, self).__init__(rsrcmgr)
+        self.interpreter = None
+        # keyword number => list of decoded char counts of its strings
+        self.string_lengths = {}
+
+    def set_interpreter(self, interpreter):
+        assert isinstance(interpreter, PDFLocInterpreter)
+        self.interpreter = interpreter
+
+    def begin_page(self, page, ctm):
+        assert self.interpreter is not None
+        self.string_lengths = {}
+
+    def render_string(self, textstate, seq):
+        # text shown by a form XObject gets the number of the Do keyword, like in PDFLocPageAnalyzer
+        keyword_num = self.interpreter.keyword_count + 1
+        font = textstate.font
+        self.string_lengths[keyword_num] = [len(font.decode(s)) for s in seq if isinstance(s, basestring)]
+
+
+class PDFLocScanner(object):
+    """
+    Enumerates the text-showing keywords of document pages without rendering the glyphs and
+    without layout analysis.
+
+    The content streams are interpreted by PDFLocInterpreter (including the form XObjects),
+    so the keywords are counted exactly as when parsing the document for conversions.
+    """
+
+    def __init__(self, pdf_document):
+        """
+        :param pdf_document: The document. Its parser's source stream needs to be open while scanning.
+        :type pdf_document: PDFDocument
+        """
+        super(PDFLocScanner, self).__init__()
+
+        assert isinstance(pdf_document, PDFDocument)
+        self._pdf_document = pdf_document
+
+        rsrcmgr = PDFLocResourceManager()
+        self._device = PDFLocScanDevice(rsrcmgr)
+        self._interpreter = PDFLocInterpreter(rsrcmgr, self._device)
+        self._device.set_interpreter(self._interpreter)
+
+    def scan_page(self, page):
+        """
+        Return the text-showing keywords of the given page.
+
+        :param page: The page.
+        :type page: PDFPage
+
+        :return: List of TextKeyword sorted by the keyword number.
+        :rtype: list
+        """
+        self._interpreter.process_page(page)
+
+        string_lengths = self._device.string_lengths
+        return [TextKeyword(keyword_num, string_lengths[keyword_num]) for keyword_num in sorted(string_lengths.keys())]
+
+    def scan(self, pagenos=None):
+        """
+        Scan the given pages of the document.
+
+        :param pagenos: The page numbers (indexed from 0) to scan. None means all pages.
+        :type pagenos: set | None
+
+        :return: Generator of tuples (page number, list of TextKeyword) in the page order.
+        :rtype: generator
+        """
+        for (pageno, page) in PDFPageTree(self._pdf_document).get_pages(pagenos):
+            yield (pageno, self.scan_page(page))
+
+
+def validate_pdflocs(document, pdflocs):
+    """
+    Check that the given pdflocs point to chars shown by text-showing keywords of the document.
+
+    Only the pages the pdflocs point to are scanned, and they are scanned by PDFLocScanner,
+    which is much faster than parsing the pages for conversions.
+
+    :param document: Either a prepared PDFDocument, open file, or a string denoting a filename.
+                     If a filename is given, the file is closed before returning.
+    :type document: PDFDocument | file | basestring
+
+    :param pdflocs: The pdflocs to check. Either PDFLoc or PDFLocPair objects, or strings with
+                        a single pdfloc. A pair is valid if both its pdflocs are valid.
+    :type pdflocs: list
+
+    :return: A list with an item for each of the pdflocs, in their order. The item is None
+                if the pdfloc is valid, or a PDFLocQueryError describing why it is not.
+    :rtype: list
+    """
+    source_file_handle = None
+    if isinstance(document, basestring):
+        source_file_handle = file(document, 'rb')
+        document = PDFDocument(PDFParser(source_file_handle))
+    elif type(document) == file:
+        document = PDFDocument(PDFParser(document))
+
+    try:
+        results = [None] * len(pdflocs)
+
+        # index => list of the PDFLocs to check
+        checked_pdflocs = {}
+        for (index, pdfloc) in enumerate(pdflocs):
+            try:
+                if isinstance(pdfloc, basestring):
+                    pdfloc = PDFLoc(pdfloc)
+                if isinstance(pdfloc, PDFLoc):
+                    checked_pdflocs[index] = [pdfloc]
+                elif isinstance(pdfloc, PDFLocPair):
+                    checked_pdflocs[index] = [pdfloc.start, pdfloc.end]
+                else:
+                    raise ValueError("Not a pdfloc: %r" % (pdfloc,))
+            except ValueError as e:
+                results[index] = PDFLocQueryError(index, pdflocs[index], e)
+
+        pagenos = set()
+        for index_pdflocs in checked_pdflocs.itervalues():
+            pagenos.update(pdfloc.page for pdfloc in index_pdflocs)
+
+        # page number => dict keyword number => string lengths
+        pages = {}
+        for (pageno, keywords) in PDFLocScanner(document).scan(pagenos):
+            pages[pageno] = dict(keywords)
+
+        for (index, index_pdflocs) in checked_pdflocs.iteritems():
+            try:
+                for pdfloc in index_pdflocs:
+                    _check_pdfloc(pdfloc, pages)
+            except LookupError as e:
+                results[index] = PDFLocQueryError(index, pdflocs[index], e)
+
+        return results
+    finally:
+        if source_file_handle is not None:
+            source_file_handle.close()
+
+
+def _check_pdfloc(pdfloc, pages):
+    """
+    :raises LookupError: If the pdfloc doesn't point to a shown char.
+    """
+    if pdfloc.page not in pages:
+        raise LookupError("The document has no page %i" % pdfloc.page)
+
+    keywords = pages[pdfloc.page]
+    if pdfloc.keyword_num not in keywords:
+        raise LookupError("Keyword %s on page %i doesn't show any text" % (pdfloc.keyword_num, pdfloc.page))
+
+    string_lengths = keywords[pdfloc.keyword_num]
+    if pdfloc.string_num is None or pdfloc.string_num >= len(string_lengths):
+        raise LookupError("Keyword %i on page %i has only %i strings" % (
+            pdfloc.keyword_num, pdfloc.page, len(string_lengths)))
+
+    string_length = string_lengths[pdfloc.string_num]
+    if pdfloc.instring_num is None or pdfloc.instring_num >= string_length:
+        raise LookupError("String %i of keyword %i on page %i has only %i chars" % (
+            pdfloc.string_num, pdfloc.keyword_num, pdfloc.page, string_length))
@@ -0,0 +1,542 @@
+import BaseHTTPServer
+import SocketServer
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+from pdfloc_converter.cache import PDFLocCache
+from pdfloc_converter.converter import PDFLocConverter, PDFLocQueryError, describe_lookup_error
+from pdfloc_converter.pdfloc import PDFLoc, PDFLocPair, PDFLocBoundingBoxes, BoundingBoxOnPage, PointOnPage
+
+__author__ = 'Martin Pecka'
+
+
+class PDFLocDocumentPool(object):
+    """
+    A least-recently-used pool of converters of open documents.
+
+    The converters parse the document pages on demand, so that a request only waits for the
+    pages it needs. If the estimated memory occupied by all parsed pages exceeds the given
+    bound, the least recently used documents that are not being queried are closed.
+
+    A document whose file has changed since it was opened is opened again.
+    """
+
+    def __init__(self, max_memory=None, cache=None, root=None, lazy_layout=False, memory_map=False):
+        """
+        :param max_memory: Maximum (estimated) memory occupied by the parsed pages of all
+                            documents in bytes. None means unbounded.
+        :type max_memory: int | None
+
+        :param cache: The cache of parsed pages the converters use.
+        :type cache: PDFLocCache | None
+
+        :param root: If given, only documents inside this directory can be opened, and
+                        relative document paths are relative to it.
+        :type root: basestring | None
+
+        :param lazy_layout: Whether the layout analysis of the pages should be postponed
+                                (see PDFLocConverter.parse_document()).
+        :type lazy_layout: bool
+
+        :param memory_map: Whether the documents should be memory-mapped while they are open
+                            (see PDFLocConverter.__init__()).
+        :type memory_map: bool
+        """
+        super(PDFLocDocumentPool, self).__init__()
+
+        assert cache is None or isinstance(cache, PDFLocCache)
+
+        self._max_memory = max_memory
+        self._cache = cache
+        self._root = os.path.realpath(root) if root is not None else None
+        self._lazy_layout = lazy_layout
+        self._memory_map = memory_map
+
+        # path => _PooledDocument, in the least recently used order
+        self._documents = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # parsing statistics of the already closed documents
+        self._closed_parse_time = 0.0
+        self._closed_parsed_page_count = 0
+
+    def convert(self, path, jobs):
+        """
+        Run the given jobs on the given document.
+
+        :param path: Path to the document.
+        :type path: basestring
+
+        :param jobs: The jobs (see run_jobs()).
+        :type jobs: list
+
+        :return: The results of the jobs (see run_jobs()).
+        :rtype: list
+
+        :raises IOError: If the document can't be opened.
+        :raises ValueError: If the document is outside of the root directory.
+        """
+        document = self._acquire(path)
+        try:
+            with document.lock:
+                results = run_jobs(document.converter, jobs)
+                document.memory_size = document.converter.memory_size
+            return results
+        finally:
+            self._release(document)
+
+    def _acquire(self, path):
+        path = self._resolve_path(path)
+        stat = os.stat(path)
+        version = (stat.st_mtime, stat.st_size)
+
+        with self._lock:
+            document = self._documents.pop(path, None)
+            if document is not None and document.version != version and document.users == 0:
+                self._close(document)
+                document = None
+
+            opening = document is None
+            if opening:
+                self.misses += 1
+                # the document is opened outside of the lock, so that opening a large (or damaged)
+                # document doesn't hold up requests for other documents; concurrent requests
+                # for this document wait until it is opened
+                document = _PooledDocument(path, version)
+            else:
+                self.hits += 1
+
+            # the most recently used document is at the end
+            self._documents[path] = document
+            document.users += 1
+
+        if opening:
+            try:
+                converter = PDFLocConverter(path, cache=self._cache, memory_map=self._memory_map)
+                converter.parse_on_demand(max_memory=self._max_memory, lazy_layout=self._lazy_layout)
+            except Exception as e:
+                with self._lock:
+                    if self._documents.get(path) is document:
+                        del self._documents[path]
+                    document.users -= 1
+                document.set_error(e)
+                raise
+            document.set_converter(converter)
+        else:
+            document.opened.wait()
+            if document.error is not None:
+                with self._lock:
+                    document.users -= 1
+                raise document.error
+
+        return document
+
+    def _release(self, document):
+        with self._lock:
+            document.users -= 1
+            self._evict()
+
+    def _evict(self):
+        if self._max_memory is None:
+            return
+
+        memory = sum(document.memory_size for document in self._documents.itervalues())
+        for document in list(self._documents.itervalues()):
+            if memory <= self._max_memory:
+                break
+            if document.users > 0:
+                continue
+            del self._documents[document.path]
+            memory -= document.memory_size
+            self._close(document)
+            self.evictions += 1
+
+    def _close(self, document):
+        if document.converter is None:
+            # the document is still being opened (or failed to open)
+            return
+        self._closed_parse_time += document.converter.parse_time
+        self._closed_parsed_page_count += document.converter.parsed_page_count
+        document.converter.close()
+
+    def _resolve_path(self, path):
+        if self._root is None:
+            return os.path.realpath(path)
+
+        path = os.path.realpath(os.path.join(self._root, path))
+        if not path.startswith(self._root + os.sep):
+            raise ValueError("The document is outside of the served directory.")
+        return path
+
+    def get_stats(self):
+        """
+        Return the statistics of the pool.
+
+        :rtype: dict
+        """
+        with self._lock:
+            documents = [document for document in self._documents.itervalues() if document.converter is not None]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": float(self.hits) / lookups if lookups > 0 else None,
+                "evictions": self.evictions,
+                "parse_time": self._closed_parse_time + sum(
+                    document.converter.parse_time for document in documents),
+                "parsed_pages": self._closed_parsed_page_count + sum(
+                    document.converter.parsed_page_count for document in documents),
+                "memory_size": sum(document.memory_size for document in documents),
+                "resident_documents": [{
+                    "path": document.path,
+                    "memory_size": document.memory_size,
+                    "parse_time": document.converter.parse_time,
+                    "parsed_pages": document.converter.parsed_page_count,
+                    "users": document.users,
+                } for document in documents],
+            }
+
+    def close(self):
+        """
+        Close all documents.
+        """
+        with self._lock:
+            for document in self._documents.itervalues():
+                self._close(document)
+            self._documents.clear()
+
+
+class _PooledDocument(object):
+    def __init__(self, path, version):
+        super(_PooledDocument, self).__init__()
+        self.path = path
+        self.version = version
+        # the converter is None until the document is opened (or if opening it has failed)
+        self.converter = None
+        self.error = None
+        self.opened = threading.Event()
+        # the converters are not thread-safe
+        self.lock = threading.Lock()
+        # number of requests using the document
+        self.users = 0
+        # memory occupied by the parsed pages after the last request
+        self.memory_size = 0
+
+    def set_converter(self, converter):
+        self.converter = converter
+        self.opened.set()
+
+    def set_error(self, error):
+        self.error = error
+        self.opened.set()
+
+
+def run_jobs(converter, jobs):
+    """
+    Run conversion jobs given as JSON-like dicts.
+
+    The supported jobs are:
+     - {"pdfloc_pair": "#pdfloc(...);#pdfloc(...)"} returns {"bboxes": [bbox, ...]}
+     - {"pdfloc": "#pdfloc(...)"} returns {"bbox": bbox}
+     - {"point": {"page": 1, "x": 10.0, "y": 20.0}, "tolerance": 2.0} returns {"pdfloc": "#pdfloc(...)"}
+     - {"bboxes": [bbox, ...]} returns {"pdfloc_pair": "#pdfloc(...);#pdfloc(...)"}
+     - {"search": "text", "ignore_case": false} returns {"matches": [{"pdfloc_pair": "...", "bboxes": [bbox, ...]}, ...]}
+
+    where bbox is {"page": 1, "bbox": [x0, y0, x1, y1], "text": "..."} (pages are indexed from 1,
+    the text is only in the results). The point, bboxes and search jobs can also contain the "hash"
+    to put into the returned pdflocs. A search job needs all pages of the document (see
+    PDFLocConverter.search()). If there is no text at the point or in the bounding boxes, the
+    returned pdfloc (pair) is null.
+
+    :param converter: The converter of the document.
+    :type converter: PDFLocConverter
+
+    :param jobs: The jobs.
+    :type jobs: list
+
+    :return: List of results in the order of the jobs. A job that failed has the result
+                {"error": "description"}.
+    :rtype: list
+    """
+    results = [None] * len(jobs)
+
+    # the pair jobs are converted as a batch
+    pair_jobs = []
+    for (index, job) in enumerate(jobs):
+        try:
+            if not isinstance(job, dict):
+                raise ValueError("A job has to be an object.")
+
+            if "pdfloc_pair" in job:
+                (start, end) = job["pdfloc_pair"].split(";", 1)
+                pair_jobs.append((index, PDFLocPair(start.strip(), end.strip())))
+            elif "pdfloc" in job:
+                pdfloc = PDFLoc(job["pdfloc"])
+                try:
+                    bbox = converter.pdfloc_to_xy(pdfloc)
+                except KeyError as e:
+                    # the pages of PDFLocs are indexed from 0
+                    raise _JobError(describe_lookup_error(e, 0))
+                results[index] = {"bbox": _bbox_to_json(bbox)}
+            elif "point" in job:
+                point = job["point"]
+                xy = PointOnPage((float(point["x"]), float(point["y"])), int(point["page"]))
+                tolerance = float(job.get("tolerance", 2.0))
+                try:
+                    pdfloc = converter.xy_to_pdfloc(xy, tolerance, job.get("hash", "0000"))
+                except KeyError as e:
+                    # the pages of the points are indexed from 1
+                    raise _JobError(describe_lookup_error(e, 1))
+                results[index] = {"pdfloc": str(pdfloc) if pdfloc is not None else None}
+            elif "bboxes" in job:
+                bboxes = PDFLocBoundingBoxes([_bbox_from_json(bbox) for bbox in job["bboxes"]])
+                try:
+                    pdfloc_pair = converter.bboxes_to_pdfloc_pair(bboxes, job.get("hash", "0000"))
+                except KeyError as e:
+                    # the pages of the bboxes are indexed from 1
+                    raise _JobError(describe_lookup_error(e, 1))
+                results[index] = {"pdfloc_pair": (str(pdfloc_pair.start) + ";" + str(pdfloc_pair.end))
+                                  if pdfloc_pair is not None else None}
+            elif "search" in job:
+                matches = converter.search(job["search"], bool(job.get("ignore_case", False)), job.get("hash", "0000"))
+                results[index] = {"matches": [{
+                    "pdfloc_pair": str(pdfloc_pair.start) + ";" + str(pdfloc_pair.end),
+                    "bboxes": [_bbox_to_json(bbox) for bbox in bboxes],
+                } for (pdfloc_pair, bboxes) in matches]}
+            else:
+                raise ValueError("Unknown job type.")
+        except (_JobError, KeyError, ValueError, TypeError, AttributeError, RuntimeError) as e:
+            results[index] = {"error": _describe_error(e)}
+
+    pair_results = converter.pdfloc_pairs_to_bboxes([pdfloc_pair for (_, pdfloc_pair) in pair_jobs])
+    for ((index, _), result) in zip(pair_jobs, pair_results):
+        if isinstance(result, PDFLocQueryError):
+            results[index] = {"error": result.message}
+        else:
+            results[index] = {"bboxes": [_bbox_to_json(bbox) for bbox in result]}
+
+    return results
+
+
+class _JobError(Exception):
+    # a job refers to a part of the document that doesn't exist
+    pass
+
+
+def _describe_error(e):
+    if isinstance(e, KeyError):
+        # the conversions' KeyErrors are turned to _JobErrors, so this is a field missing in the job
+        return "The job has no field %s" % str(e)
+    return str(e)
+
+
+def _bbox_to_json(bbox):
+    assert isinstance(bbox, BoundingBoxOnPage)
+    return {
+        "page": bbox.page,
+        "bbox": list(bbox.bbox),
+        "text": bbox.text,
+    }
+
+
+def _bbox_from_json(bbox):
+    (x0, y0, x1, y1) = bbox["bbox"]
+    return BoundingBoxOnPage((float(x0), float(y0), float(x1), float(y1)), int(bbox["page"]))
+
+
+class PDFLocService(object):
+    """
+    Answers conversion requests from a document pool, limiting the number of concurrently
+    processed requests and the time a client waits for the answer.
+    """
+
+    def __init__(self, pool, max_concurrent=4, timeout=None):
+        """
+        :param pool: The pool of documents.
+        :type pool: PDFLocDocumentPool
+
+        :param max_concurrent: Maximum number of requests processed at once. Requests over
+                                the limit are rejected.
+        :type max_concurrent: int
+
+        :param timeout: Maximum time (in seconds) to wait for the result of a request. A request
+                            that takes longer is answered with an error; its processing can't be
+                            interrupted, so it still occupies its slot until it finishes.
+        :type timeout: float | None
+        """
+        super(PDFLocService, self).__init__()
+
+        assert isinstance(pool, PDFLocDocumentPool)
+
+        self.pool = pool
+        self._timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+        self._stats_lock = threading.Lock()
+        self._start_time = time.time()
+        self.requests = 0
+        self.jobs = 0
+        self.errors = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.request_time = 0.0
+
+    def handle(self, request):
+        """
+        Answer a conversion request.
+
+        :param request: The request {"document": "path", "jobs": [...]} (see run_jobs() for the jobs).
+        :type request: dict
+
+        :return: Tuple (HTTP status code, response). The response is {"results": [...]} or
+                    {"error": "description"}.
+        :rtype: tuple
+        """
+        if not isinstance(request, dict) or "document" not in request or not isinstance(request.get("jobs"), list):
+            self._count("errors")
+            return 400, {"error": "The request has to be an object with a document and a list of jobs."}
+
+        if not self._slots.acquire(False):
+            self._count("rejected")
+            return 503, {"error": "Too many concurrent requests."}
+
+        outcome = {}
+
+        def process():
+            start_time = time.time()
+            try:
+                outcome["results"] = self.pool.convert(request["document"], request["jobs"])
+            except (IOError, OSError, ValueError) as e:
+                outcome["error"] = str(e)
+            finally:
+                self._slots.release()
+                with self._stats_lock:
+                    self.request_time += time.time() - start_time
+
+        worker = threading.Thread(target=process)
+        worker.daemon = True
+        worker.start()
+        worker.join(self._timeout)
+
+        with self._stats_lock:
+            self.requests += 1
+            self.jobs += len(request["jobs"])
+
+        if worker.is_alive():
+            self._count("timeouts")
+            return 504, {"error": "The request timed out."}
+        if "error" in outcome:
+            self._count("errors")
+            return 400, {"error": outcome["error"]}
+        if "results" not in outcome:
+            # the processing crashed; the traceback has been printed by the thread
+            self._count("errors")
+            return 500, {"error": "Internal error."}
+        return 200, {"results": outcome["results"]}
+
+    def _count(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get_stats(self):
+        """
+        Return the statistics of the service and its document pool.
+
+        :rtype: dict
+        """
+        with self._stats_lock:
+            stats = {
+                "uptime": time.time() - self._start_time,
+                "requests": self.requests,
+                "jobs": self.jobs,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "request_time": self.request_time,
+            }
+        stats["documents"] = self.pool.get_stats()
+        return stats
+
+
+class PDFLocRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    HTTP interface of PDFLocService: POST /convert with a JSON request, GET /stats.
+    """
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send_json(200, self.server.service.get_stats())
+        else:
+            self._send_json(404, {"error": "Not found."})
+
+    def do_POST(self):
+        if self.path != "/convert":
+            self._send_json(404, {"error": "Not found."})
+            return
+
+        try:
+            length = int(self.headers.getheader("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self._send_json(400, {"error": "Invalid request: %s" % str(e)})
+            return
+
+        (status, response) = self.server.service.handle(request)
+        self._send_json(status, response)
+
+    def _send_json(self, status, data):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # unix socket clients have no address
+        client = self.client_address[0] if isinstance(self.client_address, tuple) else "unix-socket"
+        sys.stderr.write("%s - - [%s] %s\n" % (client, self.log_date_time_string(), format % args))
+
+
+class PDFLocHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves PDFLocService over HTTP on a TCP port (it should only listen on localhost).
+    """
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        """
+        :param tuple address: (host, port)
+        :param PDFLocService service: The service.
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, address, PDFLocRequestHandler)
+        self.service = service
+
+
+class PDFLocUnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    Serves PDFLocService over HTTP on a Unix socket.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        """
+        :param basestring path: Path of the socket. An existing socket file is replaced.
+        :param PDFLocService service: The service.
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        SocketServer.UnixStreamServer.__init__(self, path, PDFLocRequestHandler)
+        self.service = service
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
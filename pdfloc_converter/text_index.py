@@ -0,0 +1,249 @@
+import array
+import bisect
+
+from pdfloc_converter.document_structure import PageIndex
+
+__author__ = 'Martin Pecka'
+
+
+class PDFLocTextIndex(object):
+    """
+    Full-text index of the pages of a document.
+
+    The indexed text is the text of the lines of the pages in the reading order. Every run of
+    whitespace (including line and page breaks) is collapsed into a single space, so that phrases
+    are found across line breaks. Each position of the text is mapped to the char row it comes
+    from; the whitespace added by the layout analysis is mapped to no row.
+
+    The lowercased text is indexed by trigrams: each trigram maps to the pages it starts on. A query
+    is only looked for around the pages containing its rarest trigram. The text itself is searched
+    by unicode.find().
+
+    The pages are added one by one and identified by their page numbers, so the index doesn't keep
+    the page indices. The text of a page never changes once its layout has been analyzed, so the
+    index stays valid when its pages are evicted from the converter and parsed again later.
+    """
+
+    # length of the indexed n-grams
+    _ngram_length = 3
+    # text positions not coming from any char row (with a position in the page content)
+    NO_ROW = -1
+
+    def __init__(self):
+        super(PDFLocTextIndex, self).__init__()
+
+        # pageno => (text of the page, array of the char rows of its positions)
+        self._page_texts = {}
+
+        # the following is built from _page_texts by _build() when the index is used
+        self._built = False
+        self._pagenos = []
+        # the text of page _pagenos[i] starts at _page_starts[i]; _rows[p] is the char row of text position p
+        self._page_starts = array.array('i')
+        self._rows = array.array('i')
+        self._text = u""
+        self._lower_text = u""
+        # trigram => array of the indices (to _pagenos) of the pages it starts on
+        self._ngram_pages = {}
+
+    def __contains__(self, pageno):
+        return pageno in self._page_texts
+
+    def add_page(self, pageno, page):
+        """
+        Add the text of the given page to the index. The layout of the page has to be analyzed.
+
+        :param pageno: The page number (indexed from 0).
+        :type pageno: int
+
+        :param page: The page index.
+        :type page: PageIndex
+        """
+        assert isinstance(page, PageIndex)
+        assert page.is_layout_analyzed
+
+        texts = []
+        rows = array.array('i')
+        # no leading space in the text of a page; the text of the previous one ends with a space
+        at_space = True
+        for line in xrange(page.line_count):
+            for (row, text) in page.line_items(line):
+                if len(text) == 0:
+                    continue
+                if row is None or page.char_location(row) is None:
+                    row = self.NO_ROW
+                if text.isspace():
+                    if not at_space:
+                        texts.append(u" ")
+                        rows.append(row)
+                        at_space = True
+                else:
+                    texts.append(text)
+                    rows.extend([row] * len(text))
+                    at_space = False
+
+            # lines are separated by whitespace even if the layout analysis didn't add any
+            if not at_space:
+                texts.append(u" ")
+                rows.append(self.NO_ROW)
+                at_space = True
+
+        self._page_texts[pageno] = (u"".join(texts), rows)
+        self._built = False
+
+    def _build(self):
+        if self._built:
+            return
+
+        self._pagenos = sorted(self._page_texts)
+        self._page_starts = array.array('i')
+        self._rows = array.array('i')
+        texts = []
+        for pageno in self._pagenos:
+            (text, rows) = self._page_texts[pageno]
+            self._page_starts.append(len(self._rows))
+            texts.append(text)
+            self._rows.extend(rows)
+
+        self._text = u"".join(texts)
+        # unicode.lower() maps each code point to a single one, so the positions are kept
+        self._lower_text = self._text.lower()
+
+        self._ngram_pages = {}
+        for (page_i, start) in enumerate(self._page_starts):
+            end = self._page_starts[page_i+1] if page_i + 1 < len(self._page_starts) else len(self._text)
+            for ngram in set(self._lower_text[i:i+self._ngram_length] for i in xrange(start, end)):
+                pages = self._ngram_pages.get(ngram)
+                if pages is None:
+                    pages = array.array('i')
+                    self._ngram_pages[ngram] = pages
+                pages.append(page_i)
+
+        self._built = True
+
+    @property
+    def text(self):
+        """
+        The indexed text.
+        :rtype: unicode
+        """
+        self._build()
+        return self._text
+
+    @property
+    def memory_size(self):
+        """
+        Estimate of the memory occupied by the index in bytes.
+        """
+        size = 0
+        for (text, rows) in self._page_texts.itervalues():
+            size += len(text) * 4 + rows.itemsize * len(rows) + 150
+        size += (len(self._text) + len(self._lower_text)) * 4
+        size += self._rows.itemsize * len(self._rows)
+        for (ngram, pages) in self._ngram_pages.iteritems():
+            size += 4 * len(ngram) + pages.itemsize * len(pages) + 150
+        return size
+
+    def find(self, query, ignore_case=False):
+        """
+        Find the non-overlapping occurrences of the query in the text.
+
+        Whitespace runs in the query match any whitespace runs in the text (including line and page
+        breaks); leading and trailing whitespace of the query is ignored.
+
+        :param query: The text to look for.
+        :type query: unicode
+
+        :param ignore_case: Whether the letter case should be ignored.
+        :type ignore_case: bool
+
+        :return: List of tuples ((page number, row) of the first char, (page number, row) of the last char)
+                    of the occurrences in the reading order. Occurrences that contain no char with
+                    a position in the page content are skipped.
+        :rtype: list
+
+        :raises ValueError: If the query is empty.
+        """
+        query = normalize_query(query)
+        if len(query) == 0:
+            raise ValueError("The search query is empty.")
+
+        self._build()
+
+        if ignore_case:
+            (text, query) = (self._lower_text, query.lower())
+        else:
+            text = self._text
+
+        matches = []
+        last_end = 0
+        for (window_start, window_end) in self._get_windows(query.lower()):
+            position = text.find(query, max(window_start, last_end), window_end)
+            while position >= 0:
+                last_end = position + len(query)
+                match = self._get_match(position, last_end)
+                if match is not None:
+                    matches.append(match)
+                position = text.find(query, last_end, window_end)
+
+        return matches
+
+    def _get_windows(self, lower_query):
+        """
+        Return the sorted disjoint ranges (start, end) of the text the query can be found in.
+        """
+        if len(lower_query) < self._ngram_length:
+            return [(0, len(self._text))]
+
+        pages = None
+        for i in xrange(len(lower_query) - self._ngram_length + 1):
+            ngram_pages = self._ngram_pages.get(lower_query[i:i+self._ngram_length])
+            if ngram_pages is None:
+                return []
+            if pages is None or len(ngram_pages) < len(pages):
+                pages = ngram_pages
+
+        # an occurrence containing the trigram starting on page i lies at most the query length
+        # before or after the text of the page
+        windows = []
+        for page_i in pages:
+            start = max(self._page_starts[page_i] - len(lower_query), 0)
+            end = self._page_starts[page_i+1] if page_i + 1 < len(self._page_starts) else len(self._text)
+            end = min(end + len(lower_query), len(self._text))
+            if len(windows) > 0 and start <= windows[-1][1]:
+                windows[-1] = (windows[-1][0], end)
+            else:
+                windows.append((start, end))
+        return windows
+
+    def _get_match(self, start, end):
+        first = self._get_char(start, end, 1)
+        if first is None:
+            return None
+        return first, self._get_char(end - 1, start - 1, -1)
+
+    def _get_char(self, start, stop, step):
+        # the first char with a position in the page content in the given range of the text
+        for position in xrange(start, stop, step):
+            row = self._rows[position]
+            if row != self.NO_ROW:
+                return self._pagenos[bisect.bisect_right(self._page_starts, position) - 1], row
+        return None
+
+
+def normalize_query(query):
+    """
+    Collapse the whitespace runs of the query the same way as in the indexed text.
+
+    :param query: The query. Byte strings are decoded as UTF-8.
+    :type query: basestring
+
+    :rtype: unicode
+
+    :raises TypeError: If the query is not a string.
+    """
+    if isinstance(query, str):
+        query = query.decode("utf-8")
+    elif not isinstance(query, unicode):
+        raise TypeError("The search query has to be a string.")
+    return u" ".join(query.split())
@@ -1,11 +1,21 @@
 #!/usr/bin/env python
 import os
 import sys
+import time
 import argparse
 from collections import deque
 
-from pdfloc_converter.converter import PDFLocConverter
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfparser import PDFParser
+
+from pdfloc_converter.cache import PDFLocCache
+from pdfloc_converter.annotation_writer import PDFLocAnnotationWriter
+from pdfloc_converter.batch import PDFLocBatchRunner
+from pdfloc_converter.converter import PDFLocConverter, describe_lookup_error
+from pdfloc_converter.instrumentation import PDFLocStatsCollector
 from pdfloc_converter.pdfloc import PDFLocPair, BoundingBoxOnPage, PDFLocBoundingBoxes
+from pdfloc_converter.scanner import PDFLocScanner, validate_pdflocs
+from pdfloc_converter.server import PDFLocDocumentPool, PDFLocService, PDFLocHTTPServer, PDFLocUnixHTTPServer
 from pdfloc_converter.utils.paraformatter import ParagraphFormatter
 
 
@@ -37,6 +47,15 @@ class PDFLocConverterCLI(object):
 
     # Process the command-line instructions.
     def execute_commandline(self, argv):
+        if len(argv) > 1 and argv[1] == "validate":
+            return self.execute_validate(argv[2:])
+        if len(argv) > 1 and argv[1] == "serve":
+            return self.execute_serve(argv[2:])
+        if len(argv) > 1 and argv[1] == "batch":
+            return self.execute_batch(argv[2:])
+        if len(argv) > 1 and argv[1] == "search":
+            return self.execute_search(argv[2:])
+
         # get rid of argv[0], since it only contains the command that was run
         args = self.parse_commandline(argv[1:])
 
@@ -47,22 +66,34 @@ class PDFLocConverterCLI(object):
         pdfloc_jobs = [job for job in jobs if isinstance(job, PDFLocPair)]
         bbox_jobs = [job for job in jobs if isinstance(job, PDFLocBoundingBoxes)]
 
-        # if we have an input jobs file, we parse the whole document in advance
-        pdflocs = pdfloc_jobs if args.jobs_file is None else []
-        bboxes = bbox_jobs if args.jobs_file is None else []
+        cache = PDFLocCache(args.cache_dir, args.cache_size) if args.cache_dir is not None else None
+
+        stats = PDFLocStatsCollector() if args.stats else None
 
-        converter = PDFLocConverter(args.filename, pdflocs, bboxes)
-        converter.parse_document()
+        converter = PDFLocConverter(args.filename, pdfloc_jobs, bbox_jobs, cache=cache, instrumentation=stats,
+                                    memory_map=args.memory_map)
 
-        pages = converter._pdf_document.catalog['Pages'].resolve()['Kids']
+        if args.jobs_file is not None and args.workers is None:
+            # the jobs from the jobs file are not known in advance, so we parse the pages they need
+            # as they arrive (the pages of the command-line jobs are parsed right away)
+            converter.parse_on_demand(max_pages=args.max_pages)
+        elif args.jobs_file is not None:
+            # parallel parsing only pays off when the whole document is parsed in advance
+            converter.restrict_only_on_pages_from()
+            converter.parse_document(workers=args.workers)
+        else:
+            converter.parse_document(workers=args.workers)
 
-        max_pdf_object_num = 0
-        for xref in converter._pdf_document.xrefs:
-            max_pdf_object_num = max(max_pdf_object_num, max(xref.offsets.keys()))
+        # stdout is occupied by the PDF update unless streaming
+        messages = sys.stdout if args.stream else sys.stderr
 
-        pdf_update_string = u'\n'
+        writer = None
+        if not args.stream:
+            output = file(args.output, 'wb') if args.output is not None else sys.stdout
+            writer = PDFLocAnnotationWriter(args.filename.name, output, copy_source=args.output is not None)
 
-        bboxes_result = {}
+        conversion_start_time = time.time()
+        job_count = 0
 
         # process all jobs, writing their results to stdout
         while True:
@@ -89,7 +120,7 @@ class PDFLocConverterCLI(object):
                             jobs.append(self.parse_pdfloc_or_bounding_box_from_string(job))
                             break  # let the loop process the parsed job before we read further
                         except ValueError as e:
-                            print "Error parsing %s. Cause: %s" % (job, str(e))
+                            print >>messages, "Error parsing %s. Cause: %s" % (job, str(e))
                             break
 
             if len(jobs) == 0:
@@ -97,115 +128,314 @@ class PDFLocConverterCLI(object):
                 break
 
             job = jobs.popleft()
+            job_count += 1
 
             try:
                 if isinstance(job, PDFLocPair):
                     bboxes = PDFLocBoundingBoxes(converter.pdfloc_pair_to_bboxes(job), job.start.page, job.comment)
-                    if bboxes.page not in bboxes_result:
-                        bboxes_result[bboxes.page] = []
-                    bboxes_result[bboxes.page].append(bboxes)
-                    #print "\n".join([str(bbox).strip() for bbox in bboxes.bboxes]) + "\n\n"
+                    if args.stream:
+                        print "\n".join([str(bbox).strip() for bbox in bboxes.bboxes]) + "\n"
+                        sys.stdout.flush()
+                        continue
+                    writer.add_highlight(bboxes)
                 else:
                     pdfloc_pair = converter.bboxes_to_pdfloc_pair(job)
-                    #print str(pdfloc_pair) + "\n\n"
+                    if pdfloc_pair is not None:
+                        print >>messages, str(pdfloc_pair)
+                    else:
+                        print >>messages, "No text found in %s" % str(job)
+                    messages.flush()
             except KeyError as e:
-                print "Error converting %s. Cause: %s" % (job, repr(e))
+                # the pages of PDFLocs are indexed from 0, the pages of bboxes from 1
+                cause = describe_lookup_error(e, 0 if isinstance(job, PDFLocPair) else 1)
+                print >>messages, "Error converting %s. Cause: %s" % (job, cause)
+                messages.flush()
 
-        previous_startxref = 515742  # TODO
-        orig_pdf_size = os.path.getsize(args.filename.name)-1
-        xref_table = u"xref\n0 1\n0000000000 65535 f \n"
+        if writer is not None:
+            writer.close()
+            if args.output is not None:
+                output.close()
 
-        for page_num in bboxes_result.keys():
-            bbox_list = bboxes_result[page_num]
-            page_ref = converter._pdf_document.catalog['Pages'].resolve()['Kids'][page_num-1]
-            page = page_ref.resolve()
+        if stats is not None:
+            # the time of the pages parsed on demand is included both in the parsing phases and in converting
+            print >>sys.stderr, stats.format_report()
+            print >>sys.stderr, "  %-26s %9.3f s  (%i jobs)" % ("converting jobs:", time.time() - conversion_start_time,
+                                                                job_count)
 
-            xref_table += u"%d 1\n%010d 00000 n \n" % (page_ref.objid, len(pdf_update_string)+orig_pdf_size)
+        converter.close()
 
-            annots_objid = max_pdf_object_num + 1
-            max_pdf_object_num += 1
+        return 0
 
-            exiting_annots_objids = []
-            if 'Annots' in page:
-                exiting_annots = page['Annots']
-                exiting_annots_objids = [annot.objid for annot in page['Annots']]
+    # Process the validate subcommand.
+    def execute_validate(self, argv):
+        args = self.parse_validate_commandline(argv)
 
-            pdf_update_string += u"%i 0 obj\n<<" \
-                                 u"/Type/Page" \
-                                 u"/Parent %i 0 R " \
-                                 u"/Resources %i 0 R" \
-                                 u"/MediaBox [%i %i %i %i]" \
-                                 u"/Group<</S/Transparency/CS/DeviceRGB/I true>>" \
-                                 u"/Contents %i 0 R" \
-                                 u"/Annots %d 0 R" \
-                                 u">>\nendobj\n" % (page_ref.objid, page['Parent'].objid, page['Resources'].objid,
-                                         page['MediaBox'][0], page['MediaBox'][1], page['MediaBox'][2], page['MediaBox'][3],
-                                         page['Contents'].objid, annots_objid)
+        queries = list(args.pdflocs)
+        if args.jobs_file is not None:
+            queries.extend(line.strip() for line in args.jobs_file if len(line.strip()) > 0)
+            args.jobs_file.close()
 
-            annots = range(max_pdf_object_num + 1, max_pdf_object_num + 1 + len(bbox_list))
-            max_pdf_object_num += len(bbox_list)
+        pdflocs = []
+        for query in queries:
+            # pairs are valid if both their pdflocs are valid; single pdflocs are parsed by validate_pdflocs
+            pdflocs.append(self.parse_pdfloc_or_bounding_box_from_string(query) if query.find(";") > -1 else query)
 
-            xref_table += u"%d 1\n%010d 00000 n \n" % (annots_objid, len(pdf_update_string) + orig_pdf_size)
+        pdf_document = PDFDocument(PDFParser(args.filename))
 
-            items_refs = u" 0 R ".join(str(objid) for objid in exiting_annots_objids + annots) + u" 0 R"
-            pdf_update_string += u"%d 0 obj [%s] endobj\n" % (annots_objid, items_refs)
+        if args.list_page is not None:
+            for (pageno, keywords) in PDFLocScanner(pdf_document).scan(set(args.list_page)):
+                for keyword in keywords:
+                    print "page %i, keyword %i: %s" % (pageno, keyword.keyword_num,
+                                                        " ".join(str(length) for length in keyword.string_lengths))
 
-            i = 0
-            for annotation_bboxes in bbox_list:
-                objid = annots[i]
+        all_valid = True
+        for (query, error) in zip(queries, validate_pdflocs(pdf_document, pdflocs)):
+            if error is None:
+                print "OK %s" % query
+            else:
+                print "INVALID %s: %s" % (query, error.message)
+                all_valid = False
 
-                xref_table += u"%d 1\n%010d 00000 n \n" % (objid, len(pdf_update_string) + orig_pdf_size)
+        args.filename.close()
 
-                comment = annotation_bboxes.comment.decode('utf-8').replace(u")", u"\\)")
-                first_box = annotation_bboxes.bboxes[0].bbox
-                last_box = annotation_bboxes.bboxes[-1].bbox
+        return 0 if all_valid else 1
 
-                pdf_update_string += u"%d 0 obj\n<<" \
-                                     u"/Subtype /Highlight" \
-                                     u"/P %d 0 R" \
-                                     u"/C [1 1 0]" \
-                                     u"/F 4" \
-                                     u"/Contents (%s)" \
-                                     u"/Rect [%d %d %d %d] " \
-                                     u"/QuadPoints [" % (
-                    objid, page_ref.objid, comment,
-                    min(first_box[0], last_box[0]), min(first_box[1], last_box[1]),
-                    max(first_box[2], last_box[2]), max(first_box[3], last_box[3])
-                )
+    def parse_validate_commandline(self, argv):
+        help_description = '''Checks that pdflocs point to text in a PDF file. The pages are only \
+scanned for their text-showing keywords, which is much faster than the parsing needed for conversions.
 
-                j = 0
-                for bbox in annotation_bboxes.bboxes:
-                    bbox = bbox.bbox
+The pdflocs can be given either one by one, or as pairs separated by a semicolon. A pair is valid if both \
+its pdflocs are valid. Each line of the jobs file contains one pdfloc or pair.
 
-                    top = min(bbox[1], bbox[3])
-                    bottom = max (bbox[1], bbox[3])
-                    left = min(bbox[0], bbox[2])
-                    right = max(bbox[0], bbox[2])
-                    if top - bottom > 20:
-                        top = bottom + 20
+Prints a line starting with OK or INVALID for each pdfloc. The exit code is 1 if any of them is invalid.
+'''
+        parser = argparse.ArgumentParser(prog="%s validate" % os.path.basename(sys.argv[0]),
+                                         description=help_description, formatter_class=ParagraphFormatter)
 
-                    pdf_update_string += u"%d %d %d %d %d %d %d %d " % (
-                        left, bottom, right, bottom, left, top, right, top
-                    )
+        parser.add_argument("-f", "--jobs-file", type=argparse.FileType(mode='r'),
+                            help="A file containing the pdflocs to check. "
+                                 "Can be stdin (specify '-' (just a dash) as the filename).")
+
+        parser.add_argument("--list-page", type=int, action="append",
+                            help="Also print the text-showing keywords of this page (indexed from 0) with the "
+                                 "char counts of their strings. Can be given more times.")
+
+        parser.add_argument("filename", type=argparse.FileType(mode='rb'),
+                            help="The file the pdflocs point to.")
 
-                    j += 1
+        parser.add_argument("pdflocs", nargs="*", help="The pdflocs to check.")
 
-                pdf_update_string += u"]>>\nendobj\n"
-                i += 1
+        return parser.parse_args(argv)
 
-        pdf_update_string += u"\n"
+    # Process the serve subcommand.
+    def execute_serve(self, argv):
+        args = self.parse_serve_commandline(argv)
 
-        xref_position = orig_pdf_size + len(pdf_update_string)
+        cache = PDFLocCache(args.cache_dir, args.cache_size) if args.cache_dir is not None else None
+        pool = PDFLocDocumentPool(args.max_memory, cache, args.root, args.lazy_layout, args.memory_map)
+        service = PDFLocService(pool, args.max_concurrent, args.timeout)
 
-        pdf_update_string = pdf_update_string + xref_table + u"\n" \
-                                                             u"trailer\n<<\n/Size %d /Root %d 0 R /Prev %d\n>>\n" % \
-                                                             (max_pdf_object_num+1, converter._pdf_document.xrefs[0].trailer['Root'].objid, previous_startxref)
+        if args.socket is not None:
+            server = PDFLocUnixHTTPServer(args.socket, service)
+            print >>sys.stderr, "Listening on %s" % args.socket
+        else:
+            server = PDFLocHTTPServer((args.host, args.port), service)
+            print >>sys.stderr, "Listening on http://%s:%i" % (args.host, args.port)
 
-        pdf_update_string += u"startxref\n%d\n%%%%EOF" % xref_position
-        print pdf_update_string
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            pool.close()
 
         return 0
 
+    def parse_serve_commandline(self, argv):
+        help_description = '''Runs a conversion server keeping the parsed documents in memory. The \
+requests are HTTP: POST /convert with a JSON body, and GET /stats returning the server statistics.
+
+The format of a request is:
+    {"document": "/path/to/file.pdf", "jobs": [job, ...]}
+
+The jobs are:
+    {"pdfloc_pair": "#pdfloc(...);#pdfloc(...)"}
+    {"pdfloc": "#pdfloc(...)"}
+    {"point": {"page": 1, "x": 100.0, "y": 200.0}, "tolerance": 2.0}
+    {"bboxes": [{"page": 1, "bbox": [0, 0, 200, 200]}, ...]}
+
+The response contains a result (or an error) for each job: {"results": [...]}.
+'''
+        parser = argparse.ArgumentParser(prog="%s serve" % os.path.basename(sys.argv[0]),
+                                         description=help_description, formatter_class=ParagraphFormatter)
+
+        parser.add_argument("--socket", help="Listen on this Unix socket instead of a TCP port.")
+
+        parser.add_argument("--host", default="127.0.0.1", help="The address to listen on.")
+
+        parser.add_argument("--port", type=int, default=8765, help="The TCP port to listen on.")
+
+        parser.add_argument("--root",
+                            help="Only serve documents inside this directory. Relative document paths "
+                                 "are relative to it.")
+
+        parser.add_argument("--max-memory", type=int, default=512 * 1024 * 1024,
+                            help="Maximum estimated memory occupied by the parsed pages of all documents "
+                                 "in bytes. The least recently used documents are closed when exceeded.")
+
+        parser.add_argument("--max-concurrent", type=int, default=4,
+                            help="Maximum number of requests processed at once. More requests are rejected.")
+
+        parser.add_argument("--timeout", type=float, default=30.0,
+                            help="Maximum time in seconds a request can take before it's answered with an error.")
+
+        parser.add_argument("--lazy-layout", action="store_true",
+                            help="Postpone the layout analysis of the pages until a job needs it.")
+
+        parser.add_argument("--memory-map", action="store_true",
+                            help="Memory-map the open documents instead of reading them in small chunks.")
+
+        parser.add_argument("--cache-dir",
+                            help="A directory for caching the parsed document pages.")
+
+        parser.add_argument("--cache-size", type=int,
+                            help="Maximum size of the cache directory in bytes.")
+
+        return parser.parse_args(argv)
+
+    # Process the batch subcommand.
+    def execute_batch(self, argv):
+        args = self.parse_batch_commandline(argv)
+
+        cache = PDFLocCache(args.cache_dir, args.cache_size) if args.cache_dir is not None else None
+        runner = PDFLocBatchRunner(args.output_dir, args.workers, args.split_pages if args.split_pages > 0 else None,
+                                   cache, args.lazy_layout, args.memory_map)
+
+        start_time = time.time()
+        all_converted = runner.run(args.manifest)
+        args.manifest.close()
+
+        print >>sys.stderr, "Converted %i documents in %.1f s, %i documents failed, %i jobs failed" % (
+            runner.document_count - runner.failed_document_count, time.time() - start_time,
+            runner.failed_document_count, runner.failed_job_count)
+
+        return 0 if all_converted else 1
+
+    def parse_batch_commandline(self, argv):
+        help_description = '''Converts jobs on many documents in a pool of worker processes. The documents \
+and their jobs are listed in a manifest with a JSON object on each line:
+    {"document": "/path/to/file.pdf", "jobs": [job, ...]}
+
+The jobs are those of the "serve" subcommand (see "serve --help").
+
+The results of each manifest line are written to the output directory to a file named by the line number \
+(e.g. 000042.json); summary.jsonl lists all documents in the manifest order. A document that can't be \
+converted doesn't stop the batch, but the exit code is then 1.
+'''
+        parser = argparse.ArgumentParser(prog="%s batch" % os.path.basename(sys.argv[0]),
+                                         description=help_description, formatter_class=ParagraphFormatter)
+
+        parser.add_argument("-o", "--output-dir", required=True, help="The directory to write the results to.")
+
+        parser.add_argument("-j", "--workers", type=int, help="Number of worker processes. Defaults to the number of CPUs.")
+
+        parser.add_argument("--split-pages", type=int, default=100,
+                            help="Documents with more pages than this are parsed by several workers. "
+                                 "0 means the documents are never split.")
+
+        parser.add_argument("--lazy-layout", action="store_true",
+                            help="Postpone the layout analysis of the pages until a job needs it.")
+
+        parser.add_argument("--memory-map", action="store_true",
+                            help="Memory-map the documents instead of reading them in small chunks.")
+
+        parser.add_argument("--cache-dir",
+                            help="A directory for caching the parsed document pages.")
+
+        parser.add_argument("--cache-size", type=int,
+                            help="Maximum size of the cache directory in bytes.")
+
+        parser.add_argument("manifest", type=argparse.FileType(mode='r'),
+                            help="The manifest. Can be stdin (specify '-' (just a dash) as the filename).")
+
+        return parser.parse_args(argv)
+
+    # Process the search subcommand.
+    def execute_search(self, argv):
+        args = self.parse_search_commandline(argv)
+
+        cache = PDFLocCache(args.cache_dir, args.cache_size) if args.cache_dir is not None else None
+
+        converter = PDFLocConverter(args.filename, cache=cache, memory_map=args.memory_map)
+        converter.parse_document(workers=args.workers)
+
+        writer = None
+        if args.output is not None:
+            output = file(args.output, 'wb')
+            writer = PDFLocAnnotationWriter(args.filename.name, output)
+
+        match_count = 0
+        for query in args.queries:
+            try:
+                matches = converter.search(query, args.ignore_case, args.hash)
+            except ValueError as e:
+                print >>sys.stderr, "Error searching for '%s'. Cause: %s" % (query, str(e))
+                continue
+
+            for (pdfloc_pair, bboxes) in matches:
+                # the lines can be used as pdfloc jobs with the query as the comment
+                print "%s;%s %s" % (str(pdfloc_pair.start), str(pdfloc_pair.end), query)
+                if writer is not None:
+                    writer.add_highlight(PDFLocBoundingBoxes(bboxes, comment=query))
+            match_count += len(matches)
+
+        if writer is not None:
+            writer.close()
+            output.close()
+
+        converter.close()
+
+        return 0 if match_count > 0 else 1
+
+    def parse_search_commandline(self, argv):
+        help_description = '''Finds all occurrences of the given texts in a PDF file and prints the pdfloc \
+pair of each of them (in the format of the pdfloc jobs, with the searched text as the comment).
+
+Whitespace in the texts matches any whitespace in the document, including line and page breaks.
+
+The exit code is 1 if no occurrence has been found.
+'''
+        parser = argparse.ArgumentParser(prog="%s search" % os.path.basename(sys.argv[0]),
+                                         description=help_description, formatter_class=ParagraphFormatter)
+
+        parser.add_argument("-i", "--ignore-case", action="store_true", help="Ignore the letter case.")
+
+        parser.add_argument("--hash", default="0000", help="The document hash to put in the printed pdflocs.")
+
+        parser.add_argument("-o", "--output",
+                            help="Also write the document with the found occurrences highlighted to this file.")
+
+        parser.add_argument("-j", "--workers", type=int,
+                            help="Parse the document pages in parallel using this many processes.")
+
+        parser.add_argument("--memory-map", action="store_true",
+                            help="Memory-map the document instead of reading it in small chunks. "
+                                 "The document has to be a regular file, not stdin.")
+
+        parser.add_argument("--cache-dir",
+                            help="A directory for caching the parsed document pages.")
+
+        parser.add_argument("--cache-size", type=int,
+                            help="Maximum size of the cache directory in bytes.")
+
+        parser.add_argument("filename", type=argparse.FileType(mode='rb'),
+                            help="The file to search in.")
+
+        parser.add_argument("queries", nargs="+", help="The texts to look for.")
+
+        return parser.parse_args(argv)
+
     def parse_commandline(self, argv):
         help_description = '''Performs conversions between #pdfloc(...) and\
 bounding box PDF area specifiers. First, a PDF file is needed, which is parsed and prepared for\
@@ -221,6 +451,11 @@ The format of bounding boxes job is:
     You can separate bounding boxes using newline instead of semicolon.
     In such case, everything up to the next empty line is considered a part of this job.
     It is sufficient to provide only the first and last bounding box from the set covering the whole area.
+
+To only check that pdflocs point to text in the file, run the "validate" subcommand (see "validate --help").
+To run a conversion server keeping the parsed documents in memory, run the "serve" subcommand.
+To convert jobs on many documents at once, run the "batch" subcommand.
+To find the pdflocs of all occurrences of a text, run the "search" subcommand.
 '''
         parser = argparse.ArgumentParser(description=help_description, formatter_class=ParagraphFormatter)
 
@@ -228,6 +463,38 @@ The format of bounding boxes job is:
                             help="A file containing the conversion jobs to be done. "
                                  "Can be stdin (specify '-' (just a dash) as the filename).")
 
+        parser.add_argument("--cache-dir",
+                            help="A directory for caching the parsed document pages. Repeated conversions "
+                                 "on the same document then don't need to parse the cached pages again.")
+
+        parser.add_argument("--cache-size", type=int,
+                            help="Maximum size of the cache directory in bytes. The least recently used "
+                                 "cached pages are removed when the size is exceeded.")
+
+        parser.add_argument("-j", "--workers", type=int,
+                            help="Parse the document pages in parallel using this many processes. "
+                                 "With a jobs file, this parses the whole document in advance.")
+
+        parser.add_argument("--stream", action="store_true",
+                            help="Write the result of each job to stdout as soon as it is computed instead "
+                                 "of writing a PDF update with the annotations after all jobs are done.")
+
+        parser.add_argument("-o", "--output",
+                            help="Write the document with the highlight annotations to this file. If not "
+                                 "given, only the incremental update is written to stdout; it is meant to be "
+                                 "appended to the document.")
+
+        parser.add_argument("--memory-map", action="store_true",
+                            help="Memory-map the document instead of reading it in small chunks. "
+                                 "The document has to be a regular file, not stdin.")
+
+        parser.add_argument("--stats", action="store_true",
+                            help="Write a report of the time spent in the parsing phases and the conversions to stderr.")
+
+        parser.add_argument("--max-pages", type=int,
+                            help="When reading jobs from a jobs file, the pages are parsed when a job first "
+                                 "needs them. This is the maximum number of parsed pages kept in memory.")
+
         parser.add_argument("filename", type=argparse.FileType(mode='rb'),
                             help="The file to do conversions within.")
 